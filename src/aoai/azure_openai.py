@@ -1,13 +1,42 @@
 """
 `azure_openai.py` is a module for managing interactions with the Azure OpenAI API within our application.
 """
+import asyncio
+import base64
 import os
-from typing import Dict, List, Optional
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import (
+    Any,
+    Awaitable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 import openai
+import tiktoken
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
 
+from src.aoai.conversation_memory import ConversationMemory
+from src.aoai.deployment_pool import DeploymentPool
+from src.cache.embedding_store import EmbeddingStore
+from src.cache.response_cache import ResponseCache
+from src.resilience import (
+    STREAM_INTERRUPTED_MESSAGE,
+    ResiliencePolicy,
+    get_default_policy,
+)
 from utils.ml_logging import get_logger
 
 # Load environment variables from .env file
@@ -16,6 +45,41 @@ load_dotenv()
 # Set up logger
 logger = get_logger()
 
+# Input limits of the embeddings API: inputs per request and tokens per input
+EMBEDDING_MAX_INPUTS = 2048
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+
+@lru_cache(maxsize=None)
+def _get_embedding_encoding(encoding_name: str = "cl100k_base"):
+    """
+    Returns the tiktoken encoding used to size embedding batches, or None if it cannot be loaded.
+    """
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(
+            f"Could not load the {encoding_name} encoding, estimating tokens from characters: {e}"
+        )
+        return None
+
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> Tuple[str, int]:
+    """
+    Truncates a text to at most `max_tokens` tokens.
+
+    :return: The (possibly truncated) text and its token count. Without an encoding, the count is estimated as
+        one token per four characters.
+    """
+    encoding = _get_embedding_encoding()
+    if encoding is None:
+        text = text[: max_tokens * 4]
+        return text, len(text) // 4 + 1
+    tokens = encoding.encode(text)
+    if len(tokens) > max_tokens:
+        return encoding.decode(tokens[:max_tokens]), max_tokens
+    return text, len(tokens)
+
 
 class AzureOpenAIManager:
     """
@@ -33,6 +97,11 @@ class AzureOpenAIManager:
         completion_model_name: Optional[str] = None,
         chat_model_name: Optional[str] = None,
         embedding_model_name: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        max_concurrency: int = 16,
+        embedding_store: Optional[EmbeddingStore] = None,
+        resilience: Optional[ResiliencePolicy] = None,
+        deployment_pool: Optional[DeploymentPool] = None,
     ):
         """
         Initializes the Azure OpenAI Manager with necessary configurations.
@@ -43,7 +112,23 @@ class AzureOpenAIManager:
         :param completion_model_name: The Completion Model Deployment ID. If not provided, it will be fetched from the environment variable "AZURE_AOAI_COMPLETION_MODEL_DEPLOYMENT_ID".
         :param chat_model_name: The Chat Model Name. If not provided, it will be fetched from the environment variable "AZURE_AOAI_CHAT_MODEL_NAME".
         :param embedding_model_name: The Embedding Model Deployment ID. If not provided, it will be fetched from the environment variable "AZURE_AOAI_EMBEDDING_DEPLOYMENT_ID".
+        :param cache: Optional response cache. Completion and chat requests identical to a previous one
+            (same deployment, messages and sampling parameters) are then answered from the cache.
+        :param max_concurrency: Maximum number of requests in flight at once across the async methods
+            (`agenerate_*`) of this manager, per event loop. Defaults to 16.
+        :param embedding_store: Optional persistent embedding store. Texts already embedded with the same
+            model are then served from the store, and new embeddings are added to it.
+        :param resilience: Retry, backoff and circuit breaker policy of the API calls. Defaults to the policy
+            shared by the process (`get_default_policy`).
+        :param deployment_pool: Optional pool of endpoints and deployments. Requests are then spread over its members,
+            which fail over to each other, and the endpoint and key default to those of its first member.
         """
+        self.deployment_pool = deployment_pool
+        if deployment_pool is not None:
+            api_key = api_key or deployment_pool.members[0]["api_key"]
+            azure_endpoint = (
+                azure_endpoint or deployment_pool.members[0]["azure_endpoint"]
+            )
         self.api_key = api_key or os.getenv("AZURE_AOAI_KEY")
         self.api_version = (
             api_version or os.getenv("AZURE_AOAI_API_VERSION") or "2023-05-15"
@@ -58,11 +143,23 @@ class AzureOpenAIManager:
         self.embedding_model_name = embedding_model_name or os.getenv(
             "AZURE_AOAI_EMBEDDING_DEPLOYMENT_ID"
         )
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.embedding_store = embedding_store
+        self.resilience = resilience or get_default_policy()
+        self.last_stream_stats: Optional[Dict] = None
+        # Async clients and semaphores are bound to the event loop they are first used in
+        self._async_resources: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._async_lock = threading.Lock()
 
+        # Retries are handled by the resilience policy, which also honors the rate limit headers
         self.openai_client = AzureOpenAI(
             api_key=self.api_key,
             api_version=self.api_version,
             azure_endpoint=self.azure_endpoint,
+            max_retries=0,
         )
 
         self._validate_api_configurations()
@@ -98,6 +195,23 @@ class AzureOpenAIManager:
                 "One or more OpenAI API setup variables are empty. Please review your environment variables and `SETTINGS.md`"
             )
 
+    def _cache_key(self, operation: str, request: Dict) -> Optional[str]:
+        """
+        Returns the response cache key of a request, or None if caching is disabled.
+
+        :param operation: The API operation, e.g. "chat.completions".
+        :param request: The keyword arguments of the API call, including the deployment name.
+        :return: The cache key or None.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.make_key(
+            endpoint=self.azure_endpoint,
+            api_version=self.api_version,
+            operation=operation,
+            request=request,
+        )
+
     def generate_completion_response(
         self,
         query: str,
@@ -119,7 +233,7 @@ class AzureOpenAIManager:
         :return: The generated text or None if an error occurs.
         """
         try:
-            response = self.openai_client.completions.create(
+            request = dict(
                 model=model_name or self.completion_model_name,
                 prompt=query,
                 temperature=temperature,
@@ -127,9 +241,20 @@ class AzureOpenAIManager:
                 top_p=top_p,
                 **kwargs,
             )
+            cache_key = self._cache_key("completions", request)
+            if cache_key is not None and self.cache is not None:
+                completion = self.cache.get(cache_key)
+                if completion is not None:
+                    logger.info("Completion served from cache.")
+                    return completion
+
+            response = self._call("completions", request)
 
             completion = response.choices[0].text.strip()
             logger.info(f"Generated completion: {completion}")
+
+            if cache_key is not None and self.cache is not None:
+                self.cache.set(cache_key, completion)
             return completion
 
         except openai.APIConnectionError as e:
@@ -157,8 +282,11 @@ class AzureOpenAIManager:
         max_tokens: int = 150,
         seed: int = 42,
         top_p: float = 1.0,
+        stream: bool = False,
+        include_usage: bool = False,
+        memory: Optional[ConversationMemory] = None,
         **kwargs,
-    ) -> Optional[str]:
+    ) -> Union[Optional[str], Iterator[str]]:
         """
         Generates a text response considering the conversation history.
 
@@ -169,34 +297,56 @@ class AzureOpenAIManager:
         :param max_tokens: Maximum number of tokens to generate. Defaults to 150.
         :param seed: Random seed for deterministic output. Defaults to 42.
         :param top_p: The cumulative probability cutoff for token selection. Defaults to 1.0.
+        :param stream: If True, return an iterator over the response deltas as they arrive. The conversation
+            history is updated once the iterator is exhausted. Defaults to False.
+        :param include_usage: With `stream=True`, ask the service to report token usage at the end of the stream
+            (requires API version 2024-09-01 or later). Defaults to False.
+        :param memory: Optional conversation memory. The request then holds the system message, a rolling
+            summary and the recent turns that fit in its token budget, instead of the whole history.
 
-        :return: The generated text response or None if an error occurs.
+        :return: The generated text response or None if an error occurs. With `stream=True`, an iterator over the
+            response deltas; `last_stream_stats` holds the time to first token and usage once it is consumed.
         """
         try:
-            system_message = {"role": "system", "content": system_message_content}
-            if not conversation_history or conversation_history[0] != system_message:
-                conversation_history.insert(0, system_message)
-
-            messages_for_api = conversation_history + [
-                {"role": "user", "content": query}
-            ]
-            logger.info(f"Sending request to OpenAI with query: {query}")
-
-            response = self.openai_client.chat.completions.create(
-                model=self.chat_model_name,
-                messages=messages_for_api,
+            request = self._build_chat_request(
+                conversation_history,
+                query,
+                system_message_content,
+                memory=memory,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 seed=seed,
                 top_p=top_p,
                 **kwargs,
             )
+            cache_key = self._cache_key("chat.completions", request)
 
-            response_content = response.choices[0].message.content
-            logger.info(f"Received response from OpenAI: {response_content}")
+            if stream:
+                if include_usage:
+                    request["stream_options"] = {"include_usage": True}
+                return self._stream_chat_response(
+                    request, cache_key, conversation_history, query
+                )
 
-            conversation_history.append({"role": "user", "content": query})
-            conversation_history.append({"role": "system", "content": response_content})
+            response_content = (
+                self.cache.get(cache_key)
+                if cache_key is not None and self.cache is not None
+                else None
+            )
+
+            if response_content is not None:
+                logger.info("Chat response served from cache.")
+            else:
+                logger.info(f"Sending request to OpenAI with query: {query}")
+                response = self._call("chat.completions", request)
+
+                response_content = response.choices[0].message.content
+                logger.info(f"Received response from OpenAI: {response_content}")
+
+                if cache_key is not None and self.cache is not None:
+                    self.cache.set(cache_key, response_content)
+
+            self._record_turn(conversation_history, query, response_content)
 
             return response_content
 
@@ -216,6 +366,280 @@ class AzureOpenAIManager:
             logger.error(f"Contextual response generation error: {e}")
             return None
 
+    def _stream_chat_response(
+        self,
+        request: Dict,
+        cache_key: Optional[str],
+        conversation_history: List[Dict[str, str]],
+        query: str,
+    ) -> Iterator[str]:
+        """
+        Streams a chat completion and yields its content deltas as they arrive.
+
+        Once the stream is exhausted, the query and response are appended to the conversation history and
+        `self.last_stream_stats` holds the time to first token, the total time, the number of chunks and the
+        token usage when the service reports it. If the request fails or the stream is cut off, it ends with
+        `STREAM_INTERRUPTED_MESSAGE` and `last_stream_stats["error"]` holds the error; the conversation history
+        is then left unchanged.
+
+        :param request: The keyword arguments of the chat completions call.
+        :param cache_key: The response cache key, or None if caching is disabled.
+        :param conversation_history: The conversation history to update.
+        :param query: The latest query.
+        :return: An iterator over the response deltas.
+        """
+        stats: Dict[str, Any] = {
+            "time_to_first_token": None,
+            "total_time": None,
+            "chunks": 0,
+            "usage": None,
+            "completed": False,
+            "error": None,
+        }
+        self.last_stream_stats = stats
+        start = time.perf_counter()
+        parts = []
+
+        try:
+            cached = (
+                self.cache.get(cache_key)
+                if cache_key is not None and self.cache is not None
+                else None
+            )
+            if cached is not None:
+                logger.info("Chat response served from cache.")
+                stats.update(time_to_first_token=0.0, chunks=1, completed=True)
+                parts.append(cached)
+                yield cached
+            else:
+                logger.info(f"Sending streaming request to OpenAI with query: {query}")
+                # Only opening the stream is retried; a stream cut midway is not replayed
+                response = self._call("chat.completions", dict(request, stream=True))
+                for chunk in response:
+                    if chunk.usage is not None:
+                        stats["usage"] = chunk.usage.model_dump()
+                    if not chunk.choices:
+                        continue
+                    if chunk.choices[0].finish_reason:
+                        stats["completed"] = True
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if stats["time_to_first_token"] is None:
+                            stats["time_to_first_token"] = time.perf_counter() - start
+                        stats["chunks"] += 1
+                        parts.append(delta)
+                        yield delta
+        except openai.APIConnectionError as e:
+            logger.error("The server could not be reached")
+            logger.error(e.__cause__)
+            stats["error"] = str(e)
+        except openai.RateLimitError as e:
+            logger.error("A 429 status code was received; we should back off a bit.")
+            stats["error"] = str(e)
+        except openai.APIStatusError as e:
+            logger.error("Another non-200-range status code was received")
+            logger.error(e.status_code)
+            logger.error(e.response)
+            stats["error"] = str(e)
+        except Exception as e:
+            logger.error(f"Contextual response generation error: {e}")
+            stats["error"] = str(e)
+        if stats["error"] is None and not stats["completed"]:
+            logger.warning("Stream ended before its last chunk.")
+            stats["error"] = "The stream ended before its last chunk."
+        if stats["error"] is not None:
+            # The turn is not recorded, and the reader is told the response is incomplete
+            yield STREAM_INTERRUPTED_MESSAGE
+            return
+
+        stats["total_time"] = time.perf_counter() - start
+        response_content = "".join(parts)
+        logger.info(
+            f"Stream finished: first token after {stats['time_to_first_token']}s, "
+            f"{stats['chunks']} chunks in {stats['total_time']:.2f}s."
+        )
+        if cache_key is not None and self.cache is not None and cached is None:
+            self.cache.set(cache_key, response_content)
+
+        self._record_turn(conversation_history, query, response_content)
+
+    def _build_chat_request(
+        self,
+        conversation_history: List[Dict[str, str]],
+        query: str,
+        system_message_content: str,
+        memory: Optional[ConversationMemory] = None,
+        **kwargs,
+    ) -> Dict:
+        """
+        Builds the keyword arguments of a chat completions call, adding the system message to the history if needed.
+
+        :param conversation_history: The conversation history. The system message is inserted at its start.
+        :param query: The latest query.
+        :param system_message_content: The content of the system message.
+        :param memory: Optional conversation memory selecting the messages sent.
+        :param kwargs: Sampling and other parameters of the call.
+        :return: The keyword arguments of the chat completions call.
+        """
+        self._insert_system_message(conversation_history, system_message_content)
+
+        if memory is not None:
+            messages_for_api = memory.select(conversation_history, query)
+        else:
+            messages_for_api = conversation_history + [
+                {"role": "user", "content": query}
+            ]
+        return dict(model=self.chat_model_name, messages=messages_for_api, **kwargs)
+
+    async def _abuild_chat_request(
+        self,
+        conversation_history: List[Dict[str, str]],
+        query: str,
+        system_message_content: str,
+        memory: Optional[ConversationMemory] = None,
+        **kwargs,
+    ) -> Dict:
+        """
+        Asynchronous variant of `_build_chat_request`, which summarizes old turns without blocking the event loop.
+        """
+        if memory is None:
+            return self._build_chat_request(
+                conversation_history, query, system_message_content, **kwargs
+            )
+        self._insert_system_message(conversation_history, system_message_content)
+        messages_for_api = await memory.aselect(conversation_history, query)
+        return dict(model=self.chat_model_name, messages=messages_for_api, **kwargs)
+
+    @staticmethod
+    def _insert_system_message(
+        conversation_history: List[Dict[str, str]], system_message_content: str
+    ) -> None:
+        """
+        Inserts the system message at the start of the conversation history, unless it is already there.
+        """
+        system_message = {"role": "system", "content": system_message_content}
+        if not conversation_history or conversation_history[0] != system_message:
+            conversation_history.insert(0, system_message)
+
+    @staticmethod
+    def _record_turn(
+        conversation_history: List[Dict[str, str]], query: str, response_content: str
+    ) -> None:
+        """
+        Appends a query and its response to the conversation history.
+        """
+        conversation_history.append({"role": "user", "content": query})
+        conversation_history.append({"role": "assistant", "content": response_content})
+
+    def summarize_conversation(
+        self,
+        messages: List[Dict[str, str]],
+        previous_summary: Optional[str] = None,
+        max_tokens: int = 300,
+    ) -> Optional[str]:
+        """
+        Summarizes conversation turns, extending a previous summary.
+
+        Used by `ConversationMemory` to fold turns leaving its window into a rolling summary.
+
+        :param messages: The turns to summarize.
+        :param previous_summary: The summary of the turns before them, if any.
+        :param max_tokens: Maximum number of tokens of the summary. Defaults to 300.
+        :return: The new summary, or None if an error occurs.
+        """
+        try:
+            response = self._call(
+                "chat.completions",
+                self._build_summary_request(messages, previous_summary, max_tokens),
+            )
+            return response.choices[0].message.content
+
+        except Exception as e:
+            self._log_api_error(e, "Conversation summary error")
+            return None
+
+    async def asummarize_conversation(
+        self,
+        messages: List[Dict[str, str]],
+        previous_summary: Optional[str] = None,
+        max_tokens: int = 300,
+    ) -> Optional[str]:
+        """
+        Asynchronous variant of `summarize_conversation`, used by `ConversationMemory.aselect`.
+
+        :return: The new summary, or None if an error occurs.
+        """
+        try:
+            response = await self._acall(
+                "chat.completions",
+                self._build_summary_request(messages, previous_summary, max_tokens),
+            )
+            return response.choices[0].message.content
+
+        except Exception as e:
+            self._log_api_error(e, "Conversation summary error")
+            return None
+
+    def _build_summary_request(
+        self,
+        messages: List[Dict[str, str]],
+        previous_summary: Optional[str],
+        max_tokens: int,
+    ) -> Dict:
+        """
+        Builds the keyword arguments of the chat completions call summarizing conversation turns.
+        """
+        transcript = "\n".join(
+            f"{message['role']}: {message.get('content') or ''}" for message in messages
+        )
+        instruction = (
+            "Update the summary of a conversation with its next turns. Keep facts, names, numbers, "
+            "decisions and open questions; drop pleasantries. Answer with the summary only."
+        )
+        content = f"Summary so far: {previous_summary or '(none)'}\n\nNext turns:\n{transcript}"
+        return dict(
+            model=self.chat_model_name,
+            messages=[
+                {"role": "system", "content": instruction},
+                {"role": "user", "content": content},
+            ],
+            temperature=0,
+            max_tokens=max_tokens,
+        )
+
+    def create_conversation_memory(
+        self,
+        max_tokens: int = 3000,
+        summarize: bool = True,
+        summary_max_tokens: int = 300,
+        **kwargs,
+    ) -> ConversationMemory:
+        """
+        Creates a conversation memory for one conversation, summarizing old turns with the chat model.
+
+        :param max_tokens: Token budget of the prompt. Defaults to 3000.
+        :param summarize: Whether turns leaving the window are summarized rather than dropped. Defaults to True.
+        :param summary_max_tokens: Maximum number of tokens of the summary. Defaults to 300.
+        :param kwargs: Other parameters of `ConversationMemory`.
+        :return: The conversation memory, to pass to `generate_chat_response` (or `agenerate_chat_response`)
+            with every turn.
+        """
+        return ConversationMemory(
+            max_tokens=max_tokens,
+            summarize_function=(
+                partial(self.summarize_conversation, max_tokens=summary_max_tokens)
+                if summarize
+                else None
+            ),
+            asummarize_function=(
+                partial(self.asummarize_conversation, max_tokens=summary_max_tokens)
+                if summarize
+                else None
+            ),
+            summary_max_tokens=summary_max_tokens,
+            **kwargs,
+        )
+
     def generate_embedding(
         self, input_text: str, model_name: Optional[str] = None, **kwargs
     ) -> Optional[str]:
@@ -229,14 +653,26 @@ class AzureOpenAIManager:
         :raises Exception: If an error occurs while making the API request.
         """
         try:
-            response = self.openai_client.embeddings.create(
-                input=input_text,
-                model=model_name or self.embedding_model_name,
-                **kwargs,
+            store_model = self._embedding_store_model(model_name, kwargs)
+            if self.embedding_store is not None:
+                stored = self.embedding_store.get(input_text, store_model)
+                if stored is not None:
+                    logger.debug("Embedding served from the embedding store.")
+                    return stored.tolist()
+
+            response = self._call(
+                "embeddings",
+                dict(
+                    input=input_text,
+                    model=model_name or self.embedding_model_name,
+                    **kwargs,
+                ),
             )
 
             embedding = response.data[0].embedding
             logger.debug(f"Created embedding: {response.model_dump_json(indent=2)}")
+            if self.embedding_store is not None:
+                self.embedding_store.put(input_text, embedding, store_model)
             return embedding
 
         except openai.APIConnectionError as e:
@@ -254,3 +690,513 @@ class AzureOpenAIManager:
         except Exception as e:
             logger.error(f"OpenAI API error: {e}")
             return None
+
+    @staticmethod
+    def _plan_embedding_batches(
+        texts: Sequence[str], batch_size: int, max_tokens_per_batch: int
+    ) -> List[Tuple[List[int], List[str]]]:
+        """
+        Packs texts into embedding requests that respect the input limits of the API.
+
+        Texts longer than EMBEDDING_MAX_INPUT_TOKENS are truncated, and empty texts are sent as a single space
+        since the API rejects empty inputs.
+
+        :param texts: The texts to embed.
+        :param batch_size: Maximum number of texts per request (capped at EMBEDDING_MAX_INPUTS).
+        :param max_tokens_per_batch: Maximum number of tokens per request.
+        :return: A list of batches, each holding the positions of its texts in `texts` and the texts to send.
+        """
+        batch_size = max(1, min(batch_size, EMBEDDING_MAX_INPUTS))
+        batches = []
+        indices: List[int] = []
+        inputs: List[str] = []
+        batch_tokens = 0
+        for index, text in enumerate(texts):
+            text, tokens = _truncate_to_tokens(
+                text or " ", min(EMBEDDING_MAX_INPUT_TOKENS, max_tokens_per_batch)
+            )
+            if inputs and (
+                len(inputs) >= batch_size
+                or batch_tokens + tokens > max_tokens_per_batch
+            ):
+                batches.append((indices, inputs))
+                indices, inputs, batch_tokens = [], [], 0
+            indices.append(index)
+            inputs.append(text)
+            batch_tokens += tokens
+        if inputs:
+            batches.append((indices, inputs))
+        return batches
+
+    @staticmethod
+    def _embedding_rows(response) -> np.ndarray:
+        """
+        Converts an embeddings response into a float32 matrix, one row per input in request order.
+        """
+        data = sorted(response.data, key=lambda item: item.index)
+        if data and isinstance(data[0].embedding, str):
+            # Base64 payloads are decoded straight into the matrix, without Python float lists
+            return np.stack(
+                [
+                    np.frombuffer(base64.b64decode(item.embedding), dtype="<f4")
+                    for item in data
+                ]
+            ).astype(np.float32, copy=False)
+        return np.asarray([item.embedding for item in data], dtype=np.float32)
+
+    @staticmethod
+    def _assemble_embeddings(
+        total: int, batches: List[Tuple[List[int], List[str]]], rows: List[np.ndarray]
+    ) -> np.ndarray:
+        """
+        Writes the embeddings of every batch into one contiguous matrix, in the order of the original texts.
+        """
+        dimensions = rows[0].shape[1] if rows else 0
+        matrix = np.empty((total, dimensions), dtype=np.float32)
+        for (indices, _), batch_rows in zip(batches, rows):
+            matrix[indices] = batch_rows
+        return matrix
+
+    def _embedding_store_model(self, model_name: Optional[str], kwargs: Dict) -> str:
+        """
+        Returns the model name under which embeddings are kept in the embedding store.
+
+        Requests for shortened embeddings (`dimensions`) are kept apart from full-size ones.
+        """
+        model = model_name or self.embedding_model_name or ""
+        if kwargs.get("dimensions"):
+            model = f"{model}:{kwargs['dimensions']}"
+        return model
+
+    def _stored_embeddings(
+        self, texts: Sequence[str], store_model: str
+    ) -> Tuple[Optional[np.ndarray], List[int]]:
+        """
+        Looks up texts in the embedding store.
+
+        :return: The matrix of stored embeddings (None if no text was found) and the positions of the texts
+            that still need to be embedded.
+        """
+        if self.embedding_store is None or not len(texts):
+            return None, list(range(len(texts)))
+        stored, found = self.embedding_store.get_many(texts, store_model)
+        missing = np.flatnonzero(~found).tolist()
+        return (stored if found.any() else None), missing
+
+    def _merge_stored_embeddings(
+        self,
+        stored: Optional[np.ndarray],
+        missing: List[int],
+        pending: List[str],
+        embedded: np.ndarray,
+        store_model: str,
+    ) -> np.ndarray:
+        """
+        Adds new embeddings to the embedding store and merges them with the stored ones, in input order.
+        """
+        if self.embedding_store is not None and pending:
+            self.embedding_store.put_many(pending, embedded, store_model)
+        if stored is None:
+            return embedded
+        if missing:
+            stored[missing] = embedded
+        return stored
+
+    def generate_embeddings(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 256,
+        max_tokens_per_batch: int = 100_000,
+        model_name: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        **kwargs,
+    ) -> Optional[np.ndarray]:
+        """
+        Generates embeddings for many texts, packing them into batched requests sent concurrently.
+
+        :param texts: The texts to embed.
+        :param batch_size: Maximum number of texts per request. Defaults to 256.
+        :param max_tokens_per_batch: Maximum number of tokens per request. Defaults to 100000.
+        :param model_name: The name of the model to use. If None, the default embedding model is used.
+        :param max_concurrency: Maximum number of requests in flight. Defaults to the manager's `max_concurrency`.
+        :param kwargs: Additional parameters for the API requests, e.g. `dimensions`.
+        :return: A contiguous float32 matrix with one row per text, in the order of `texts`, or None if a
+            request failed.
+        """
+        start = time.perf_counter()
+        store_model = self._embedding_store_model(model_name, kwargs)
+        stored, missing = self._stored_embeddings(texts, store_model)
+        pending = [texts[index] for index in missing]
+        batches = self._plan_embedding_batches(
+            pending, batch_size, max_tokens_per_batch
+        )
+        request = dict(
+            model=model_name or self.embedding_model_name,
+            encoding_format="base64",
+            **kwargs,
+        )
+
+        def embed(batch: Tuple[List[int], List[str]]) -> np.ndarray:
+            response = self._call("embeddings", dict(input=batch[1], **request))
+            return self._embedding_rows(response)
+
+        try:
+            workers = max(1, min(max_concurrency or self.max_concurrency, len(batches)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                rows = list(executor.map(embed, batches))
+        except Exception as e:
+            self._log_api_error(e, "OpenAI API error")
+            return None
+
+        matrix = self._merge_stored_embeddings(
+            stored,
+            missing,
+            pending,
+            self._assemble_embeddings(len(pending), batches, rows),
+            store_model,
+        )
+        logger.info(
+            f"Embedded {len(pending)} texts in {len(batches)} requests in {time.perf_counter() - start:.2f}s "
+            f"({len(texts) - len(pending)} served from the embedding store)."
+        )
+        return matrix
+
+    def _get_async_resources(self) -> Dict:
+        """
+        Returns the async client and the concurrency semaphore of the running event loop, creating them on first use.
+
+        :return: A dictionary with the keys `client` (AsyncAzureOpenAI) and `semaphore` (asyncio.Semaphore).
+        """
+        if self.azure_endpoint is None:
+            raise ValueError("The Azure OpenAI endpoint is not set.")
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            resources = self._async_resources.get(loop)
+            if resources is None:
+                resources = {
+                    "client": AsyncAzureOpenAI(
+                        api_key=self.api_key,
+                        api_version=self.api_version,
+                        azure_endpoint=self.azure_endpoint,
+                        max_retries=0,
+                    ),
+                    "semaphore": asyncio.Semaphore(self.max_concurrency),
+                }
+                self._async_resources[loop] = resources
+        return resources
+
+    def _endpoint_key(self, model: str) -> str:
+        """Returns the endpoint identifier of a deployment for the resilience policy."""
+        return f"{self.azure_endpoint}/{model}"
+
+    @staticmethod
+    def _operation(client: Any, operation: str) -> Any:
+        """Returns the resource of a client implementing an API operation, e.g. `client.chat.completions`."""
+        for name in operation.split("."):
+            client = getattr(client, name)
+        return client
+
+    def _call(self, operation: str, request: Dict) -> Any:
+        """
+        Calls an API operation of the client through the resilience policy, or through the deployment pool.
+
+        :param operation: The API operation, e.g. "chat.completions".
+        :param request: The keyword arguments of the API call.
+        :return: The API response.
+        """
+        pool = self.deployment_pool
+        if pool is not None:
+
+            def send(member: Dict, deployment: str) -> Any:
+                endpoint = self._operation(pool.get_client(member), operation)
+                return endpoint.with_raw_response.create(
+                    **dict(request, model=deployment)
+                )
+
+            return pool.call(
+                request["model"], send, hedge=not request.get("stream")
+            ).parse()
+
+        endpoint = self._operation(self.openai_client, operation)
+        return self.resilience.call(
+            self._endpoint_key(request["model"]), endpoint.create, **request
+        )
+
+    async def _acall(self, operation: str, request: Dict) -> Any:
+        """
+        Calls an API operation of the async client through the resilience policy (or the deployment pool),
+        waiting for a free slot of the concurrency semaphore.
+
+        :param operation: The API operation, e.g. "chat.completions".
+        :param request: The keyword arguments of the API call.
+        :return: The API response.
+        """
+        resources = self._get_async_resources()
+        pool = self.deployment_pool
+        if pool is not None:
+
+            async def send(member: Dict, deployment: str) -> Any:
+                endpoint = self._operation(pool.get_async_client(member), operation)
+                async with resources["semaphore"]:
+                    return await endpoint.with_raw_response.create(
+                        **dict(request, model=deployment)
+                    )
+
+            response = await pool.acall(
+                request["model"], send, hedge=not request.get("stream")
+            )
+            return response.parse()
+
+        endpoint = self._operation(resources["client"], operation)
+
+        async def attempt():
+            # The semaphore is only held while a request is in flight, not during backoff
+            async with resources["semaphore"]:
+                return await endpoint.create(**request)
+
+        return await self.resilience.acall(
+            self._endpoint_key(request["model"]), attempt
+        )
+
+    async def agenerate_completion_response(
+        self,
+        query: str,
+        temperature: float = 0.5,
+        max_tokens: int = 100,
+        model_name: Optional[str] = None,
+        top_p: float = 1.0,
+        **kwargs,
+    ) -> Optional[str]:
+        """
+        Asynchronous variant of `generate_completion_response`, limited by the manager's concurrency semaphore.
+
+        :return: The generated text or None if an error occurs.
+        """
+        try:
+            request = dict(
+                model=model_name or self.completion_model_name,
+                prompt=query,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                **kwargs,
+            )
+            cache_key = self._cache_key("completions", request)
+            if cache_key is not None and self.cache is not None:
+                completion = self.cache.get(cache_key)
+                if completion is not None:
+                    logger.info("Completion served from cache.")
+                    return completion
+
+            response = await self._acall("completions", request)
+
+            completion = response.choices[0].text.strip()
+            logger.info(f"Generated completion: {completion}")
+
+            if cache_key is not None and self.cache is not None:
+                self.cache.set(cache_key, completion)
+            return completion
+
+        except Exception as e:
+            self._log_api_error(e, "OpenAI API error")
+            return None
+
+    async def agenerate_chat_response(
+        self,
+        conversation_history: List[Dict[str, str]],
+        query: str,
+        system_message_content: str = (
+            "You are an AI assistant that helps people find information. "
+            "Please be precise, polite, and concise."
+        ),
+        temperature: float = 0.7,
+        max_tokens: int = 150,
+        seed: int = 42,
+        top_p: float = 1.0,
+        memory: Optional[ConversationMemory] = None,
+        **kwargs,
+    ) -> Optional[str]:
+        """
+        Asynchronous variant of `generate_chat_response`, limited by the manager's concurrency semaphore.
+
+        Concurrent calls must each use their own `conversation_history`, since it is updated in place.
+
+        :return: The generated text response or None if an error occurs.
+        """
+        try:
+            request = await self._abuild_chat_request(
+                conversation_history,
+                query,
+                system_message_content,
+                memory=memory,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                seed=seed,
+                top_p=top_p,
+                **kwargs,
+            )
+            cache_key = self._cache_key("chat.completions", request)
+            response_content = (
+                self.cache.get(cache_key)
+                if cache_key is not None and self.cache is not None
+                else None
+            )
+
+            if response_content is not None:
+                logger.info("Chat response served from cache.")
+            else:
+                logger.info(f"Sending async request to OpenAI with query: {query}")
+                response = await self._acall("chat.completions", request)
+
+                response_content = response.choices[0].message.content
+                logger.info(f"Received response from OpenAI: {response_content}")
+
+                if cache_key is not None and self.cache is not None:
+                    self.cache.set(cache_key, response_content)
+
+            self._record_turn(conversation_history, query, response_content)
+            return response_content
+
+        except Exception as e:
+            self._log_api_error(e, "Contextual response generation error")
+            return None
+
+    async def agenerate_embedding(
+        self, input_text: str, model_name: Optional[str] = None, **kwargs
+    ) -> Optional[List[float]]:
+        """
+        Asynchronous variant of `generate_embedding`, limited by the manager's concurrency semaphore.
+
+        :return: The embedding, or None if an error occurred.
+        """
+        try:
+            store_model = self._embedding_store_model(model_name, kwargs)
+            if self.embedding_store is not None:
+                stored = self.embedding_store.get(input_text, store_model)
+                if stored is not None:
+                    return stored.tolist()
+
+            response = await self._acall(
+                "embeddings",
+                dict(
+                    input=input_text,
+                    model=model_name or self.embedding_model_name,
+                    **kwargs,
+                ),
+            )
+            embedding = response.data[0].embedding
+            if self.embedding_store is not None:
+                self.embedding_store.put(input_text, embedding, store_model)
+            return embedding
+
+        except Exception as e:
+            self._log_api_error(e, "OpenAI API error")
+            return None
+
+    async def agenerate_embeddings(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 256,
+        max_tokens_per_batch: int = 100_000,
+        model_name: Optional[str] = None,
+        **kwargs,
+    ) -> Optional[np.ndarray]:
+        """
+        Asynchronous variant of `generate_embeddings`, limited by the manager's concurrency semaphore.
+
+        :return: A contiguous float32 matrix with one row per text, in the order of `texts`, or None if a
+            request failed.
+        """
+        start = time.perf_counter()
+        store_model = self._embedding_store_model(model_name, kwargs)
+        stored, missing = self._stored_embeddings(texts, store_model)
+        pending = [texts[index] for index in missing]
+        batches = self._plan_embedding_batches(
+            pending, batch_size, max_tokens_per_batch
+        )
+        request = dict(
+            model=model_name or self.embedding_model_name,
+            encoding_format="base64",
+            **kwargs,
+        )
+
+        async def embed(batch: Tuple[List[int], List[str]]) -> np.ndarray:
+            response = await self._acall("embeddings", dict(input=batch[1], **request))
+            return self._embedding_rows(response)
+
+        try:
+            rows = await asyncio.gather(*(embed(batch) for batch in batches))
+        except Exception as e:
+            self._log_api_error(e, "OpenAI API error")
+            return None
+
+        matrix = self._merge_stored_embeddings(
+            stored,
+            missing,
+            pending,
+            self._assemble_embeddings(len(pending), batches, rows),
+            store_model,
+        )
+        logger.info(
+            f"Embedded {len(pending)} texts in {len(batches)} requests in {time.perf_counter() - start:.2f}s "
+            f"({len(texts) - len(pending)} served from the embedding store)."
+        )
+        return matrix
+
+    async def gather(
+        self, calls: Iterable[Awaitable], return_exceptions: bool = True
+    ) -> List[Any]:
+        """
+        Runs many async calls of this manager concurrently and returns their results in order.
+
+        The calls share the manager's semaphore, so at most `max_concurrency` requests are in flight however
+        many calls are passed. From synchronous code, use e.g.
+        `asyncio.run(manager.gather(manager.agenerate_completion_response(q) for q in queries))`.
+
+        :param calls: The awaitables to run, e.g. `agenerate_chat_response(...)` coroutines.
+        :param return_exceptions: Whether exceptions are returned in place of results instead of raised.
+            Defaults to True.
+        :return: The results, in the order of `calls`.
+        """
+        start = time.perf_counter()
+        results = await asyncio.gather(*calls, return_exceptions=return_exceptions)
+        failed = sum(
+            1
+            for result in results
+            if result is None or isinstance(result, BaseException)
+        )
+        logger.info(
+            f"Gathered {len(results)} calls in {time.perf_counter() - start:.2f}s ({failed} failed)."
+        )
+        return results
+
+    async def aclose(self) -> None:
+        """
+        Closes the async clients of the running event loop.
+        """
+        with self._async_lock:
+            resources = self._async_resources.pop(asyncio.get_running_loop(), None)
+        if resources is not None:
+            await resources["client"].close()
+        if self.deployment_pool is not None:
+            await self.deployment_pool.aclose()
+
+    @staticmethod
+    def _log_api_error(error: Exception, message: str) -> None:
+        """
+        Logs an error raised by an API call.
+
+        :param error: The error.
+        :param message: Message logged for errors other than connection, rate limit and status errors.
+        """
+        if isinstance(error, openai.APIConnectionError):
+            logger.error("The server could not be reached")
+            logger.error(error.__cause__)
+        elif isinstance(error, openai.RateLimitError):
+            logger.error("A 429 status code was received; we should back off a bit.")
+        elif isinstance(error, openai.APIStatusError):
+            logger.error("Another non-200-range status code was received")
+            logger.error(error.status_code)
+            logger.error(error.response)
+        else:
+            logger.error(f"{message}: {error}")
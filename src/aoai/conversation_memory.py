@@ -0,0 +1,266 @@
+"""
+`conversation_memory.py` keeps chat requests within a token budget.
+
+The system message is always sent. The most recent turns are sent as long as they fit in the
+budget; when they do not, the oldest turns leave the window, and, if a summarizer is configured,
+they are folded into a rolling summary sent as a second system message. Windows slide in steps
+(down to `low_water` of the budget), so the summarizer runs every few turns rather than on every
+turn. Token counts are cached per message text, so a long history is not re-tokenized each turn.
+"""
+
+import asyncio
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import tiktoken
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Tokens added by the chat format around each message, and to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    """Returns the tiktoken encoding used to count tokens, or None if it cannot be loaded."""
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(
+            f"Could not load the {encoding_name} encoding, estimating tokens from characters: {e}"
+        )
+        return None
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """
+    Returns the number of tokens of a text. Results are cached, so repeated messages are tokenized once.
+
+    Without the encoding (e.g. offline), the count is estimated as one token per four characters.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+class ConversationMemory:
+    """
+    Selects the part of a conversation history sent with each chat request.
+
+    A memory follows one conversation: it remembers how many turns were folded into the summary.
+
+    Attributes:
+        max_tokens (int): Token budget of the prompt (system message, summary, history and query).
+        summarize_function (Optional[Callable]): Function called with the turns leaving the window and the
+            previous summary, returning the new summary. Without it, old turns are simply dropped.
+        asummarize_function (Optional[Callable]): Coroutine function used instead of `summarize_function` by
+            `aselect`. Without it, `aselect` runs `summarize_function` in a worker thread.
+        summary (Optional[str]): The current rolling summary.
+        tokens_saved (int): Total number of prompt tokens not sent thanks to the window, over all turns.
+        last_stats (Optional[Dict[str, int]]): Token counts of the last selection.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 3000,
+        summarize_function: Optional[
+            Callable[[List[Dict[str, str]], Optional[str]], Optional[str]]
+        ] = None,
+        summary_max_tokens: int = 300,
+        low_water: float = 0.6,
+        encoding_name: str = "cl100k_base",
+        asummarize_function: Optional[
+            Callable[[List[Dict[str, str]], Optional[str]], Awaitable[Optional[str]]]
+        ] = None,
+    ):
+        """
+        Initialize the conversation memory.
+
+        :param max_tokens: Token budget of the prompt. Defaults to 3000.
+        :param summarize_function: Optional summarizer of the turns leaving the window, e.g.
+            `AzureOpenAIManager.summarize_conversation`. Defaults to None (old turns are dropped).
+        :param summary_max_tokens: Tokens reserved in the budget for the summary. Defaults to 300.
+        :param low_water: Fraction of the history budget the window shrinks to when it overflows. Defaults to 0.6.
+        :param encoding_name: The tiktoken encoding used to count tokens. Defaults to "cl100k_base".
+        :param asummarize_function: Optional asynchronous summarizer used by `aselect`, e.g.
+            `AzureOpenAIManager.asummarize_conversation`. Defaults to None.
+        """
+        self.max_tokens = max_tokens
+        self.summarize_function = summarize_function
+        self.asummarize_function = asummarize_function
+        self.summary_max_tokens = summary_max_tokens
+        self.low_water = low_water
+        self.encoding_name = encoding_name
+        self.summary: Optional[str] = None
+        self.tokens_saved = 0
+        self.last_stats: Optional[Dict[str, int]] = None
+        # Number of history messages (after the system message) that left the window
+        self._forgotten = 0
+
+    def reset(self) -> None:
+        """Forgets the summary and the window position, e.g. when the conversation is cleared."""
+        self.summary = None
+        self._forgotten = 0
+
+    def message_tokens(self, message: Dict[str, str]) -> int:
+        """Returns the number of prompt tokens of a message."""
+        return (
+            count_tokens(message.get("content") or "", self.encoding_name)
+            + MESSAGE_OVERHEAD_TOKENS
+        )
+
+    def select(
+        self, conversation_history: List[Dict[str, str]], query: str
+    ) -> List[Dict[str, str]]:
+        """
+        Returns the messages to send for a query: the system message, the summary, the recent turns that fit in
+        the budget and the query.
+
+        :param conversation_history: The full conversation history, starting with the system message if any.
+        :param query: The latest query.
+        :return: The messages of the chat request.
+        """
+        self._fold(self._slide(conversation_history, query))
+        return self._assemble(conversation_history, query)
+
+    async def aselect(
+        self, conversation_history: List[Dict[str, str]], query: str
+    ) -> List[Dict[str, str]]:
+        """
+        Asynchronous variant of `select`, which summarizes turns leaving the window without blocking the event
+        loop.
+        """
+        await self._afold(self._slide(conversation_history, query))
+        return self._assemble(conversation_history, query)
+
+    @property
+    def summarizes(self) -> bool:
+        """Whether turns leaving the window are summarized rather than dropped."""
+        return (
+            self.summarize_function is not None or self.asummarize_function is not None
+        )
+
+    @staticmethod
+    def _split(
+        conversation_history: List[Dict[str, str]],
+    ) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """Splits a history into its system message (if any) and its turns."""
+        pinned = conversation_history[:1]
+        if pinned and pinned[0].get("role") != "system":
+            pinned = []
+        return pinned, conversation_history[len(pinned) :]
+
+    def _slide(
+        self, conversation_history: List[Dict[str, str]], query: str
+    ) -> List[Dict[str, str]]:
+        """
+        Slides the window past the oldest turns if the recent ones do not fit in the budget.
+
+        :return: The turns that left the window, to fold into the summary.
+        """
+        pinned, turns = self._split(conversation_history)
+        if self._forgotten > len(turns):
+            # The caller started a new conversation with the same memory
+            self.reset()
+
+        query_message = {"role": "user", "content": query}
+        fixed_tokens = (
+            sum(self.message_tokens(m) for m in pinned)
+            + self.message_tokens(query_message)
+            + REPLY_OVERHEAD_TOKENS
+        )
+        if self.summarizes:
+            fixed_tokens += self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+        budget = max(0, self.max_tokens - fixed_tokens)
+
+        window = turns[self._forgotten :]
+        window_tokens = [self.message_tokens(m) for m in window]
+        total = sum(window_tokens)
+        if total <= budget:
+            return []
+        # Slide the window down to the low-water mark, so that it does not slide again next turn
+        target = int(budget * self.low_water)
+        dropped = 0
+        while dropped < len(window) and (
+            total > target or window[dropped].get("role") != "user"
+        ):
+            total -= window_tokens[dropped]
+            dropped += 1
+        self._forgotten += dropped
+        return window[:dropped]
+
+    def _assemble(
+        self, conversation_history: List[Dict[str, str]], query: str
+    ) -> List[Dict[str, str]]:
+        """Returns the messages of the current window and records `last_stats`."""
+        pinned, turns = self._split(conversation_history)
+        window = turns[self._forgotten :]
+        query_message = {"role": "user", "content": query}
+
+        messages = list(pinned)
+        if self.summary:
+            messages.append(
+                {"role": "system", "content": SUMMARY_PREFIX + self.summary}
+            )
+        messages.extend(window)
+        messages.append(query_message)
+
+        history_tokens = sum(self.message_tokens(m) for m in conversation_history) + (
+            self.message_tokens(query_message) + REPLY_OVERHEAD_TOKENS
+        )
+        sent_tokens = (
+            sum(self.message_tokens(m) for m in messages) + REPLY_OVERHEAD_TOKENS
+        )
+        saved = max(0, history_tokens - sent_tokens)
+        self.tokens_saved += saved
+        self.last_stats = {
+            "history_tokens": history_tokens,
+            "sent_tokens": sent_tokens,
+            "saved_tokens": saved,
+            "window_messages": len(window),
+            "forgotten_messages": self._forgotten,
+        }
+        if saved:
+            logger.info(
+                f"Conversation memory sent {sent_tokens} of {history_tokens} tokens ({saved} saved)."
+            )
+        return messages
+
+    def _fold(self, messages: List[Dict[str, str]]) -> None:
+        """Folds turns leaving the window into the rolling summary, if a summarizer is configured."""
+        if not messages or self.summarize_function is None:
+            return
+        try:
+            summary = self.summarize_function(messages, self.summary)
+        except Exception as e:
+            logger.error(f"Failed to summarize the conversation: {e}")
+            return
+        if summary:
+            self.summary = summary
+
+    async def _afold(self, messages: List[Dict[str, str]]) -> None:
+        """Asynchronous variant of `_fold`."""
+        if not messages:
+            return
+        try:
+            if self.asummarize_function is not None:
+                summary = await self.asummarize_function(messages, self.summary)
+            elif self.summarize_function is not None:
+                summary = await asyncio.to_thread(
+                    self.summarize_function, messages, self.summary
+                )
+            else:
+                return
+        except Exception as e:
+            logger.error(f"Failed to summarize the conversation: {e}")
+            return
+        if summary:
+            self.summary = summary
@@ -0,0 +1,598 @@
+"""
+`deployment_pool.py` spreads requests over several Azure OpenAI endpoints and deployments.
+
+Each request is routed to the member with the fewest requests in flight (or the lowest expected
+latency), skipping members that are throttled, whose rate-limit headers report an exhausted quota,
+or whose circuit breaker is open. A request that fails with a throttling or server error fails over
+to the next member; once every member has failed, the resilience policy backs off and tries again.
+Optionally, a request still running after the usual latency of its member is hedged: a duplicate is
+sent to another member and the first response wins.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+from src.resilience import (
+    CircuitOpenError,
+    ResiliencePolicy,
+    classify_error,
+    get_default_policy,
+    retry_delay_from_headers,
+)
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+ROUTING_STRATEGIES = ("least_outstanding", "latency")
+
+# Seconds a throttled member is skipped when the service does not say how long to wait
+DEFAULT_THROTTLE_SECONDS = 1.0
+
+# Latency samples kept per member, and needed before the hedging delay follows them
+_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+
+
+class DeploymentPool:
+    """
+    Routes Azure OpenAI requests over several endpoints and deployments, with failover and hedging.
+
+    Members are dictionaries with the keys `azure_endpoint` and `api_key`, and optionally `api_version`,
+    `deployments` (a mapping of the deployment names used by the application to the names of the member,
+    for deployments named differently per region), `weight` (relative capacity, defaults to 1) and `name`.
+
+    Attributes:
+        members (List[Dict]): The members and their routing state.
+        strategy (str): "least_outstanding" or "latency".
+        hedge_after (Optional[float]): Minimum seconds before a request is hedged, or None to disable hedging.
+        hedge_percentile (float): Latency percentile of a member after which its requests are hedged.
+    """
+
+    def __init__(
+        self,
+        members: List[Dict[str, Any]],
+        strategy: str = "least_outstanding",
+        hedge_after: Optional[float] = None,
+        hedge_percentile: float = 95.0,
+        min_remaining_tokens: int = 1000,
+        limits_ttl: float = 60.0,
+        api_version: Optional[str] = None,
+        resilience: Optional[ResiliencePolicy] = None,
+        max_workers: int = 32,
+    ):
+        """
+        Initialize the pool.
+
+        :param members: The endpoints and deployments of the pool (see the class docstring).
+        :param strategy: "least_outstanding" routes to the member with the fewest requests in flight relative
+            to its weight; "latency" also weighs the average latency of the member. Defaults to "least_outstanding".
+        :param hedge_after: Minimum number of seconds before a request without response is duplicated to
+            another member. Defaults to None (no hedging). Hedged requests are billed twice.
+        :param hedge_percentile: Once a member has enough latency samples, its requests are hedged after this
+            percentile of its latencies (if later than `hedge_after`). Defaults to 95.
+        :param min_remaining_tokens: Members whose `x-ratelimit-remaining-tokens` is below this value are only
+            used when no other member is available. Defaults to 1000.
+        :param limits_ttl: Seconds the rate-limit headers of a member are trusted. Defaults to 60.
+        :param api_version: API version of the members that do not set one. Defaults to the environment
+            variable "AZURE_AOAI_API_VERSION" or "2023-05-15".
+        :param resilience: Circuit breakers and backoff of the pool. Defaults to the policy shared by the process.
+        :param max_workers: Threads available for hedged requests of the synchronous `call`. Defaults to 32.
+        :raises ValueError: If no member is given, a member lacks an endpoint or key, two members share a name,
+            or the strategy is unknown.
+        """
+        if not members:
+            raise ValueError("A deployment pool needs at least one member.")
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(
+                f"Unknown routing strategy {strategy!r}, expected one of {ROUTING_STRATEGIES}"
+            )
+        self.strategy = strategy
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_remaining_tokens = min_remaining_tokens
+        self.limits_ttl = limits_ttl
+        self.api_version = (
+            api_version or os.getenv("AZURE_AOAI_API_VERSION") or "2023-05-15"
+        )
+        self.resilience = resilience or get_default_policy()
+        self.max_workers = max_workers
+        self.members = [self._new_member(spec, i) for i, spec in enumerate(members)]
+        if len({m["name"] for m in self.members}) < len(self.members):
+            raise ValueError(
+                "Members of a deployment pool sharing an endpoint need distinct names."
+            )
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._clients: Dict[str, AzureOpenAI] = {}
+        # Async clients are bound to the event loop they are first used in
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    @classmethod
+    def from_env(
+        cls, variable: str = "AZURE_AOAI_DEPLOYMENT_POOL", **kwargs: Any
+    ) -> Optional["DeploymentPool"]:
+        """
+        Creates a pool from a JSON list of members in an environment variable.
+
+        Members may give the name of an environment variable holding their key as `api_key_env` rather than
+        the key itself.
+
+        :param variable: The environment variable. Defaults to "AZURE_AOAI_DEPLOYMENT_POOL".
+        :param kwargs: Additional keyword arguments of the pool.
+        :return: The pool, or None if the variable is not set.
+        """
+        value = os.getenv(variable)
+        if not value:
+            return None
+        members = json.loads(value)
+        for member in members:
+            if "api_key_env" in member:
+                member["api_key"] = os.getenv(member.pop("api_key_env"))
+        return cls(members, **kwargs)
+
+    @staticmethod
+    def _new_member(spec: Dict[str, Any], position: int) -> Dict[str, Any]:
+        """Returns a member with its routing state."""
+        if not spec.get("azure_endpoint") or not spec.get("api_key"):
+            raise ValueError(
+                f"Member {position} of the deployment pool needs an azure_endpoint and an api_key."
+            )
+        return {
+            "name": spec.get("name") or spec["azure_endpoint"],
+            "azure_endpoint": spec["azure_endpoint"].rstrip("/"),
+            "api_key": spec["api_key"],
+            "api_version": spec.get("api_version"),
+            "deployments": dict(spec.get("deployments") or {}),
+            "weight": float(spec.get("weight", 1.0)),
+            "outstanding": 0,
+            "latency": None,
+            "latencies": deque(maxlen=_LATENCY_WINDOW),
+            "remaining_requests": None,
+            "remaining_tokens": None,
+            "limits_updated": 0.0,
+            "throttled_until": 0.0,
+            "calls": 0,
+            "failures": 0,
+            "throttled": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    @staticmethod
+    def deployment(member: Dict[str, Any], model: str) -> str:
+        """Returns the name, on a member, of a deployment of the application."""
+        return member["deployments"].get(model, model)
+
+    def _member_key(self, member: Dict[str, Any], model: str) -> str:
+        """Returns the endpoint identifier of a deployment of a member for the resilience policy."""
+        return f"{member['azure_endpoint']}/{self.deployment(member, model)}"
+
+    def get_client(self, member: Dict[str, Any]) -> AzureOpenAI:
+        """Returns the OpenAI client of a member, creating it on first use."""
+        with self._lock:
+            client = self._clients.get(member["name"])
+            if client is None:
+                client = AzureOpenAI(
+                    api_key=member["api_key"],
+                    api_version=member["api_version"] or self.api_version,
+                    azure_endpoint=member["azure_endpoint"],
+                    max_retries=0,
+                )
+                self._clients[member["name"]] = client
+        return client
+
+    def get_async_client(self, member: Dict[str, Any]) -> AsyncAzureOpenAI:
+        """Returns the async OpenAI client of a member for the running event loop, creating it on first use."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(member["name"])
+            if client is None:
+                client = AsyncAzureOpenAI(
+                    api_key=member["api_key"],
+                    api_version=member["api_version"] or self.api_version,
+                    azure_endpoint=member["azure_endpoint"],
+                    max_retries=0,
+                )
+                clients[member["name"]] = client
+        return client
+
+    def _is_exhausted(self, member: Dict[str, Any], now: float) -> bool:
+        """Whether a member is throttled or reported an exhausted quota recently."""
+        if member["throttled_until"] > now:
+            return True
+        if now - member["limits_updated"] > self.limits_ttl:
+            return False
+        return member["remaining_requests"] == 0 or (
+            member["remaining_tokens"] is not None
+            and member["remaining_tokens"] < self.min_remaining_tokens
+        )
+
+    def _score(self, member: Dict[str, Any], default_latency: float) -> float:
+        """Returns the routing cost of a member; the cheapest member is chosen."""
+        if self.strategy == "latency":
+            return (
+                (member["outstanding"] + 1)
+                / member["weight"]
+                * (member["latency"] or default_latency)
+            )
+        return member["outstanding"] / member["weight"]
+
+    def _choose(self, model: str, exclude: Set[str]) -> Optional[Dict[str, Any]]:
+        """
+        Picks the member to send a request to, and counts the request as outstanding on it. The request must
+        then be sent with `_attempt` or `_aattempt`.
+
+        :param model: The deployment of the application.
+        :param exclude: Names of the members already tried.
+        :return: The member, or None if every member was tried or has an open circuit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            latencies = [m["latency"] for m in self.members if m["latency"]]
+            default_latency = float(np.mean(latencies)) if latencies else 1.0
+            ranked = sorted(
+                (m for m in self.members if m["name"] not in exclude),
+                key=lambda m: (
+                    self._is_exhausted(m, now),
+                    m["throttled_until"],
+                    self._score(m, default_latency),
+                    # Ties (e.g. sequential requests) rotate over the members by weight
+                    m["calls"] / m["weight"],
+                ),
+            )
+        for member in ranked:
+            breaker = self.resilience.circuit_breaker(self._member_key(member, model))
+            if breaker.state != breaker.OPEN and breaker.allow() == 0:
+                # The request counts as outstanding from now on, so that concurrent choices spread out
+                with self._lock:
+                    member["outstanding"] += 1
+                    member["calls"] += 1
+                return member
+        return None
+
+    def _record_limits(self, member: Dict[str, Any], headers: Any) -> None:
+        """Updates the remaining quota of a member from the rate-limit headers of a response."""
+        if not headers:
+            return
+        for header, field in (
+            ("x-ratelimit-remaining-requests", "remaining_requests"),
+            ("x-ratelimit-remaining-tokens", "remaining_tokens"),
+        ):
+            value = headers.get(header)
+            if value is not None:
+                try:
+                    member[field] = int(float(value))
+                    member["limits_updated"] = time.monotonic()
+                except ValueError:
+                    pass
+
+    def _succeeded(
+        self, member: Dict[str, Any], model: str, start: float, response: Any
+    ) -> None:
+        """Records a response of a member: its latency, rate-limit headers and circuit."""
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            member["outstanding"] -= 1
+            member["latencies"].append(elapsed)
+            member["latency"] = (
+                elapsed
+                if member["latency"] is None
+                else 0.8 * member["latency"] + 0.2 * elapsed
+            )
+            self._record_limits(member, getattr(response, "headers", None))
+        self.resilience.circuit_breaker(
+            self._member_key(member, model)
+        ).record_success()
+
+    def _failed(self, member: Dict[str, Any], model: str, error: Exception) -> None:
+        """Records a failed request of a member: its rate-limit headers, throttling and circuit."""
+        transient, status, headers = classify_error(error)
+        breaker = self.resilience.circuit_breaker(self._member_key(member, model))
+        with self._lock:
+            member["outstanding"] -= 1
+            member["failures"] += 1
+            self._record_limits(member, headers)
+            if status == 429:
+                member["throttled"] += 1
+                member["throttled_until"] = time.monotonic() + (
+                    retry_delay_from_headers(headers) or DEFAULT_THROTTLE_SECONDS
+                )
+        # Throttling says nothing about the health of the member, so it does not trip the breaker
+        if status != 429 and (transient or (status is not None and status >= 500)):
+            breaker.record_failure()
+        elif status is not None and status < 500:
+            breaker.record_success()
+        else:
+            # A 429, or an error without a status: a trial call must still be settled
+            breaker.abort_trial()
+        if transient:
+            logger.warning(
+                f"Request to {member['name']} failed ({status or type(error).__name__}); failing over."
+            )
+
+    def _hedge_delay(self, member: Dict[str, Any]) -> Optional[float]:
+        """Returns the seconds after which a request to a member is hedged, or None if hedging is disabled."""
+        if self.hedge_after is None or len(self.members) < 2:
+            return None
+        with self._lock:
+            latencies = list(member["latencies"])
+        if len(latencies) < _MIN_LATENCY_SAMPLES:
+            return self.hedge_after
+        return max(
+            self.hedge_after, float(np.percentile(latencies, self.hedge_percentile))
+        )
+
+    def _no_member_error(self, model: str) -> CircuitOpenError:
+        """Returns the error raised when every member of the pool has an open circuit."""
+        return CircuitOpenError(
+            f"deployment pool/{model}", self.resilience.recovery_timeout
+        )
+
+    def call(
+        self,
+        model: str,
+        send: Callable[[Dict[str, Any], str], Any],
+        hedge: bool = True,
+    ) -> Any:
+        """
+        Sends a request to the pool.
+
+        :param model: The deployment of the application the request is for.
+        :param send: Function sending the request to a member, called with the member and the name of the
+            deployment on that member. Its return value is returned; its `headers`, if any, are read for
+            rate-limit information.
+        :param hedge: Whether the request may be hedged. Streaming requests should not be. Defaults to True.
+        :return: The return value of `send`.
+        :raises CircuitOpenError: If every member has an open circuit.
+        :raises Exception: The last error of `send`, if it is not transient or every retry failed.
+        """
+        return self.resilience.call(
+            f"deployment pool/{model}", self._route, model, send, hedge
+        )
+
+    def _route(
+        self, model: str, send: Callable[[Dict[str, Any], str], Any], hedge: bool
+    ) -> Any:
+        """Tries the members in routing order until one succeeds (one round of `call`)."""
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            member = self._choose(model, tried)
+            if member is None:
+                break
+            tried.add(member["name"])
+            try:
+                delay = self._hedge_delay(member) if hedge else None
+                if delay is None:
+                    return self._attempt(member, model, send)
+                return self._hedged(member, model, send, delay, tried)
+            except Exception as e:
+                if not classify_error(e)[0]:
+                    raise
+                last_error = e
+        raise last_error or self._no_member_error(model)
+
+    def _attempt(
+        self,
+        member: Dict[str, Any],
+        model: str,
+        send: Callable[[Dict[str, Any], str], Any],
+    ) -> Any:
+        """Sends a request to one member, recording the outcome."""
+        start = time.perf_counter()
+        try:
+            response = send(member, self.deployment(member, model))
+        except Exception as e:
+            self._failed(member, model, e)
+            raise
+        except BaseException:
+            with self._lock:
+                member["outstanding"] -= 1
+            self.resilience.circuit_breaker(
+                self._member_key(member, model)
+            ).abort_trial()
+            raise
+        self._succeeded(member, model, start, response)
+        return response
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Returns the thread pool running hedged requests, creating it on first use."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="deployment-pool"
+                )
+        return self._executor
+
+    def _hedged(
+        self,
+        member: Dict[str, Any],
+        model: str,
+        send: Callable[[Dict[str, Any], str], Any],
+        delay: float,
+        tried: Set[str],
+    ) -> Any:
+        """Sends a request to a member and, if it has not answered after `delay` seconds, to a second member."""
+        executor = self._get_executor()
+        pending = {executor.submit(self._attempt, member, model, send): member}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            backup = self._choose(model, tried)
+            if backup is not None:
+                tried.add(backup["name"])
+                with self._lock:
+                    member["hedges"] += 1
+                logger.info(
+                    f"No response from {member['name']} after {delay:.2f}s; hedging to {backup['name']}."
+                )
+                pending[executor.submit(self._attempt, backup, model, send)] = backup
+
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = pending.pop(future)
+                if future.exception() is None:
+                    # The slower request keeps running in its thread; its response is discarded
+                    if winner is not member:
+                        with self._lock:
+                            winner["hedge_wins"] += 1
+                    return future.result()
+                last_error = future.exception()
+        raise last_error or self._no_member_error(model)
+
+    async def acall(
+        self,
+        model: str,
+        send: Callable[[Dict[str, Any], str], Awaitable[Any]],
+        hedge: bool = True,
+    ) -> Any:
+        """
+        Asynchronous variant of `call`, for a coroutine function `send`. The slower of two hedged requests
+        is cancelled.
+        """
+        return await self.resilience.acall(
+            f"deployment pool/{model}", self._aroute, model, send, hedge
+        )
+
+    async def _aroute(
+        self,
+        model: str,
+        send: Callable[[Dict[str, Any], str], Awaitable[Any]],
+        hedge: bool,
+    ) -> Any:
+        """Asynchronous variant of `_route`."""
+        tried: Set[str] = set()
+        last_error: Optional[Exception] = None
+        while True:
+            member = self._choose(model, tried)
+            if member is None:
+                break
+            tried.add(member["name"])
+            try:
+                delay = self._hedge_delay(member) if hedge else None
+                if delay is None:
+                    return await self._aattempt(member, model, send)
+                return await self._ahedged(member, model, send, delay, tried)
+            except Exception as e:
+                if not classify_error(e)[0]:
+                    raise
+                last_error = e
+        raise last_error or self._no_member_error(model)
+
+    async def _aattempt(
+        self,
+        member: Dict[str, Any],
+        model: str,
+        send: Callable[[Dict[str, Any], str], Awaitable[Any]],
+    ) -> Any:
+        """Asynchronous variant of `_attempt`."""
+        start = time.perf_counter()
+        try:
+            response = await send(member, self.deployment(member, model))
+        except asyncio.CancelledError:
+            # E.g. the slower of two hedged requests: it must not leave the circuit half-open for good
+            with self._lock:
+                member["outstanding"] -= 1
+            self.resilience.circuit_breaker(
+                self._member_key(member, model)
+            ).abort_trial()
+            raise
+        except Exception as e:
+            self._failed(member, model, e)
+            raise
+        self._succeeded(member, model, start, response)
+        return response
+
+    async def _ahedged(
+        self,
+        member: Dict[str, Any],
+        model: str,
+        send: Callable[[Dict[str, Any], str], Awaitable[Any]],
+        delay: float,
+        tried: Set[str],
+    ) -> Any:
+        """Asynchronous variant of `_hedged`."""
+        pending = {asyncio.ensure_future(self._aattempt(member, model, send)): member}
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            backup = self._choose(model, tried)
+            if backup is not None:
+                tried.add(backup["name"])
+                with self._lock:
+                    member["hedges"] += 1
+                logger.info(
+                    f"No response from {member['name']} after {delay:.2f}s; hedging to {backup['name']}."
+                )
+                pending[
+                    asyncio.ensure_future(self._aattempt(backup, model, send))
+                ] = backup
+
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    winner = pending.pop(task)
+                    if task.exception() is None:
+                        if winner is not member:
+                            with self._lock:
+                                winner["hedge_wins"] += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error or self._no_member_error(model)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """
+        Returns the routing state and counters of every member.
+
+        :return: A list of dictionaries with the keys `name`, `outstanding`, `latency`, `calls`, `failures`,
+            `throttled`, `hedges`, `hedge_wins`, `remaining_requests` and `remaining_tokens`.
+        """
+        fields = (
+            "name",
+            "outstanding",
+            "latency",
+            "calls",
+            "failures",
+            "throttled",
+            "hedges",
+            "hedge_wins",
+            "remaining_requests",
+            "remaining_tokens",
+        )
+        with self._lock:
+            return [{field: m[field] for field in fields} for m in self.members]
+
+    async def aclose(self) -> None:
+        """Closes the async clients of the running event loop."""
+        with self._lock:
+            clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
+    def close(self) -> None:
+        """Shuts down the thread pool of hedged requests."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -4,6 +4,7 @@ import dotenv
 import os
 from utils.ml_logging import get_logger
 from src.ocr.cosmosDB_indexer import CosmosDBIndexer
+from src.ocr.query_guard import QueryRejectedError
 from src.app.prompts import get_chat_cosmos_db_prompt, get_cosmos_db_prompt
 
 # Load environment variables
@@ -13,11 +14,22 @@ dotenv.load_dotenv(".env")
 logger = get_logger()
 
 from src.ocr.transformer import GPT4VisionManager
+from src.cache.response_cache import ResponseCache
+from src.cache.embedding_store import EmbeddingStore
+from src.ocr.image_preprocessor import ImagePreprocessor
 from src.aoai.azure_openai import AzureOpenAIManager
+from src.aoai.deployment_pool import DeploymentPool
+from src.ocr.vector_index import LocalVectorIndex
+
+# Optional pools of AOAI endpoints, as JSON lists in the environment (see `DeploymentPool`)
+hedge_after = float(os.getenv("AZURE_AOAI_HEDGE_AFTER", "0")) or None
 
 # Initialize GPT4VisionManager in session state
 if "gpt4_vision_manager" not in st.session_state:
-    st.session_state.gpt4_vision_manager = GPT4VisionManager()
+    st.session_state.gpt4_vision_manager = GPT4VisionManager(
+        cache=ResponseCache(directory=os.getenv("RESPONSE_CACHE_DIR", ".cache/responses")),
+        image_preprocessor=ImagePreprocessor(),
+        deployment_pool=DeploymentPool.from_env("AZURE_AOAI_VISION_DEPLOYMENT_POOL", hedge_after=hedge_after))
 
 # Initialize GPT4VisionManager in session state
 if "gpt4_manager" not in st.session_state:
@@ -25,11 +37,21 @@ if "gpt4_manager" not in st.session_state:
         api_key=os.getenv("AZURE_AOAI_KEY"),
         api_version=os.getenv("AZURE_AOAI_API_VERSION"),
         azure_endpoint=os.getenv("AZURE_AOAI_API_ENDPOINT"),
-        completion_model_name=os.getenv("AZURE_AOAI_CHAT_MODEL_NAME_DEPLOYMENT_ID"))
+        completion_model_name=os.getenv("AZURE_AOAI_CHAT_MODEL_NAME_DEPLOYMENT_ID"),
+        embedding_store=EmbeddingStore(os.getenv("EMBEDDING_STORE_DIR", ".cache/embeddings")),
+        deployment_pool=DeploymentPool.from_env(hedge_after=hedge_after))
+
+# Local vector index over the submitted requests, for similarity search
+if "vector_index" not in st.session_state:
+    st.session_state.vector_index = LocalVectorIndex(
+        quantize=os.getenv("VECTOR_INDEX_INT8", "false").lower() == "true",
+        n_lists=int(os.getenv("VECTOR_INDEX_LISTS", "0")) or None)
 
 if "cosmos_manager" not in st.session_state:
     st.session_state.cosmos_client = CosmosDBIndexer(database_name="gbbai-qualifiction-db",
-                                                     container_name="gbbai-qualifiction")
+                                                     container_name="gbbai-qualifiction",
+                                                     vector_index=st.session_state.vector_index,
+                                                     embedding_function=st.session_state.gpt4_manager.generate_embeddings)
 
 st.title("🤖 AI RequestGPT")
 
@@ -64,31 +86,62 @@ if uploaded_file is not None:
     file_path = save_uploaded_file(uploaded_file)
     image_paths.append(file_path)
 
+search_mode = st.sidebar.radio(
+    "Search mode", ["Cosmos DB query", "Similar requests"],
+    help="'Similar requests' finds the requests closest in meaning to your message in a local vector index.")
+
+def query_cosmos_db(prompt, image_paths):
+    """
+    Has GPT-4V translate the prompt into a Cosmos DB query and runs it once checked by the query guard.
+    """
+    COSMOS_DB_PROMPT_WITH_PROMPT = get_cosmos_db_prompt(prompt)
+    response_query = st.session_state.gpt4_vision_manager.call_gpt4v_image(
+        image_file_paths=image_paths,
+        user_instruction=COSMOS_DB_PROMPT_WITH_PROMPT,
+        system_instruction='''You are and Cosmos DB engineer expert tasked with translating natural
+            language queries related to project requests into specific Cosmos DB queries. The database schema
+            includes fields like `RequestTitle`, `Requester`, `RequesterEmail`, `Partner`, `ProjectedWorkHours`,
+            `ExpectedStartDate`, `MSXID`, `TPID`, `PrimarySolutionArea`, `SecondarySolutionArea`, `CustomerName`, 
+            `OperatingUnit`, `ProblemDescription`, `ProjectedACR`, `NecessarySkills`, `AzureAIServices`, `EngagementCountry`, 
+            `EngagementRegion`, `MonthlyUsage`, `Attachment`, `CreatedDate`, `RequestId`, `Status`, `AssignedTo`, `AssignedDate`, 
+            `Approved`, `ApprovedDate`, and `ApprovedBy`.''',
+        ocr=True,
+        use_vision_api=True,
+        display_image=False,
+        temperature=0.7,
+        max_tokens=450,
+        top_p=1.0
+    )
+
+    logger.info(f"Generated CosmosDb query: {response_query}")
+    if not response_query:
+        # The vision call failed (e.g. throttled or circuit open) and returned nothing
+        return "The query could not be generated right now. Please try again in a moment."
+
+    # Bound, parameterize and cost-check the generated query before it reaches Cosmos DB
+    try:
+        compiled_query = st.session_state.cosmos_client.compile_query(response_query)
+        return st.session_state.cosmos_client.execute_query(
+            compiled_query["query"],
+            parameters=compiled_query["parameters"],
+            max_items=int(os.getenv("COSMOS_QUERY_MAX_ITEMS", "50")))
+    except QueryRejectedError as e:
+        logger.warning(f"Rejected generated query: {e}")
+        return f"The query could not be run: {e}"
+
+
 # React to user input
 if prompt := st.chat_input("How can I assist you today?"):
     with st.spinner('Generating response...'):
-        COSMOS_DB_PROMPT_WITH_PROMPT = get_cosmos_db_prompt(prompt)
-        response_query = st.session_state.gpt4_vision_manager.call_gpt4v_image(
-            image_file_paths=image_paths,
-            user_instruction=COSMOS_DB_PROMPT_WITH_PROMPT,
-            system_instruction='''You are and Cosmos DB engineer expert tasked with translating natural
-                language queries related to project requests into specific Cosmos DB queries. The database schema
-                includes fields like `RequestTitle`, `Requester`, `RequesterEmail`, `Partner`, `ProjectedWorkHours`,
-                `ExpectedStartDate`, `MSXID`, `TPID`, `PrimarySolutionArea`, `SecondarySolutionArea`, `CustomerName`, 
-                `OperatingUnit`, `ProblemDescription`, `ProjectedACR`, `NecessarySkills`, `AzureAIServices`, `EngagementCountry`, 
-                `EngagementRegion`, `MonthlyUsage`, `Attachment`, `CreatedDate`, `RequestId`, `Status`, `AssignedTo`, `AssignedDate`, 
-                `Approved`, `ApprovedDate`, and `ApprovedBy`.''',
-            ocr=True,
-            use_vision_api=True,
-            display_image=False,
-            temperature=0.7,
-            max_tokens=450,
-            top_p=1.0
-        )
-
-        logger.info(f"Generated CosmosDb query: {response_query}")
-
-        data = st.session_state.cosmos_client.execute_query(response_query)
+        if search_mode == "Similar requests":
+            # Answered from the local vector index: no generated query and no Cosmos DB round trip
+            if "vector_index_built" not in st.session_state:
+                st.session_state.cosmos_client.build_vector_index()
+                st.session_state.vector_index_built = True
+            data = st.session_state.cosmos_client.search_similar(
+                prompt, k=int(os.getenv("SIMILAR_REQUESTS_K", "5")))
+        else:
+            data = query_cosmos_db(prompt, image_paths)
 
         # Display user message in chat message container
         with st.chat_message("user"):
@@ -103,8 +156,10 @@ if prompt := st.chat_input("How can I assist you today?"):
         ]
 
         CHAT_COSMOS_DB_PROMPT_WITH_PROMPT = get_chat_cosmos_db_prompt(json_response=data, prompt=prompt)
-    
-        response = st.session_state.gpt4_vision_manager.call_gpt4v_image(
+
+    # Stream the assistant response into the chat message container as it is generated
+    with st.chat_message("assistant"):
+        response = st.write_stream(st.session_state.gpt4_vision_manager.call_gpt4v_image(
             image_file_paths=image_paths,
             system_instruction="You are an AI assistant that helps people find information. Please be precise, polite, and concise.",
             user_instruction=CHAT_COSMOS_DB_PROMPT_WITH_PROMPT,
@@ -113,10 +168,7 @@ if prompt := st.chat_input("How can I assist you today?"):
             display_image=False,
             max_tokens=2000,
             seed=42,
-        )
-
-    # Display assistant response in chat message container
-    with st.chat_message("assistant"):
-        st.markdown(response)
+            stream=True,
+        ))
     # Add assistant response to chat history
     st.session_state.messages.append({"role": "assistant", "content": response})
\ No newline at end of file
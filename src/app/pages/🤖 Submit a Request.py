@@ -1,20 +1,25 @@
 import base64
+import os
 import streamlit as st
 import re
 import secrets
 import string
 from src.app.utilsapp import send_email
-from typing import List, Dict
+from typing import List
 from dotenv import load_dotenv
 import datetime
 
 from src.app.qualiFictionAlgo import calculate_total_score
 from src.ocr.transformer import GPT4VisionManager
+from src.aoai.deployment_pool import DeploymentPool
+from src.cache.response_cache import ResponseCache
+from src.ocr.image_preprocessor import ImagePreprocessor
 from utils.ml_logging import get_logger
 from src.utilsfunc import save_uploaded_file
 from src.app.oumapping import ou_email_mapping
 from src import settings
 from src.ocr.cosmosDB_indexer import CosmosDBIndexer
+from src.extractors.attachment_store import AttachmentStore
 
 # Load environment variables from .env file
 load_dotenv()
@@ -27,11 +32,31 @@ FROM_EMAIL= "Pablosalvadorlopez@outlook.com"
 
 # Initialize GPT4VisionManager in session state
 if "gpt4_vision_manager" not in st.session_state:
-    st.session_state.gpt4_vision_manager = GPT4VisionManager()
+    st.session_state.gpt4_vision_manager = GPT4VisionManager(
+        cache=ResponseCache(directory=os.getenv("RESPONSE_CACHE_DIR", ".cache/responses")),
+        image_preprocessor=ImagePreprocessor(),
+        deployment_pool=DeploymentPool.from_env(
+            "AZURE_AOAI_VISION_DEPLOYMENT_POOL",
+            hedge_after=float(os.getenv("AZURE_AOAI_HEDGE_AFTER", "0")) or None))
 
 if "cosmos_manager" not in st.session_state:
-    st.session_state.cosmos_client = CosmosDBIndexer(database_name="gbbai-qualifiction-db",
-                                                     container_name="gbbai-qualifiction")
+    # New requests are added to the chat page's vector index, if it has been created
+    st.session_state.cosmos_client = CosmosDBIndexer(
+        database_name="gbbai-qualifiction-db",
+        container_name="gbbai-qualifiction",
+        vector_index=st.session_state.get("vector_index"),
+        embedding_function=(st.session_state.gpt4_manager.generate_embeddings
+                            if "gpt4_manager" in st.session_state else None))
+
+
+def get_attachment_store():
+    """
+    Returns the attachment store, creating it on first use so that the page loads without Blob Storage settings.
+    """
+    if "attachment_store" not in st.session_state:
+        st.session_state.attachment_store = AttachmentStore(
+            container_name=os.getenv("AZURE_ATTACHMENTS_CONTAINER", "attachments"))
+    return st.session_state.attachment_store
 
 
 # Function to convert image to base64 for embedding
@@ -77,7 +102,8 @@ def process_input(image_paths: List[str],
                   weighted_projected_acr: float, 
                   weighted_projected_length: float, 
                   weighted_partner_executives: float, 
-                  weighted_actual_acr: float) -> Dict:
+                  weighted_actual_acr: float,
+                  stream: bool = False):
     """
     This function processes the input data and calculates various metrics.
 
@@ -90,9 +116,10 @@ def process_input(image_paths: List[str],
     weighted_projected_length (float): The weighted projected length of the project.
     weighted_partner_executives (float): The weighted number of partner executives involved in the project.
     weighted_actual_acr (float): The weighted actual Annual Contract Revenue (ACR).
+    stream (bool): Whether to return an iterator over the response as it is generated. Defaults to False.
 
     Returns:
-    Dict: A dictionary containing the processed data and calculated metrics.
+    The evaluation of the request, or an iterator over its deltas if `stream` is True.
     """
     USER_PROMPT = f"""
         As an AI specialist in our organization, you are entrusted with the critical task of evaluating project requests through a detailed analysis process. This comprehensive process involves reviewing textual content, examining any supplementary visual materials, and considering quantitative inputs to calculate an evaluative score. Your role is to interpret these elements, aiming for strategic project enhancements while maintaining the confidentiality of our evaluation criteria.
@@ -177,6 +204,7 @@ def process_input(image_paths: List[str],
         display_image=False,
         max_tokens=2000,
         seed=42,
+        stream=stream,
     )
     return response
 
@@ -271,10 +299,16 @@ def main():
                         int(projected_value), int(projected_work_hours), bif_parthner, int(monthly_usage))
                     st.success(f"Qualification.ai Score successfully calculated: {total_score}")
 
-                with st.spinner('Evaluating your request, please wait...'):
-                    response = process_input(image_paths, bif_requestid, str(problem_description), total_score, weighted_projected_acr,
-                                             weighted_projected_length, weighted_partner_executives, weighted_actual_acr)
-                    st.write(response)
+                # Stream the evaluation as it is generated instead of waiting for the full response
+                response = st.write_stream(process_input(image_paths, bif_requestid, str(problem_description), total_score,
+                                                         weighted_projected_acr, weighted_projected_length,
+                                                         weighted_partner_executives, weighted_actual_acr, stream=True))
+
+                # Do not email or index an evaluation that failed or was cut off
+                stream_stats = st.session_state.gpt4_vision_manager.last_stream_stats or {}
+                if not response or stream_stats.get("error"):
+                    st.error("The evaluation could not be generated. Please submit the request again.")
+                    st.stop()
 
                 # Send email to the AI GBB team aligned to the selected OUs
                 selected_ous = set(bif_ou)
@@ -308,6 +342,14 @@ def main():
                     st.error("Could not extract decision from response.")
                     decision = None
 
+            # Keep only a reference to the attachment in Cosmos DB; the bytes go to Blob Storage
+            attachment = None
+            if uploaded_file is not None:
+                uploaded_file.seek(0)
+                attachment = get_attachment_store().upload(
+                    uploaded_file, blob_name=f"{bif_requestid}/{uploaded_file.name}",
+                    content_type=uploaded_file.type)
+
             request_data = {
                 'RequestTitle': bif_name,
                 'Requester': bif_requestername,
@@ -328,7 +370,7 @@ def main():
                 'EngagementCountry': engagement_country,
                 'EngagementRegion': engagement_region,
                 'MonthlyUsage': monthly_usage,
-                'Attachment': uploaded_file.read() if uploaded_file else None,
+                'Attachment': attachment,
                 'CreatedDate': createdon,
                 'RequestId': bif_requestid,
                 'Status': 'In progress' if approved == "True" else 'Blocked due to Rejection',
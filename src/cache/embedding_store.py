@@ -0,0 +1,445 @@
+"""
+`embedding_store.py` provides a persistent, memory-mapped store of embeddings keyed by text.
+
+Vectors are appended to a flat binary file that is memory-mapped for reads, so lookups return
+views into the OS page cache instead of copies, and several worker processes can open the same
+store read-only without duplicating it in memory. A SHA-256 of the model name and text maps each
+text to its row. Vectors can be stored as float32, float16 or int8 (with a float32 scale per row);
+`compact` drops duplicate or unwanted rows and rewrites the files atomically.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+# Every row is identified by the raw SHA-256 digest of its model and text
+_KEY_SIZE = 32
+
+# File naming the generation directory that holds the data files of a compacted store
+_CURRENT_NAME = "CURRENT"
+_GENERATION_PREFIX = "gen-"
+_DATA_FILES = ("vectors.bin", "scales.bin", "keys.bin", "meta.json")
+
+
+def embedding_key(text: str, model: Optional[str] = None) -> bytes:
+    """
+    Returns the key of a text in the embedding store.
+
+    :param text: The embedded text.
+    :param model: The embedding model (deployment) name, so that vectors of different models never collide.
+    :return: The raw SHA-256 digest of the model and text.
+    """
+    return hashlib.sha256(f"{model or ''}\x00{text}".encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    An append-only, memory-mapped embedding store shared across processes.
+
+    The store directory holds `meta.json` (dtype and dimensions), `vectors.bin` (one row per embedding),
+    `keys.bin` (one digest per row) and, for int8 storage, `scales.bin`. Rows are written before their keys,
+    so a crash never exposes a partial row. One process writes; any number of processes can read, and
+    readers pick up new rows on their next miss.
+
+    `compact` writes a new generation of the files to a subdirectory and then switches to it by replacing
+    the `CURRENT` file, which names the generation, in a single rename. Until a store is first compacted,
+    its files are in the store directory itself.
+
+    Attributes:
+        directory (str): Directory of the store.
+        dtype (str): Storage type of the vectors: "float32", "float16" or "int8".
+        dimensions (Optional[int]): Dimensions of the vectors, or None until the first vector is stored.
+        read_only (bool): Whether the store rejects writes.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dtype: str = "float32",
+        dimensions: Optional[int] = None,
+        read_only: bool = False,
+    ):
+        """
+        Open or create an embedding store.
+
+        :param directory: Directory of the store. Created if it does not exist and the store is writable.
+        :param dtype: Storage type of new stores: "float32", "float16" or "int8". Existing stores keep the type
+            they were created with. Defaults to "float32".
+        :param dimensions: Dimensions of the vectors. Defaults to the dimensions of the first vector stored.
+        :param read_only: Whether to open the store for reading only. Defaults to False.
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}"
+            )
+        self.directory = directory
+        self.dtype = dtype
+        self.dimensions = dimensions
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._index: Dict[bytes, int] = {}
+        self._count = 0
+        self._keys_state: Optional[Tuple[int, int]] = None
+        self._vectors: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        # Subdirectory of the current generation of the data files ("" before the first compaction)
+        self._generation = ""
+
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+        self._read_generation()
+        if not self._read_meta() and dimensions is not None and not read_only:
+            self._write_meta()
+        self.refresh()
+
+    def _path(self, name: str) -> str:
+        """Returns the path of a data file of the current generation of the store."""
+        return os.path.join(self.directory, self._generation, name)
+
+    def _read_generation(self) -> bool:
+        """Follows `CURRENT` to the current generation of the data files. Returns True if it changed."""
+        try:
+            with open(
+                os.path.join(self.directory, _CURRENT_NAME), encoding="utf-8"
+            ) as f:
+                generation = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if generation == self._generation:
+            return False
+        self._generation = generation
+        return True
+
+    def _read_meta(self) -> bool:
+        """Loads the dtype and dimensions of an existing store. Returns False if the store is new."""
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return False
+        self.dtype = meta["dtype"]
+        self.dimensions = meta["dimensions"]
+        return True
+
+    def _write_meta(self) -> None:
+        """Writes the dtype and dimensions of the store."""
+        with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dtype": self.dtype, "dimensions": self.dimensions}, f)
+
+    @property
+    def _row_bytes(self) -> int:
+        return (self.dimensions or 0) * np.dtype(self.dtype).itemsize
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: bytes) -> bool:
+        return key in self._index
+
+    def refresh(self) -> None:
+        """
+        Loads rows appended since the store was opened or last refreshed, e.g. by another process.
+
+        If the store was compacted in the meantime, the index is rebuilt from scratch.
+        """
+        with self._lock:
+            if self._read_generation():
+                # The store was compacted, possibly into another dtype
+                self._index, self._count, self._keys_state = {}, 0, None
+                self._vectors = self._scales = None
+                self._read_meta()
+            keys_path = self._path("keys.bin")
+            try:
+                stat = os.stat(keys_path)
+            except FileNotFoundError:
+                return
+            if self.dimensions is None:
+                self._read_meta()
+            if self._keys_state == (stat.st_ino, stat.st_size):
+                return
+            if self.dimensions is None:
+                return
+
+            # Only rows whose vector (and scale) are fully written are visible
+            rows = stat.st_size // _KEY_SIZE
+            rows = min(
+                rows, os.path.getsize(self._path("vectors.bin")) // self._row_bytes
+            )
+            if self.dtype == "int8":
+                rows = min(rows, os.path.getsize(self._path("scales.bin")) // 4)
+            if rows > self._count:
+                with open(keys_path, "rb") as f:
+                    f.seek(self._count * _KEY_SIZE)
+                    data = f.read((rows - self._count) * _KEY_SIZE)
+                for offset in range(0, len(data), _KEY_SIZE):
+                    self._index.setdefault(
+                        data[offset : offset + _KEY_SIZE],
+                        self._count + offset // _KEY_SIZE,
+                    )
+                self._count = rows
+            self._keys_state = (stat.st_ino, rows * _KEY_SIZE)
+
+            if not self.read_only:
+                # Drop a partially written tail so that new rows stay aligned
+                for name, size in self._file_sizes(rows).items():
+                    if os.path.getsize(self._path(name)) > size:
+                        os.truncate(self._path(name), size)
+
+    def _file_sizes(self, rows: int) -> Dict[str, int]:
+        """Returns the expected size of each data file for a number of rows."""
+        sizes = {"keys.bin": rows * _KEY_SIZE, "vectors.bin": rows * self._row_bytes}
+        if self.dtype == "int8":
+            sizes["scales.bin"] = rows * 4
+        return sizes
+
+    def _mapped_vectors(self) -> np.memmap:
+        """Returns the memory map of the stored vectors, remapping it if rows were appended."""
+        if self._vectors is None or len(self._vectors) < self._count:
+            self._vectors = np.memmap(
+                self._path("vectors.bin"),
+                dtype=self.dtype,
+                mode="r",
+                shape=(self._count, self.dimensions or 0),
+            )
+            if self.dtype == "int8":
+                self._scales = np.memmap(
+                    self._path("scales.bin"),
+                    dtype=np.float32,
+                    mode="r",
+                    shape=(self._count,),
+                )
+        return self._vectors
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        """Returns stored rows as float32, without copying float32 storage."""
+        vectors = self._mapped_vectors()[rows]
+        # Mapping the vectors maps the scales of int8 storage
+        if self._scales is not None:
+            return vectors.astype(np.float32) * self._scales[rows][..., None]
+        return vectors.astype(np.float32, copy=False)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """A zero-copy, read-only view of all stored vectors in their storage type."""
+        with self._lock:
+            if self._count == 0:
+                return np.empty((0, self.dimensions or 0), dtype=self.dtype)
+            return self._mapped_vectors()[: self._count]
+
+    def get(self, text: str, model: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        Returns the embedding of a text, or None if it is not in the store.
+
+        :param text: The embedded text.
+        :param model: The embedding model name.
+        :return: A float32 vector. For float32 storage it is a read-only view into the memory map.
+        """
+        key = embedding_key(text, model)
+        with self._lock:
+            if key not in self._index:
+                self.refresh()
+            row = self._index.get(key)
+            if row is None:
+                return None
+            vector = self._mapped_vectors()[row]
+            if self._scales is not None:
+                return vector.astype(np.float32) * self._scales[row]
+            return vector.astype(np.float32, copy=False)
+
+    def get_many(
+        self, texts: Sequence[str], model: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up the embeddings of many texts at once.
+
+        :param texts: The embedded texts.
+        :param model: The embedding model name.
+        :return: A float32 matrix with one row per text (rows of missing texts are zero) and a boolean mask of
+            the texts found in the store.
+        """
+        keys = [embedding_key(text, model) for text in texts]
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self.refresh()
+            rows = [self._index.get(key, -1) for key in keys]
+            found = np.array([row >= 0 for row in rows], dtype=bool)
+            matrix = np.zeros((len(texts), self.dimensions or 0), dtype=np.float32)
+            if found.any():
+                matrix[found] = self._decode(np.array(rows)[found])
+        return matrix, found
+
+    def put_many(
+        self,
+        texts: Sequence[str],
+        vectors: np.ndarray,
+        model: Optional[str] = None,
+    ) -> int:
+        """
+        Appends the embeddings of texts that are not in the store yet.
+
+        :param texts: The embedded texts.
+        :param vectors: A matrix with one embedding per text.
+        :param model: The embedding model name.
+        :return: The number of rows appended.
+        """
+        if self.read_only:
+            raise PermissionError(f"Embedding store {self.directory} is read-only")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+                self._write_meta()
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Expected vectors of {self.dimensions} dimensions, got {vectors.shape[1]}"
+                )
+            self.refresh()
+
+            new_keys: List[bytes] = []
+            new_rows: List[int] = []
+            seen = set()
+            for position, text in enumerate(texts):
+                key = embedding_key(text, model)
+                if key not in self._index and key not in seen:
+                    seen.add(key)
+                    new_keys.append(key)
+                    new_rows.append(position)
+            if not new_keys:
+                return 0
+
+            self._append(new_keys, vectors[new_rows])
+        return len(new_keys)
+
+    def put(
+        self, text: str, vector: Sequence[float], model: Optional[str] = None
+    ) -> None:
+        """
+        Appends the embedding of a text if it is not in the store yet.
+
+        :param text: The embedded text.
+        :param vector: The embedding.
+        :param model: The embedding model name.
+        """
+        self.put_many([text], np.asarray(vector, dtype=np.float32)[None, :], model)
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        """Appends rows to the data files, keys last."""
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+            with open(self._path("scales.bin"), "ab") as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            stored = vectors.astype(self.dtype)
+        with open(self._path("vectors.bin"), "ab") as f:
+            f.write(np.ascontiguousarray(stored).tobytes())
+        with open(self._path("keys.bin"), "ab") as f:
+            f.write(b"".join(keys))
+        self.refresh()
+
+    def compact(
+        self,
+        keep: Optional[Iterable[str]] = None,
+        model: Optional[str] = None,
+        dtype: Optional[str] = None,
+    ) -> int:
+        """
+        Rewrites the store without duplicate rows and, optionally, only with the given texts.
+
+        The new files are written to a new generation directory, which replaces the current one in a single
+        rename of `CURRENT`. Readers keep a consistent view of the previous generation and switch to the new
+        one on their next refresh. The previous generation is deleted by the next compaction, so readers must
+        refresh in between.
+
+        :param keep: Texts whose embeddings are kept. Defaults to every text in the store.
+        :param model: The embedding model name of the texts in `keep`.
+        :param dtype: New storage type of the vectors. Defaults to the current one.
+        :return: The number of rows removed.
+        """
+        if self.read_only:
+            raise PermissionError(f"Embedding store {self.directory} is read-only")
+        with self._lock:
+            self.refresh()
+            if self._count == 0:
+                return 0
+            if keep is None:
+                kept = sorted(self._index.items(), key=lambda item: item[1])
+            else:
+                keys = {embedding_key(text, model) for text in keep}
+                kept = sorted(
+                    (item for item in self._index.items() if item[0] in keys),
+                    key=lambda item: item[1],
+                )
+            removed = self._count - len(kept)
+            rows = np.array([row for _, row in kept], dtype=np.int64)
+            vectors = (
+                self._decode(rows) if len(rows) else np.empty((0, self.dimensions or 0))
+            )
+
+            new_dtype = dtype or self.dtype
+            if new_dtype not in SUPPORTED_DTYPES:
+                raise ValueError(
+                    f"Unsupported dtype {new_dtype}, expected one of {SUPPORTED_DTYPES}"
+                )
+            previous = self._generation
+            staging = tempfile.mkdtemp(prefix=_GENERATION_PREFIX, dir=self.directory)
+            compacted = EmbeddingStore(staging, new_dtype, self.dimensions)
+            if len(kept):
+                compacted._append([key for key, _ in kept], vectors)
+            current_path = os.path.join(self.directory, _CURRENT_NAME)
+            with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(os.path.basename(staging))
+            os.replace(current_path + ".tmp", current_path)
+
+            self.refresh()
+            self._remove_generations(keep=(self._generation, previous))
+        logger.info(
+            f"Compacted embedding store {self.directory}: kept {len(kept)} rows, removed {removed}."
+        )
+        return removed
+
+    def _remove_generations(self, keep: Sequence[str]) -> None:
+        """Deletes the data files of every generation not in `keep` (the store directory itself being "")."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if (
+                name.startswith(_GENERATION_PREFIX)
+                and name not in keep
+                and os.path.isdir(path)
+            ):
+                # Fails on platforms that cannot delete mapped files; retried by the next compaction
+                shutil.rmtree(path, ignore_errors=True)
+        if "" not in keep:
+            for name in _DATA_FILES:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the number of rows and the size of the store on disk.
+
+        :return: A dictionary with the keys `rows`, `dimensions` and `disk_bytes`.
+        """
+        with self._lock:
+            sizes = self._file_sizes(self._count) if self.dimensions else {}
+            return {
+                "rows": self._count,
+                "dimensions": self.dimensions or 0,
+                "disk_bytes": sum(sizes.values()),
+            }
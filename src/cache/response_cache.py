@@ -0,0 +1,370 @@
+"""
+`response_cache.py` provides a content-addressed, two-tier cache for model responses.
+
+Responses are keyed by a stable hash of everything that determines the output of a call
+(deployment, model version, messages, sampling parameters, enhancements). A small in-memory
+LRU tier serves repeated calls within a process and an optional on-disk tier, with TTL and
+size-based eviction, keeps responses across restarts and processes.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Matches inline base64 images so they can be replaced by a digest of their content
+_DATA_URL_PATTERN = re.compile(r"^data:([\w/+.-]+);base64,(.*)$", re.DOTALL)
+
+
+def _digest_data_urls(value: Any) -> Any:
+    """
+    Replaces base64 data URLs in a nested structure by a SHA-256 digest of their content.
+
+    Keeps cache keys small and cheap to serialize when payloads carry several MB of image data.
+
+    :param value: A JSON-serializable structure.
+    :return: The same structure with data URLs replaced by their digest.
+    """
+    if isinstance(value, dict):
+        return {k: _digest_data_urls(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_digest_data_urls(v) for v in value]
+    if isinstance(value, str) and value.startswith("data:"):
+        match = _DATA_URL_PATTERN.match(value)
+        if match:
+            digest = hashlib.sha256(match.group(2).encode("ascii")).hexdigest()
+            return f"data:{match.group(1)};sha256,{digest}"
+    return value
+
+
+def make_cache_key(**parts: Any) -> str:
+    """
+    Builds a stable cache key from the parameters that determine a model response.
+
+    :param parts: Named parts of the key, e.g. deployment, model_version, messages, temperature, seed.
+    :return: A hex SHA-256 digest of the canonical JSON form of the parts.
+    """
+    canonical = json.dumps(
+        _digest_data_urls(parts), sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory LRU cache with an optional time-to-live.
+
+    Attributes:
+        max_entries (int): Maximum number of entries kept in memory.
+        ttl (Optional[float]): Time to live of an entry in seconds, or None for no expiry.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None):
+        """
+        Initialize the LRU cache.
+
+        :param max_entries: Maximum number of entries kept in memory. Defaults to 256.
+        :param ttl: Time to live of an entry in seconds. Defaults to None (no expiry).
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the value stored under `key`, or None if it is missing or expired.
+
+        :param key: The cache key.
+        :return: The cached value or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, stored_at: Optional[float] = None) -> None:
+        """
+        Stores `value` under `key`, evicting the least recently used entries if needed.
+
+        :param key: The cache key.
+        :param value: The value to store.
+        :param stored_at: When the value was stored (e.g. in a slower tier), as a Unix timestamp. The TTL counts
+            from then. Defaults to now.
+        """
+        if stored_at is None:
+            stored_at = time.time()
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    A directory of gzip-compressed JSON entries with a time-to-live and size-based eviction.
+
+    Entries are written atomically, so several processes can share the same directory.
+    When the total size exceeds `max_bytes`, the least recently used entries are removed.
+
+    Attributes:
+        directory (str): Directory holding the cache entries.
+        max_bytes (int): Maximum total size of the entries on disk.
+        ttl (Optional[float]): Time to live of an entry in seconds, or None for no expiry.
+    """
+
+    SUFFIX = ".json.gz"
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Initialize the disk cache, creating the directory if it does not exist.
+
+        :param directory: Directory holding the cache entries.
+        :param max_bytes: Maximum total size of the entries on disk. Defaults to 512 MB.
+        :param ttl: Time to live of an entry in seconds. Defaults to None (no expiry).
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(
+            os.path.getsize(path) for path, _ in self._iter_entries()
+        )
+
+    def _path(self, key: str) -> str:
+        """Returns the file path of an entry, fanned out in sub-directories by key prefix."""
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    def _iter_entries(self):
+        """Yields (path, stat) for every entry in the cache directory."""
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.SUFFIX):
+                    path = os.path.join(root, name)
+                    try:
+                        yield path, os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the value stored under `key`, or None if it is missing, expired or unreadable.
+
+        :param key: The cache key.
+        :return: The cached value or None.
+        """
+        entry = self.get_entry(key)
+        return entry[1] if entry is not None else None
+
+    def get_entry(self, key: str) -> Optional[Tuple[float, Any]]:
+        """
+        Returns the value stored under `key` with the time it was written, or None if it is missing, expired
+        or unreadable.
+
+        :param key: The cache key.
+        :return: A tuple of (write time as a Unix timestamp, cached value), or None.
+        """
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                self._remove(path)
+                return None
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            # Record the access time for LRU eviction without changing the write time used by the TTL
+            os.utime(path, (time.time(), stat.st_mtime))
+            return stat.st_mtime, value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores `value` under `key` and evicts old entries if the cache is over its size limit.
+
+        :param key: The cache key.
+        :param value: A JSON-serializable value.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                f.write(json.dumps(value).encode("utf-8"))
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - previous_size
+            over_limit = self._total_bytes > self.max_bytes
+        if over_limit:
+            self._evict()
+
+    def _remove(self, path: str) -> None:
+        """Removes an entry and updates the size accounting."""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._total_bytes -= size
+
+    def _evict(self) -> None:
+        """Removes least recently used entries until the cache is below 90% of its size limit."""
+        entries = sorted(self._iter_entries(), key=lambda entry: entry[1].st_atime)
+        with self._lock:
+            self._total_bytes = sum(stat.st_size for _, stat in entries)
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        for path, _ in entries:
+            if self._total_bytes <= target:
+                break
+            self._remove(path)
+            evicted += 1
+        logger.info(f"Evicted {evicted} entries from disk cache {self.directory}.")
+
+    def clear(self) -> None:
+        """Removes every entry from the cache."""
+        for path, _ in list(self._iter_entries()):
+            self._remove(path)
+
+    @property
+    def total_bytes(self) -> int:
+        """Total size in bytes of the entries on disk."""
+        return self._total_bytes
+
+
+class ResponseCache:
+    """
+    A content-addressed response cache with an in-memory LRU tier and an optional on-disk tier.
+
+    Lookups check memory first, then disk; disk hits are promoted to memory.
+
+    Attributes:
+        memory (LRUCache): The in-memory tier.
+        disk (Optional[DiskCache]): The on-disk tier, or None if only memory is used.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found in the cache.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        directory: Optional[str] = None,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        ttl: Optional[float] = 7 * 24 * 3600,
+    ):
+        """
+        Initialize the response cache.
+
+        :param max_entries: Maximum number of entries kept in memory. Defaults to 256.
+        :param directory: Directory of the on-disk tier. If None, only the in-memory tier is used.
+        :param max_disk_bytes: Maximum total size of the on-disk tier. Defaults to 512 MB.
+        :param ttl: Time to live of an entry in seconds, for both tiers. Defaults to 7 days; None disables expiry.
+        """
+        self.memory = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.disk = (
+            DiskCache(directory, max_bytes=max_disk_bytes, ttl=ttl)
+            if directory
+            else None
+        )
+        self.hits = 0
+        self.misses = 0
+
+    make_key = staticmethod(make_cache_key)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the response stored under `key`, or None on a miss.
+
+        :param key: The cache key, as returned by `make_key`.
+        :return: The cached response or None.
+        """
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            entry = self.disk.get_entry(key)
+            if entry is not None:
+                # The entry keeps its write time, so that promotion does not extend its TTL
+                stored_at, value = entry
+                self.memory.set(key, value, stored_at=stored_at)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Stores a response in both tiers. None values are not cached.
+
+        :param key: The cache key, as returned by `make_key`.
+        :param value: A JSON-serializable response.
+        """
+        if value is None:
+            return
+        self.memory.set(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value)
+            except OSError as e:
+                logger.warning(f"Failed to write response to disk cache: {e}")
+
+    def clear(self) -> None:
+        """Removes every entry from both tiers."""
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit/miss counters and the size of each tier.
+
+        :return: A dictionary with the keys `hits`, `misses`, `memory_entries` and `disk_bytes`.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_entries": len(self.memory),
+            "disk_bytes": self.disk.total_bytes if self.disk is not None else 0,
+        }
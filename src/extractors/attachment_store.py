@@ -0,0 +1,167 @@
+import base64
+import hashlib
+import io
+import mimetypes
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Any, Dict, List, Optional, Set, Union
+
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobBlock, ContentSettings
+
+from src.extractors.blob_data_extractor import AzureBlobDataExtractor
+from utils.ml_logging import get_logger
+
+# Initialize logger
+logger = get_logger()
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class AttachmentStore:
+    """
+    Stores attachments in Azure Blob Storage and returns small references to keep in Cosmos DB documents.
+
+    Attachments are read once, in blocks: each block is hashed and staged in parallel, then the block list is
+    committed. A reference holds the URL, blob name, size, SHA-256 and MIME type of the attachment; the bytes
+    are only downloaded when `read` or `download_to_stream` is called.
+
+    Attributes:
+        blob_manager (AzureBlobDataExtractor): The blob manager of the attachments container.
+        block_size (int): Size of the staged blocks in bytes.
+        max_concurrency (int): Maximum number of blocks uploaded at once.
+    """
+
+    def __init__(
+        self,
+        container_name: str = "attachments",
+        blob_manager: Optional[AzureBlobDataExtractor] = None,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        max_concurrency: int = 4,
+    ):
+        """
+        Initialize the AttachmentStore.
+
+        Args:
+            container_name (str, optional): Name of the container holding the attachments. Defaults to "attachments".
+            blob_manager (AzureBlobDataExtractor, optional): Existing blob manager to use. Defaults to a new one
+                for `container_name`.
+            block_size (int, optional): Size of the staged blocks in bytes. Defaults to 4 MB.
+            max_concurrency (int, optional): Maximum number of blocks uploaded at once. Defaults to 4.
+        """
+        self.blob_manager = blob_manager or AzureBlobDataExtractor(
+            container_name=container_name
+        )
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+        self._container_checked = False
+
+    def _ensure_container(self) -> None:
+        """Creates the attachments container on first use if it does not exist."""
+        if self._container_checked:
+            return
+        try:
+            self.blob_manager.container_client.create_container()
+            logger.info(f"Created container {self.blob_manager.container_name}")
+        except ResourceExistsError:
+            pass
+        self._container_checked = True
+
+    def upload(
+        self,
+        data: Union[bytes, IO[bytes]],
+        blob_name: str,
+        content_type: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Uploads an attachment as parallel block uploads and returns its reference.
+
+        :param data: The attachment content, as bytes or a readable binary stream (e.g. a Streamlit UploadedFile).
+        :param blob_name: Name of the blob, e.g. "<request id>/<file name>".
+        :param content_type: MIME type of the attachment. Defaults to a guess from `blob_name`.
+        :return: A reference dictionary with the keys `url`, `container`, `blob_name`, `size`, `sha256` and
+            `content_type`.
+        """
+        self._ensure_container()
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+        content_type = (
+            content_type
+            or mimetypes.guess_type(blob_name)[0]
+            or "application/octet-stream"
+        )
+        blob_client = self.blob_manager.container_client.get_blob_client(blob_name)
+
+        digest = hashlib.sha256()
+        size = 0
+        block_ids: List[str] = []
+        in_flight: Set[Future] = set()
+        try:
+            with ThreadPoolExecutor(
+                max_workers=max(1, self.max_concurrency)
+            ) as executor:
+                # Blocks are read one at a time, so at most `max_concurrency` blocks are held in memory
+                for chunk in iter(lambda: stream.read(self.block_size), b""):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    block_id = base64.b64encode(
+                        f"{len(block_ids):08d}".encode("ascii")
+                    ).decode("ascii")
+                    block_ids.append(block_id)
+                    if len(in_flight) >= self.max_concurrency:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    in_flight.add(
+                        executor.submit(blob_client.stage_block, block_id, chunk)
+                    )
+                for future in in_flight:
+                    future.result()
+
+            blob_client.commit_block_list(
+                [BlobBlock(block_id=block_id) for block_id in block_ids],
+                content_settings=ContentSettings(content_type=content_type),
+                metadata={"sha256": digest.hexdigest()},
+            )
+        except Exception as e:
+            logger.error(f"Failed to upload attachment {blob_name}: {e}")
+            raise
+
+        reference = {
+            "url": blob_client.url,
+            "container": self.blob_manager.container_name,
+            "blob_name": blob_name,
+            "size": size,
+            "sha256": digest.hexdigest(),
+            "content_type": content_type,
+        }
+        logger.info(
+            f"Uploaded attachment {blob_name} ({size} bytes in {len(block_ids)} blocks)"
+        )
+        return reference
+
+    def read(self, reference: Dict[str, Any], verify: bool = True) -> bytes:
+        """
+        Downloads the content of an attachment.
+
+        :param reference: The reference returned by `upload`.
+        :param verify: Whether to check the content against the SHA-256 of the reference. Defaults to True.
+        :return: The attachment content.
+        :raises Exception: If the download fails.
+        """
+        buffer = io.BytesIO()
+        self.download_to_stream(reference, buffer)
+        content = buffer.getvalue()
+        if verify and hashlib.sha256(content).hexdigest() != reference["sha256"]:
+            raise ValueError(
+                f"Attachment {reference['blob_name']} does not match its SHA-256."
+            )
+        return content
+
+    def download_to_stream(self, reference: Dict[str, Any], stream: IO[bytes]) -> int:
+        """
+        Downloads an attachment into a writable stream without holding it in memory.
+
+        :param reference: The reference returned by `upload`.
+        :param stream: Writable binary stream, e.g. an open file.
+        :return: Number of bytes written.
+        """
+        return self.blob_manager.download_to_stream(reference["url"], stream)
@@ -1,7 +1,12 @@
+import json
 import os
 import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from typing import Dict, List, Optional, Union
+from typing import IO, Any, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import unquote, urlparse
 
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
@@ -12,6 +17,12 @@ from utils.ml_logging import get_logger
 # Initialize logger
 logger = get_logger()
 
+# Size of the ranges blobs are downloaded in, and of the first request of a download
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+
+# File of a synced directory recording the ETag, size and last-modified time of its blobs
+SYNC_MANIFEST_NAME = ".blob_manifest.json"
+
 
 class AzureBlobDataExtractor:
     """
@@ -22,15 +33,42 @@ class AzureBlobDataExtractor:
         container_name (str): Name of the Azure Blob Storage container.
         service_client (BlobServiceClient): Azure Blob Service Client.
         container_client: Azure Container Client specific to the container.
+        max_concurrency (int): Ranges of a blob downloaded in parallel.
+        max_parallel_blobs (int): Blobs downloaded in parallel by the folder downloads.
+        download_stats (Dict[str, int]): Blobs and bytes downloaded, and failed downloads, since creation.
+        last_download_stats (Optional[Dict[str, float]]): Blobs, bytes, seconds and throughput (MB/s)
+            of the last folder download.
+
+    Blobs larger than `chunk_size` are downloaded as ranges of `chunk_size` bytes, `max_concurrency` at
+    a time, and written to their destination as they arrive, so a download needs memory for a few chunks
+    rather than for the whole blob.
     """
 
-    def __init__(self, container_name: Optional[str] = None):
+    def __init__(
+        self,
+        container_name: Optional[str] = None,
+        max_concurrency: int = 4,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_parallel_blobs: int = 4,
+    ):
         """
         Initialize the AzureBlobManager with a container name.
 
         Args:
             container_name (str, optional): Name of the Azure Blob Storage container. Defaults to None.
+            max_concurrency (int, optional): Ranges of a blob downloaded in parallel. Defaults to 4.
+            chunk_size (int, optional): Size in bytes of the ranges, and of the first request of a download.
+                Blobs up to this size are downloaded in a single request. Defaults to 4 MiB.
+            max_parallel_blobs (int, optional): Blobs downloaded in parallel by `download_blobs_to_folder`
+                and `download_files_to_folder`. A folder download opens up to
+                `max_parallel_blobs * max_concurrency` connections. Defaults to 4.
         """
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.max_parallel_blobs = max_parallel_blobs
+        self.download_stats = {"blobs": 0, "bytes": 0, "failed": 0}
+        self.last_download_stats: Optional[Dict[str, float]] = None
+        self._stats_lock = threading.Lock()
         try:
             load_dotenv()
             connect_str = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
@@ -43,7 +81,9 @@ class AzureBlobDataExtractor:
                 )
             self.container_name = container_name
             self.blob_service_client = BlobServiceClient.from_connection_string(
-                connect_str
+                connect_str,
+                max_single_get_size=chunk_size,
+                max_chunk_get_size=chunk_size,
             )
             if container_name:
                 self.container_client = self.blob_service_client.get_container_client(
@@ -78,18 +118,366 @@ class AzureBlobDataExtractor:
             file_name,
         ) = get_container_and_blob_name_from_url(file_path)
         try:
-            blob_data = (
-                self.blob_service_client.get_blob_client(
-                    container=container_name, blob=file_name
-                )
-                .download_blob()
-                .readall()
-            )
+            blob_data = self._download(container_name, file_name).readall()
+            self._record_download(len(blob_data))
             logger.info(f"Successfully downloaded blob file {file_name}")
         except Exception as e:
             logger.error(f"Failed to download blob file {file_name}: {e}")
         return blob_data
 
+    def download_to_stream(self, file_path: str, stream: IO[bytes]) -> int:
+        """
+        Downloads a blob into a writable stream, chunk by chunk, without holding it in memory.
+
+        Ranges are downloaded in parallel if the stream is seekable (e.g. a file or a BytesIO), and one
+        after another otherwise.
+
+        :param file_path: URL of the blob.
+        :param stream: Writable binary stream, e.g. an open file.
+        :return: Number of bytes written.
+        """
+        container_name, file_name = get_container_and_blob_name_from_url(file_path)
+        try:
+            seekable = stream.seekable() if hasattr(stream, "seekable") else False
+            size = self._download(
+                container_name, file_name, None if seekable else 1
+            ).readinto(stream)
+            self._record_download(size)
+            logger.info(f"Successfully downloaded blob file {file_name} ({size} bytes)")
+        except Exception as e:
+            logger.error(f"Failed to download blob file {file_name}: {e}")
+            raise
+        return size
+
+    def _container(self, container_name: Optional[str] = None) -> str:
+        """
+        Returns the given container name, or the container of the manager.
+
+        :raises ValueError: If no container is given and the manager has none.
+        """
+        name = container_name or self.container_name
+        if not name:
+            raise ValueError(
+                "No container name given and the manager has no container."
+            )
+        return name
+
+    def _download(
+        self, container_name: str, blob_name: str, max_concurrency: Optional[int] = None
+    ):
+        """
+        Starts the download of a blob.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param max_concurrency: Ranges downloaded in parallel. Defaults to `max_concurrency`.
+        :return: The StorageStreamDownloader of the blob.
+        """
+        return self.blob_service_client.get_blob_client(
+            container=container_name, blob=blob_name
+        ).download_blob(max_concurrency=max_concurrency or self.max_concurrency)
+
+    def _record_download(self, size: int) -> None:
+        """Adds a downloaded blob to `download_stats`."""
+        with self._stats_lock:
+            self.download_stats["blobs"] += 1
+            self.download_stats["bytes"] += size
+
+    def download_blob_to_file(
+        self, blob_name: str, local_path: str, container_name: Optional[str] = None
+    ) -> int:
+        """
+        Downloads a blob to a local file, writing ranges to the file as they arrive.
+
+        The blob is written to `<local_path>.part` and renamed once complete, so an interrupted download
+        never leaves a truncated file at `local_path`.
+
+        :param blob_name: Name of the blob.
+        :param local_path: Path of the local file.
+        :param container_name: Name of the container. Defaults to the container of the manager.
+        :return: Number of bytes written.
+        """
+        partial_path = f"{local_path}.part"
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        try:
+            with open(partial_path, "wb") as file:
+                size = self._download(
+                    self._container(container_name), blob_name
+                ).readinto(file)
+            os.replace(partial_path, local_path)
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        self._record_download(size)
+        return size
+
+    def download_blobs_to_folder(
+        self,
+        blob_names: Iterable[str],
+        local_dir: str,
+        container_name: Optional[str] = None,
+        max_parallel_blobs: Optional[int] = None,
+    ) -> Dict[str, str]:
+        """
+        Downloads blobs to a local directory, several at a time.
+
+        Blobs are saved under their base name, so blobs of different folders cannot share one (use
+        `sync_folder` to keep their paths). `last_download_stats` then holds the number of blobs, bytes, the
+        elapsed time and the aggregate throughput.
+
+        :param blob_names: Names of the blobs.
+        :param local_dir: The local directory.
+        :param container_name: Name of the container. Defaults to the container of the manager.
+        :param max_parallel_blobs: Blobs downloaded in parallel. Defaults to `max_parallel_blobs`.
+        :return: A dictionary of blob names to local paths.
+        :raises ValueError: If blobs share a base name; nothing is downloaded then.
+        :raises Exception: The first download error, once the other downloads have finished.
+        """
+        paths: Dict[str, str] = {}
+        names_by_path: Dict[str, str] = {}
+        for name in blob_names:
+            path = os.path.join(local_dir, os.path.basename(name))
+            if names_by_path.setdefault(path, name) != name:
+                raise ValueError(
+                    f"Blobs {names_by_path[path]} and {name} would both be downloaded to {path}."
+                )
+            paths[name] = path
+        os.makedirs(local_dir, exist_ok=True)
+        errors = self._download_to_paths(paths, container_name, max_parallel_blobs)
+        if errors:
+            raise next(iter(errors.values()))
+        return paths
+
+    def _download_to_paths(
+        self,
+        paths: Dict[str, str],
+        container_name: Optional[str] = None,
+        max_parallel_blobs: Optional[int] = None,
+    ) -> Dict[str, BaseException]:
+        """
+        Downloads blobs to local paths, several at a time, and records `last_download_stats`.
+
+        :param paths: A dictionary of blob names to local paths.
+        :param container_name: Name of the container. Defaults to the container of the manager.
+        :param max_parallel_blobs: Blobs downloaded in parallel. Defaults to `max_parallel_blobs`.
+        :return: A dictionary of the blobs that could not be downloaded to their errors.
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=max_parallel_blobs or self.max_parallel_blobs
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    self.download_blob_to_file, name, path, container_name
+                )
+                for name, path in paths.items()
+            }
+        elapsed = time.perf_counter() - start
+
+        sizes, errors = [], {}
+        for name, future in futures.items():
+            error = future.exception()
+            if error is None:
+                sizes.append(future.result())
+                logger.info(f"Downloaded {name} to {paths[name]}")
+            else:
+                logger.error(f"Failed to download blob file {name}: {error}")
+                errors[name] = error
+        with self._stats_lock:
+            self.download_stats["failed"] += len(errors)
+
+        total = sum(sizes)
+        throughput = total / elapsed / 1e6 if elapsed > 0 else 0.0
+        self.last_download_stats = {
+            "blobs": len(sizes),
+            "bytes": total,
+            "seconds": elapsed,
+            "throughput_mbps": throughput,
+        }
+        logger.info(
+            f"Downloaded {len(sizes)} blobs ({total / 1e6:.1f} MB) in {elapsed:.2f}s "
+            f"({throughput:.1f} MB/s, {len(errors)} failed)."
+        )
+        return errors
+
+    def _split_folder_path(self, folder_path: str) -> Tuple[str, str]:
+        """
+        Returns the container and the blob name prefix of a folder.
+
+        :param folder_path: URL of the folder (or container), or path of the folder within the container of
+            the manager.
+        :return: A tuple of (container name, prefix). The prefix is empty or ends with "/".
+        """
+        if urlparse(folder_path).scheme in ("http", "https"):
+            service_url = self.blob_service_client.url.rstrip("/") + "/"
+            if folder_path.startswith(service_url):
+                path = folder_path[len(service_url) :]
+            else:
+                path = urlparse(folder_path).path.lstrip("/")
+            container_name, _, prefix = unquote(path).partition("/")
+        else:
+            container_name, prefix = self._container(), folder_path
+        prefix = prefix.strip("/")
+        return container_name, f"{prefix}/" if prefix else ""
+
+    @staticmethod
+    def _read_manifest(
+        manifest_path: str, container_name: str, prefix: str
+    ) -> Dict[str, Dict[str, Any]]:
+        """Returns the blobs recorded by the sync manifest of a directory, if it syncs the same folder."""
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if (
+            manifest.get("container") != container_name
+            or manifest.get("prefix") != prefix
+        ):
+            logger.warning(
+                f"{manifest_path} was written for another folder; syncing from scratch."
+            )
+            return {}
+        return manifest.get("blobs", {})
+
+    @staticmethod
+    def _write_manifest(
+        manifest_path: str,
+        container_name: str,
+        prefix: str,
+        blobs: Dict[str, Dict[str, Any]],
+    ) -> None:
+        """Replaces the sync manifest of a directory atomically."""
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=os.path.dirname(manifest_path),
+            suffix=".tmp",
+            delete=False,
+            encoding="utf-8",
+        ) as f:
+            json.dump(
+                {"container": container_name, "prefix": prefix, "blobs": blobs},
+                f,
+                indent=1,
+            )
+        os.replace(f.name, manifest_path)
+
+    def sync_folder(
+        self,
+        folder_path: str,
+        local_dir: str,
+        delete: bool = False,
+        max_parallel_blobs: Optional[int] = None,
+    ) -> Dict[str, int]:
+        """
+        Mirrors a folder of Azure Blob Storage in a local directory, downloading only new and changed blobs.
+
+        Only the blobs under the folder are listed, and their paths relative to the folder are kept. The
+        ETag, size and last-modified time of the downloaded blobs are recorded in a manifest in the directory
+        (`SYNC_MANIFEST_NAME`); a blob is downloaded again when its ETag changes or its local file is missing
+        or has another size. If nothing is listed under the folder but a blob has its exact name, that blob
+        is synced on its own.
+
+        :param folder_path: URL of the folder (or container), or path of the folder within the container of
+            the manager. A URL or path of a single blob is accepted too.
+        :param local_dir: The local directory.
+        :param delete: Whether to delete the local files of blobs that no longer exist. Only files written by
+            a previous sync are deleted. Defaults to False.
+        :param max_parallel_blobs: Blobs downloaded in parallel. Defaults to `max_parallel_blobs`.
+        :return: A dictionary with the numbers of blobs `listed`, `downloaded`, `unchanged`, `deleted` and
+            `failed`, and the `bytes` downloaded.
+        :raises Exception: The first download error, once the other downloads have finished and the
+            manifest has been updated.
+        """
+        container_name, prefix = self._split_folder_path(folder_path)
+        local_dir = os.path.abspath(local_dir)
+        os.makedirs(local_dir, exist_ok=True)
+        manifest_path = os.path.join(local_dir, SYNC_MANIFEST_NAME)
+        recorded = self._read_manifest(manifest_path, container_name, prefix)
+
+        container_client = self.blob_service_client.get_container_client(container_name)
+        blobs = list(container_client.list_blobs(name_starts_with=prefix))
+        base = prefix
+        if not blobs and prefix:
+            # The path may name a single blob rather than a folder
+            blob_name = prefix[:-1]
+            blobs = [
+                blob
+                for blob in container_client.list_blobs(name_starts_with=blob_name)
+                if blob.name == blob_name
+            ]
+            base = blob_name[: blob_name.rfind("/") + 1]
+
+        listed: Dict[str, Dict[str, Any]] = {}
+        for blob in blobs:
+            relative_path = os.path.normpath(blob.name[len(base) :])
+            if (
+                blob.name.endswith("/")
+                or os.path.isabs(relative_path)
+                or relative_path.split(os.sep)[0] == ".."
+            ):
+                # Folder placeholders, and names that would land outside the directory
+                continue
+            listed[blob.name] = {
+                "etag": blob.etag,
+                "size": blob.size,
+                "last_modified": blob.last_modified.isoformat()
+                if blob.last_modified
+                else None,
+                "path": relative_path,
+            }
+
+        def is_stale(name: str, entry: Dict[str, Any]) -> bool:
+            local_path = os.path.join(local_dir, entry["path"])
+            return (
+                recorded.get(name, {}).get("etag") != entry["etag"]
+                or not os.path.isfile(local_path)
+                or os.path.getsize(local_path) != entry["size"]
+            )
+
+        stale = [name for name, entry in listed.items() if is_stale(name, entry)]
+        errors: Dict[str, BaseException] = {}
+        downloaded_bytes = 0
+        if stale:
+            errors = self._download_to_paths(
+                {name: os.path.join(local_dir, listed[name]["path"]) for name in stale},
+                container_name,
+                max_parallel_blobs,
+            )
+            if self.last_download_stats is not None:
+                downloaded_bytes = int(self.last_download_stats["bytes"])
+
+        # Blobs that failed keep their previous entry, so that they are downloaded again next time
+        manifest_blobs = dict(recorded)
+        manifest_blobs.update(
+            (name, entry) for name, entry in listed.items() if name not in errors
+        )
+        deleted = 0
+        if delete:
+            for name in set(recorded) - set(listed):
+                local_path = os.path.join(local_dir, manifest_blobs.pop(name)["path"])
+                if os.path.isfile(local_path):
+                    os.remove(local_path)
+                    deleted += 1
+        self._write_manifest(manifest_path, container_name, prefix, manifest_blobs)
+
+        stats: Dict[str, int] = {
+            "listed": len(listed),
+            "downloaded": len(stale) - len(errors),
+            "unchanged": len(listed) - len(stale),
+            "deleted": deleted,
+            "failed": len(errors),
+            "bytes": downloaded_bytes,
+        }
+        logger.info(
+            f"Synced {container_name}/{prefix} to {local_dir}: {stats['downloaded']} downloaded, "
+            f"{stats['unchanged']} unchanged, {deleted} deleted, {len(errors)} failed."
+        )
+        if errors:
+            raise next(iter(errors.values()))
+        return stats
+
     def extract_metadata(self, blob_url: str) -> Dict[str, Optional[Union[str, int]]]:
         """
         Extracts metadata from a blob in Azure Blob Storage.
@@ -165,26 +553,19 @@ class AzureBlobDataExtractor:
         """
         Downloads all files from a specified folder in Azure Blob Storage to a local directory.
 
+        The files keep their paths relative to the folder, so blobs in subfolders are written to
+        subdirectories of `local_dir` rather than all in `local_dir` itself. Files downloaded to the directory
+        by a previous call, and unchanged since, are not downloaded again; the directory holds a manifest
+        (`SYNC_MANIFEST_NAME`) for that purpose (see `sync_folder`).
+
         Args:
-            folder_path (str): The path to the folder within the blob container.
+            folder_path (str): The URL of the folder, or its path within the blob container. The URL or path
+                of a single blob downloads that blob alone.
             local_dir (str): The local directory to which the files will be downloaded.
         """
         try:
-            # Ensure folder path ends with a '/'
-            if not folder_path.endswith("/"):
-                folder_path += "/"
-                logger.info(f"Folder path {folder_path}")
-
-            blob_list = self.container_client.list_blobs()
-            for blob in blob_list:
-                logger.info(f"{blob.name}")
-                local_file_path = os.path.join(local_dir, os.path.basename(blob.name))
-                blob_client = self.container_client.get_blob_client(blob.name)
-                with open(local_file_path, "wb") as file:
-                    downloader = blob_client.download_blob()
-                    file.write(downloader.readall())
-
-                logger.info(f"Downloaded {blob.name} to {local_file_path}")
+            logger.info(f"Folder path {folder_path}")
+            self.sync_folder(folder_path, local_dir)
 
         except Exception as e:
             logger.error(f"An error occurred while downloading files: {e}")
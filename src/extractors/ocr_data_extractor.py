@@ -17,13 +17,18 @@ class OCRHelper:
     Class for OCR functionalities, particularly extracting images from PDF files.
     """
 
-    def __init__(self, container_name: Optional[str] = None):
+    def __init__(
+        self, container_name: Optional[str] = None, cache_dir: Optional[str] = None
+    ):
         """
         Initialize the OCRHelper with a container name.
         Args:
             container_name (str): Name of the Azure Blob Storage container.
+            cache_dir (str, optional): Directory where blob folders are kept between runs, so that only new
+                and changed PDFs are downloaded. Defaults to None (a temporary directory per run).
         """
-        self.blob_manager = None
+        self.cache_dir = cache_dir
+        self.blob_manager: Optional[AzureBlobDataExtractor] = None
         if container_name:
             self.init_blob_manager(container_name)
 
@@ -40,45 +45,114 @@ class OCRHelper:
         Extracts pages from a PDF file or a folder of PDF files and saves them as pictures.
         Args:
             input_path (str): Path to the PDF file or folder of PDF files.
-            output_path (str): Path to the folder where the pictures will be saved.
+            output_path (str): Path to the folder where the pictures will be saved. The pictures of PDF files
+                in subfolders of a blob folder are saved in the same subfolders of `output_path`.
+        Raises:
+            ValueError: If the input path is a URL and the blob manager was not initialized.
         """
         is_url = urlparse(input_path).scheme in ["http", "https"]
 
         if is_url:
             logger.info(f"Input path is a URL: {input_path}")
+            if self.blob_manager is None:
+                raise ValueError(
+                    "A container name is required to read PDF files from Azure Blob Storage. "
+                    "Call init_blob_manager first."
+                )
+            if self.cache_dir:
+                local_dir = os.path.join(
+                    self.cache_dir, *urlparse(input_path).path.strip("/").split("/")
+                )
+                self.blob_manager.sync_folder(input_path, local_dir, delete=True)
+                # Only the PDF files downloaded by this sync are newer than their pictures
+                self._process_pdf_path(
+                    local_dir, output_path, recursive=True, skip_unchanged=True
+                )
+                return
             with tempfile.TemporaryDirectory() as temp_dir:
                 self.blob_manager.download_files_to_folder(input_path, temp_dir)
-                self._process_pdf_path(temp_dir, output_path)
+                self._process_pdf_path(temp_dir, output_path, recursive=True)
         else:
             logger.info(f"Input path is a local file or directory: {input_path}")
             self._process_pdf_path(input_path, output_path)
 
-    def _process_pdf_path(self, input_path: str, output_path: str) -> None:
+    def _process_pdf_path(
+        self,
+        input_path: str,
+        output_path: str,
+        recursive: bool = False,
+        skip_unchanged: bool = False,
+    ) -> None:
         """
         Processes a PDF file or all PDF files in a directory.
         Args:
             input_path (str): Path to the PDF file or directory containing PDF files.
             output_path (str): Path to save the extracted images.
+            recursive (bool, optional): Whether to include the PDF files of subdirectories. Defaults to False.
+            skip_unchanged (bool, optional): Whether to skip the PDF files of a directory whose images were
+                saved after the file was last modified. Defaults to False.
         """
         if os.path.isdir(input_path):
-            self._process_pdf_directory(input_path, output_path)
+            self._process_pdf_directory(
+                input_path, output_path, recursive, skip_unchanged
+            )
         elif os.path.isfile(input_path) and input_path.lower().endswith(".pdf"):
             self._process_single_pdf(input_path, output_path)
         else:
             logger.error("The input path is neither a valid PDF file nor a directory.")
 
-    def _process_pdf_directory(self, directory_path: str, output_path: str) -> None:
+    def _process_pdf_directory(
+        self,
+        directory_path: str,
+        output_path: str,
+        recursive: bool = False,
+        skip_unchanged: bool = False,
+    ) -> None:
         """
         Processes all PDF files in a directory and saves each page as an image.
         Args:
             directory_path (str): Directory containing PDF files.
-            output_path (str): Directory where the images will be saved.
+            output_path (str): Directory where the images will be saved. The images of PDF files in
+                subdirectories are saved in the same subdirectories, so that files with the same name do not
+                overwrite each other's images.
+            recursive (bool, optional): Whether to include the PDF files of subdirectories. Defaults to False.
+            skip_unchanged (bool, optional): Whether to skip the PDF files whose images were saved after the
+                file was last modified. Defaults to False.
         """
-        all_files = glob.glob(os.path.join(directory_path, "*.pdf"))
+        pattern = os.path.join("**", "*.pdf") if recursive else "*.pdf"
+        all_files = glob.glob(
+            os.path.join(directory_path, pattern), recursive=recursive
+        )
         logger.info(f"Found {len(all_files)} PDF files in {directory_path}")
+        skipped = 0
         for file_path in all_files:
+            relative_dir = os.path.relpath(os.path.dirname(file_path), directory_path)
+            file_output_path = os.path.normpath(os.path.join(output_path, relative_dir))
+            if skip_unchanged and self._is_rendered(file_path, file_output_path):
+                skipped += 1
+                continue
             logger.info(f"Processing file: {file_path}")
-            self._process_single_pdf(file_path, output_path)
+            self._process_single_pdf(file_path, file_output_path)
+        if skipped:
+            logger.info(f"Skipped {skipped} PDF files whose images are up to date.")
+
+    @staticmethod
+    def _is_rendered(file_path: str, output_path: str) -> bool:
+        """
+        Checks whether the images of a PDF file were saved after the file was last modified.
+        Args:
+            file_path (str): Path to the PDF file.
+            output_path (str): Directory where the images of the file are saved.
+        Returns:
+            bool: True if the image of the last page, which is saved last, is newer than the file.
+        """
+        with fitz.open(file_path) as doc:
+            page_count = doc.page_count
+        base_filename = os.path.splitext(os.path.basename(file_path))[0]
+        last_page = os.path.join(output_path, f"{base_filename}-page-{page_count}.png")
+        if not os.path.isfile(last_page):
+            return False
+        return os.path.getmtime(last_page) >= os.path.getmtime(file_path)
 
     def _process_single_pdf(self, file_path: str, output_path: str) -> None:
         """
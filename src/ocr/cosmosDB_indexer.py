@@ -1,12 +1,59 @@
-from typing import Dict, Any, Optional, List
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Any,
+    Iterator,
+    Optional,
+    List,
+    Sequence,
+    Tuple,
+)
 from azure.cosmos import CosmosClient, DatabaseProxy, ContainerProxy, PartitionKey
 from azure.cosmos import exceptions
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import os
+import threading
+import time
+import numpy as np
+from src.ocr.polling import retry_after_seconds
+from src.ocr.query_guard import (
+    DEFAULT_HEAVY_FIELDS,
+    DEFAULT_REQUEST_FIELDS,
+    CosmosQueryGuard,
+)
+from src.ocr.vector_index import LocalVectorIndex
 from utils.ml_logging import get_logger
 
 # Initialize logging
 logger = get_logger()
 
+# Maximum number of operations and request size of a Cosmos DB transactional batch
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 2 * 1024 * 1024
+
+# Status codes of transient failures worth retrying
+_RETRYABLE_STATUS_CODES = (408, 429, 449, 500, 503)
+
+# Fields whose text is embedded for similarity search
+DEFAULT_EMBEDDING_FIELDS = (
+    "RequestTitle",
+    "CustomerName",
+    "PrimarySolutionArea",
+    "SecondarySolutionArea",
+    "NecessarySkills",
+    "AzureAIServices",
+    "ProblemDescription",
+)
+
+# Fields returned with similarity search results
+DEFAULT_SEARCH_FIELDS = tuple(
+    field for field in DEFAULT_REQUEST_FIELDS if field not in DEFAULT_HEAVY_FIELDS
+)
+
 
 class CosmosDBIndexer:
     def __init__(
@@ -15,6 +62,13 @@ class CosmosDBIndexer:
         credential_id: Optional[str] = None,
         database_name: Optional[str] = None,
         container_name: Optional[str] = None,
+        query_guard: Optional[CosmosQueryGuard] = None,
+        vector_index: Optional[LocalVectorIndex] = None,
+        embedding_function: Optional[
+            Callable[[List[str]], Optional[np.ndarray]]
+        ] = None,
+        embedding_fields: Sequence[str] = DEFAULT_EMBEDDING_FIELDS,
+        search_fields: Sequence[str] = DEFAULT_SEARCH_FIELDS,
     ):
         """
         Initialize the CosmosDBIndexer with connection details to Azure Cosmos DB.
@@ -23,14 +77,27 @@ class CosmosDBIndexer:
         :param credential_id: Credential ID for the Azure Cosmos DB account.
         :param database_name: The name of the database to use.
         :param container_name: The name of the container to index data into.
+        :param query_guard: Guard used by `compile_query` to check and rewrite generated queries. Defaults to a
+            CosmosQueryGuard with its default settings.
+        :param vector_index: Optional local vector index kept up to date with the documents written by
+            `index_data` and `bulk_index_data`, and used by `search_similar`.
+        :param embedding_function: Function embedding a list of texts into a matrix, e.g.
+            `AzureOpenAIManager.generate_embeddings`. Required by the vector index.
+        :param embedding_fields: Fields whose text is embedded for similarity search.
+        :param search_fields: Fields stored in the vector index and returned with similarity search results.
         """
+        self.endpoint_url = endpoint_url or os.getenv("AZURE_COSMOSDB_ENDPOINT")
+        self._credential = credential_id or os.getenv("AZURE_COSMOSDB_KEY")
         try:
-            self.client = CosmosClient(
-                endpoint_url or os.getenv("AZURE_COSMOSDB_ENDPOINT"),
-                credential=credential_id or os.getenv("AZURE_COSMOSDB_KEY"),
-            )
+            self.client = CosmosClient(self.endpoint_url, credential=self._credential)
         except Exception as e:
             raise ValueError("Failed to initialize CosmosClient") from e
+        self._async_client: Optional[AsyncCosmosClient] = None
+        self.query_guard = query_guard or CosmosQueryGuard()
+        self.vector_index = vector_index
+        self.embedding_function = embedding_function
+        self.embedding_fields = tuple(embedding_fields)
+        self.search_fields = tuple(search_fields)
 
         if database_name is not None:
             self.database: DatabaseProxy = self.client.get_database_client(
@@ -109,8 +176,11 @@ class CosmosDBIndexer:
         :param data_list: A list of dictionaries, each representing a data item to be indexed, potentially including nested structures.
         :param id_key: The key to use for the Invoice ID in the indexed data. Defaults to 'InvoiceId'.
         :return: A list of responses from the database after indexing each data item or None if an error occurred.
+
+        For large volumes, use `bulk_index_data`, which groups items into transactional batches per partition key.
         """
         responses = []
+        indexed_documents = []
         for i, data in enumerate(data_list):
             try:
                 logger.info(f"Processing data item {i+1} of {len(data_list)}")
@@ -134,6 +204,7 @@ class CosmosDBIndexer:
                     f"Data indexed successfully with id: {processed_data['id']}"
                 )
                 responses.append(response)
+                indexed_documents.append(processed_data)
             except exceptions.CosmosHttpResponseError as e:
                 logger.error(f"Failed to index data item {i+1}: {e}")
                 responses.append(None)
@@ -143,8 +214,238 @@ class CosmosDBIndexer:
                 )
                 responses.append(None)
         logger.info(f"Final number of records indexed: {len(responses)}")
+        self.update_vector_index(indexed_documents)
         return responses
 
+    def bulk_index_data(
+        self,
+        data_list: List[Dict[str, Any]],
+        id_key: str = "InvoiceId",
+        partition_key_path: Optional[str] = None,
+        batch_size: int = MAX_BATCH_OPERATIONS,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+    ) -> Dict[str, Any]:
+        """
+        Indexes many data items using transactional batches, grouped by partition key and run concurrently.
+
+        Items are preprocessed as in `index_data` and upserted in batches of up to `batch_size` items sharing
+        a partition key value, and of at most `MAX_BATCH_BYTES` once serialized. Partitions are processed
+        concurrently. Throttled batches (429) wait for the retry-after returned by the service and are retried;
+        batches still too large for the service (413) are halved; when a single item makes its batch fail, that
+        item is recorded as failed and the rest of the batch is re-queued.
+
+        :param data_list: A list of dictionaries, each representing a data item to be indexed.
+        :param id_key: The key to use as the item 'id'. Items without it, or without a partition key value, are
+            skipped. Defaults to 'InvoiceId'.
+        :param partition_key_path: Partition key path of the container, e.g. "/InvoiceId". Defaults to the path read
+            from the container properties.
+        :param batch_size: Maximum number of items per transactional batch (at most 100). Defaults to 100.
+        :param max_concurrency: Maximum number of batches in flight at once. Defaults to 8.
+        :param max_retries: Maximum number of retries of a batch after transient failures. Defaults to 5.
+        :return: A dictionary with the keys `indexed`, `failed`, `skipped` (item counts), `failed_ids`,
+            `request_charge` (total RU), `elapsed` (seconds) and `items_per_second`.
+        """
+        start = time.perf_counter()
+        if partition_key_path is None:
+            partition_key_path = self.container.read()["partitionKey"]["paths"][0]
+        batch_size = max(1, min(batch_size, MAX_BATCH_OPERATIONS))
+
+        partitions: Dict[Any, List[Dict[str, Any]]] = defaultdict(list)
+        null_ids, null_partition_keys = 0, 0
+        for data in data_list:
+            processed_data = self.preprocess_data(data)
+            if processed_data.get(id_key) in [None, "null"]:
+                null_ids += 1
+                continue
+            processed_data["id"] = str(processed_data[id_key])
+            partition_key = self._partition_key_value(
+                processed_data, partition_key_path
+            )
+            if partition_key is None:
+                # A batch needs the partition key value of its items
+                null_partition_keys += 1
+                continue
+            partitions[partition_key].append(processed_data)
+        skipped = null_ids + null_partition_keys
+        if null_ids:
+            logger.warning(f"Skipped {null_ids} data items with a null {id_key}.")
+        if null_partition_keys:
+            logger.warning(
+                f"Skipped {null_partition_keys} data items without a value at {partition_key_path}."
+            )
+
+        batches = [
+            (partition_key, batch)
+            for partition_key, items in partitions.items()
+            for batch in self._split_batches(items, batch_size)
+        ]
+        stats: Dict[str, Any] = {
+            "indexed": 0,
+            "failed": 0,
+            "failed_ids": [],
+            "request_charge": 0.0,
+        }
+        stats_lock = threading.Lock()
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = {
+                executor.submit(
+                    self._execute_upsert_batch, partition_key, items, max_retries
+                ): (partition_key, items)
+                for partition_key, items in batches
+            }
+            for future in as_completed(futures):
+                try:
+                    indexed, failed_ids, request_charge = future.result()
+                except Exception as e:
+                    # An unexpected error fails its batch only; the other batches are still accounted
+                    partition_key, items = futures[future]
+                    logger.error(
+                        f"Failed to index a batch of {len(items)} items in partition {partition_key}: {e}"
+                    )
+                    indexed, request_charge = 0, 0.0
+                    failed_ids = [item["id"] for item in items]
+                with stats_lock:
+                    stats["indexed"] += indexed
+                    stats["failed"] += len(failed_ids)
+                    stats["failed_ids"].extend(failed_ids)
+                    stats["request_charge"] += request_charge
+
+        failed_id_set = set(stats["failed_ids"])
+        self.update_vector_index(
+            [
+                item
+                for _, items in batches
+                for item in items
+                if item["id"] not in failed_id_set
+            ]
+        )
+
+        elapsed = time.perf_counter() - start
+        stats.update(
+            skipped=skipped,
+            elapsed=elapsed,
+            items_per_second=stats["indexed"] / elapsed if elapsed > 0 else 0.0,
+        )
+        logger.info(
+            f"Bulk indexed {stats['indexed']} items ({stats['failed']} failed, {skipped} skipped) "
+            f"in {elapsed:.1f}s across {len(partitions)} partitions: "
+            f"{stats['items_per_second']:.1f} items/s, {stats['request_charge']:.1f} RU."
+        )
+        return stats
+
+    @staticmethod
+    def _split_batches(
+        items: List[Dict[str, Any]], batch_size: int
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Splits items into batches of at most `batch_size` items and `MAX_BATCH_BYTES` once serialized.
+
+        An item larger than `MAX_BATCH_BYTES` on its own gets a batch of its own, which the service rejects.
+        """
+        batches: List[List[Dict[str, Any]]] = []
+        batch: List[Dict[str, Any]] = []
+        batch_bytes = 0
+        for item in items:
+            item_bytes = len(json.dumps(item, default=str).encode("utf-8"))
+            if batch and (
+                len(batch) >= batch_size or batch_bytes + item_bytes > MAX_BATCH_BYTES
+            ):
+                batches.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(item)
+            batch_bytes += item_bytes
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _execute_upsert_batch(
+        self, partition_key: Any, items: List[Dict[str, Any]], max_retries: int
+    ) -> Tuple[int, List[str], float]:
+        """
+        Upserts items sharing a partition key as transactional batches, retrying and re-queuing on failure.
+
+        A batch the service finds too large (413) is split in two halves, which are sent in turn.
+
+        :param partition_key: The partition key value of the items.
+        :param items: The preprocessed items to upsert.
+        :param max_retries: Maximum number of retries after transient failures.
+        :return: A tuple (number of items indexed, ids of failed items, total request charge).
+        """
+        indexed, failed_ids, request_charge = 0, [], 0.0
+        queue: List[List[Dict[str, Any]]] = [list(items)]
+        current: Optional[List[Dict[str, Any]]] = None
+        retries = 0
+        while queue:
+            pending = queue[0]
+            if not pending:
+                queue.pop(0)
+                continue
+            if pending is not current:
+                # Every entry of the queue (e.g. each half of a split batch) has its own retries
+                current, retries = pending, 0
+            try:
+                results = self.container.execute_item_batch(
+                    [("upsert", (item,)) for item in pending],
+                    partition_key=partition_key,
+                )
+                request_charge += sum(
+                    float(result.get("requestCharge", 0)) for result in results
+                )
+                indexed += len(pending)
+                queue.pop(0)
+            except exceptions.CosmosBatchOperationError as e:
+                request_charge += float(e.headers.get("x-ms-request-charge", 0))
+                failed_status = e.operation_responses[e.error_index].get("statusCode")
+                if failed_status in _RETRYABLE_STATUS_CODES and retries < max_retries:
+                    retries += 1
+                    time.sleep(self._retry_delay(e.headers, retries))
+                    continue
+                # The batch is atomic: drop the failing item and re-queue the others
+                failed_item = pending.pop(e.error_index)
+                failed_ids.append(failed_item["id"])
+                logger.error(
+                    f"Failed to index item {failed_item['id']} (status {failed_status}): {e.message}"
+                )
+            except exceptions.CosmosHttpResponseError as e:
+                if e.status_code == 413 and len(pending) > 1:
+                    half = len(pending) // 2
+                    logger.warning(
+                        f"Batch of {len(pending)} items in partition {partition_key} is too large; "
+                        "splitting it in two."
+                    )
+                    queue[0:1] = [pending[:half], pending[half:]]
+                    continue
+                if e.status_code in _RETRYABLE_STATUS_CODES and retries < max_retries:
+                    retries += 1
+                    time.sleep(self._retry_delay(e.headers or {}, retries))
+                    continue
+                logger.error(
+                    f"Failed to index a batch of {len(pending)} items in partition {partition_key}: "
+                    f"{e.message}"
+                )
+                failed_ids.extend(item["id"] for item in queue.pop(0))
+        return indexed, failed_ids, request_charge
+
+    @staticmethod
+    def _retry_delay(headers: Dict[str, Any], attempt: int) -> float:
+        """
+        Returns how long to wait before retrying: the service's retry-after, or an exponential backoff.
+        """
+        retry_after = retry_after_seconds(headers)
+        return retry_after if retry_after is not None else min(0.1 * 2**attempt, 10.0)
+
+    @staticmethod
+    def _partition_key_value(data: Dict[str, Any], partition_key_path: str) -> Any:
+        """
+        Returns the value of a (possibly nested) partition key path, e.g. "/customer/id", in an item.
+        """
+        value: Any = data
+        for part in partition_key_path.strip("/").split("/"):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
     # TODO: Add preprocess_data method as needed
     @staticmethod
     def preprocess_data(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -153,7 +454,7 @@ class CosmosDBIndexer:
         :param data: The original data dictionary to be preprocessed.
         :return: A dictionary of the processed data ready for indexing.
         """
-        logger.info(f"Data before preprocessing: {data}")
+        logger.debug(f"Data before preprocessing: {data}")
         processed_data = {}
         for key, value in data.items():
             if isinstance(value, dict) and "content" in value:
@@ -167,21 +468,152 @@ class CosmosDBIndexer:
                 processed_data[key] = value
             else:
                 processed_data[key] = value
-        logger.info(f"Data after preprocessing: {processed_data}")
+        logger.debug(f"Data after preprocessing: {processed_data}")
         return processed_data
 
-    def execute_query(self, query: str):
+    def _document_text(self, document: Dict[str, Any]) -> str:
+        """Returns the text embedded for a document, one "Field: value" line per embedding field."""
+        lines = []
+        for field in self.embedding_fields:
+            value = document.get(field)
+            if value in (None, "", [], "null"):
+                continue
+            if isinstance(value, (list, tuple)):
+                value = ", ".join(str(v) for v in value)
+            lines.append(f"{field}: {value}")
+        return "\n".join(lines)
+
+    def update_vector_index(self, documents: List[Dict[str, Any]]) -> int:
+        """
+        Embeds documents and adds them to the vector index, replacing earlier versions of the same ids.
+
+        Failures are logged and do not affect the documents already written to Cosmos DB.
+
+        :param documents: Documents with an `id`, as written to the container.
+        :return: The number of documents added to the index.
+        """
+        if self.vector_index is None or self.embedding_function is None:
+            return 0
+        documents = [
+            document
+            for document in documents
+            if document.get("id") and self._document_text(document)
+        ]
+        if not documents:
+            return 0
+        try:
+            vectors = self.embedding_function(
+                [self._document_text(document) for document in documents]
+            )
+            if vectors is None:
+                logger.error("Failed to embed documents for the vector index.")
+                return 0
+            self.vector_index.add(
+                [str(document["id"]) for document in documents],
+                vectors,
+                [
+                    {
+                        field: document[field]
+                        for field in self.search_fields
+                        if document.get(field) is not None
+                    }
+                    for document in documents
+                ],
+            )
+        except Exception as e:
+            logger.error(f"Failed to update the vector index: {e}")
+            return 0
+        logger.info(f"Added {len(documents)} documents to the vector index.")
+        return len(documents)
+
+    def build_vector_index(self, batch_size: int = 256) -> int:
+        """
+        Loads every document of the container into the vector index, e.g. when the application starts.
+
+        Only the embedded and returned fields are read, and documents are embedded `batch_size` at a time.
+
+        :param batch_size: Number of documents embedded per call of the embedding function. Defaults to 256.
+        :return: The number of documents added to the index.
+        """
+        fields = dict.fromkeys(("id",) + self.embedding_fields + self.search_fields)
+        query = "SELECT " + ", ".join(f"c.{field}" for field in fields) + " FROM c"
+        start = time.perf_counter()
+        added = 0
+        batch: List[Dict[str, Any]] = []
+        for item in self.iter_query(query, max_item_count=max(batch_size, 100)):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                added += self.update_vector_index(batch)
+                batch = []
+        added += self.update_vector_index(batch)
+        logger.info(
+            f"Built the vector index with {added} documents in {time.perf_counter() - start:.1f}s."
+        )
+        return added
+
+    def search_similar(
+        self, text: str, k: int = 5, min_score: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Finds the documents most similar to a text in the local vector index, without querying Cosmos DB.
+
+        :param text: The text to search for, e.g. a request description.
+        :param k: Maximum number of results. Defaults to 5.
+        :param min_score: Minimum cosine similarity of the results. Defaults to None (no minimum).
+        :return: The search fields of the matching documents with their `id` and `similarity`, best first.
+        """
+        if self.vector_index is None or self.embedding_function is None:
+            raise ValueError(
+                "Similarity search requires a vector index and an embedding function"
+            )
+        vectors = self.embedding_function([text])
+        if vectors is None:
+            logger.error("Failed to embed the similarity search query.")
+            return []
+        return [
+            {
+                "id": result["id"],
+                **(result["metadata"] or {}),
+                "similarity": round(result["score"], 4),
+            }
+            for result in self.vector_index.search(vectors[0], k=k, min_score=min_score)
+        ]
+
+    def compile_query(self, query: str) -> Dict[str, Any]:
+        """
+        Checks and rewrites a generated SQL query before it is executed. See `CosmosQueryGuard.compile`.
+
+        :param query: The SQL query, e.g. as written by a language model.
+        :return: A dictionary with the keys `query`, `parameters`, `estimated_cost` and `rewrites`.
+        :raises QueryRejectedError: If the query is not a single SELECT statement or is over budget.
+        """
+        return self.query_guard.compile(query)
+
+    def execute_query(
+        self,
+        query: str,
+        max_items: Optional[int] = None,
+        max_item_count: int = 100,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+    ):
         """
         Executes a SQL query against the Azure Cosmos DB container.
 
         :param query: The SQL query to execute.
+        :param max_items: Maximum number of items to return; the query stops fetching pages once reached.
+            Defaults to None (all items).
+        :param max_item_count: Number of items fetched per page. Defaults to 100.
+        :param parameters: Optional query parameters, e.g. as returned by `compile_query`.
         :return: The result of the query or None if an error occurred.
         """
         try:
             # Execute the query
             items = list(
-                self.container.query_items(
-                    query=query, enable_cross_partition_query=True
+                self.iter_query(
+                    query,
+                    parameters=parameters,
+                    max_items=max_items,
+                    max_item_count=max_item_count,
                 )
             )
 
@@ -196,3 +628,154 @@ class CosmosDBIndexer:
         except exceptions.CosmosHttpResponseError as e:
             logger.error(f"An error occurred: {e.message}")
             return None
+
+    def query_pages(
+        self,
+        query: str,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[Any] = None,
+        max_item_count: int = 100,
+        continuation_token: Optional[str] = None,
+    ) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """
+        Executes a SQL query and yields its results page by page.
+
+        Each page comes with the continuation token that resumes the query after it, so a consumer can stop
+        and later continue with `continuation_token` without re-reading (or re-paying for) earlier pages.
+
+        :param query: The SQL query to execute.
+        :param parameters: Optional query parameters, e.g. [{"name": "@id", "value": "42"}].
+        :param partition_key: Partition key value to restrict the query to a single partition. Defaults to None
+            (cross-partition query).
+        :param max_item_count: Maximum number of items per page. Defaults to 100.
+        :param continuation_token: Token returned with a previous page, to resume the query after it.
+        :return: An iterator of tuples (items of the page, continuation token or None after the last page).
+        """
+        query_kwargs: Dict[str, Any] = {"max_item_count": max_item_count}
+        if partition_key is not None:
+            query_kwargs["partition_key"] = partition_key
+        else:
+            query_kwargs["enable_cross_partition_query"] = True
+        # `by_page` is typed as a plain iterator, but returns a page iterator holding the continuation token
+        pager: Any = self.container.query_items(
+            query=query, parameters=parameters, **query_kwargs
+        ).by_page(continuation_token)
+        for page in pager:
+            yield list(page), pager.continuation_token
+
+    def iter_query(
+        self,
+        query: str,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[Any] = None,
+        max_items: Optional[int] = None,
+        max_item_count: int = 100,
+        continuation_token: Optional[str] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Executes a SQL query and lazily yields its items, fetching pages only as they are consumed.
+
+        :param query: The SQL query to execute.
+        :param parameters: Optional query parameters.
+        :param partition_key: Partition key value to restrict the query to a single partition. Defaults to None.
+        :param max_items: Maximum number of items to yield; no further page is fetched once reached.
+            Defaults to None (all items).
+        :param max_item_count: Maximum number of items per page. Defaults to 100.
+        :param continuation_token: Token returned with a page of `query_pages`, to resume the query after it.
+        :return: An iterator of items.
+        """
+        if max_items is not None:
+            max_item_count = min(max_item_count, max_items)
+        returned = 0
+        for page, _ in self.query_pages(
+            query,
+            parameters=parameters,
+            partition_key=partition_key,
+            max_item_count=max_item_count,
+            continuation_token=continuation_token,
+        ):
+            for item in page:
+                if max_items is not None and returned >= max_items:
+                    return
+                returned += 1
+                yield item
+            if max_items is not None and returned >= max_items:
+                return
+
+    async def aquery_pages(
+        self,
+        query: str,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[Any] = None,
+        max_item_count: int = 100,
+        continuation_token: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+        """
+        Asynchronous variant of `query_pages`, built on the `aio` Cosmos DB client.
+
+        :return: An async iterator of tuples (items of the page, continuation token or None after the last page).
+        """
+        query_kwargs: Dict[str, Any] = {"max_item_count": max_item_count}
+        if partition_key is not None:
+            query_kwargs["partition_key"] = partition_key
+        pager = (
+            self._get_async_container()
+            .query_items(query=query, parameters=parameters, **query_kwargs)
+            .by_page(continuation_token)
+        )
+        async for page in pager:
+            yield [item async for item in page], pager.continuation_token
+
+    async def aiter_query(
+        self,
+        query: str,
+        parameters: Optional[List[Dict[str, Any]]] = None,
+        partition_key: Optional[Any] = None,
+        max_items: Optional[int] = None,
+        max_item_count: int = 100,
+        continuation_token: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Asynchronous variant of `iter_query`.
+
+        :return: An async iterator of items.
+        """
+        if max_items is not None:
+            max_item_count = min(max_item_count, max_items)
+        returned = 0
+        async for page, _ in self.aquery_pages(
+            query,
+            parameters=parameters,
+            partition_key=partition_key,
+            max_item_count=max_item_count,
+            continuation_token=continuation_token,
+        ):
+            for item in page:
+                if max_items is not None and returned >= max_items:
+                    return
+                returned += 1
+                yield item
+            if max_items is not None and returned >= max_items:
+                return
+
+    def _get_async_container(self):
+        """
+        Returns the `aio` proxy of the container, creating the async client on first use.
+
+        :return: The async ContainerProxy.
+        """
+        if self._async_client is None:
+            self._async_client = AsyncCosmosClient(
+                self.endpoint_url, credential=self._credential
+            )
+        return self._async_client.get_database_client(
+            self.database.id
+        ).get_container_client(self.container.id)
+
+    async def aclose(self) -> None:
+        """
+        Closes the async Cosmos DB client and its connections.
+        """
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
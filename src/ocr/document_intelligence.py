@@ -1,22 +1,99 @@
+import asyncio
+import hashlib
+import mmap
 import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from functools import lru_cache
-from typing import Any, Dict, Iterator, List, Optional, Union
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
+import requests
 from azure.ai.documentintelligence import DocumentIntelligenceClient, models
+from azure.ai.documentintelligence.aio import (
+    DocumentIntelligenceClient as AsyncDocumentIntelligenceClient,
+)
 
 # from azure.ai.formrecognizer import DocumentAnalysisClient
 from azure.ai.documentintelligence.models import AnalyzeDocumentRequest, Document
 from azure.core.credentials import AzureKeyCredential
-from azure.core.polling import LROPoller
 from dotenv import load_dotenv
 from langchain_core.documents import Document as LangchainDocument
 
+from src.cache.response_cache import ResponseCache
 from src.extractors.blob_data_extractor import AzureBlobDataExtractor
+from src.ocr.invoice_table import (
+    INVOICE_FIELDS,
+    INVOICE_ITEM_FIELDS,
+    invoices_to_arrow,
+    invoices_to_pandas,
+)
+from src.ocr.layout_chunker import chunk_layout
+from src.ocr.polling import (
+    DEFAULT_BACKOFF_FACTOR,
+    DEFAULT_INITIAL_DELAY,
+    DEFAULT_MAX_DELAY,
+    AdaptivePolling,
+    AsyncAdaptivePolling,
+)
+from src.resilience import ResiliencePolicy, get_default_policy
 from utils.ml_logging import get_logger
 
 # Initialize logging
 logger = get_logger()
 
+# Analysis options that change the result, and therefore take part in the result cache key
+_RESULT_CACHE_OPTIONS = (
+    "model_id",
+    "pages",
+    "locale",
+    "string_index_type",
+    "features",
+    "query_fields",
+    "output_content_format",
+)
+
+# Timeout of the HEAD request checking whether the document behind a URL changed
+URL_VALIDATOR_TIMEOUT = 10
+
+
+def _file_sha256(f: IO[bytes]) -> str:
+    """
+    Returns the SHA-256 of a binary file object and rewinds it.
+
+    Regular files are memory-mapped, so their pages are hashed straight from the page cache
+    without being copied into Python objects.
+
+    :param f: A seekable binary file object.
+    :return: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    try:
+        size = os.fstat(f.fileno()).st_size
+    except (AttributeError, OSError):
+        size = 0
+    if size > 0:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            digest.update(mapped)
+    else:
+        f.seek(0)
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
 
 class AzureDocumentIntelligenceManager:
     """
@@ -28,6 +105,11 @@ class AzureDocumentIntelligenceManager:
         azure_endpoint: Optional[str] = None,
         azure_key: Optional[str] = None,
         container_name: Optional[str] = None,
+        polling_initial_delay: float = DEFAULT_INITIAL_DELAY,
+        polling_max_delay: float = DEFAULT_MAX_DELAY,
+        polling_backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        cache: Optional[ResponseCache] = None,
+        resilience: Optional[ResiliencePolicy] = None,
     ):
         """
         Initialize the class with configurations for Azure's Document Analysis Client.
@@ -35,26 +117,52 @@ class AzureDocumentIntelligenceManager:
         :param azure_endpoint: Endpoint URL for Azure's Document Analysis Client.
         :param azure_key: API key for Azure's Document Analysis Client.
         :param container_client: Azure Container Client specific to the container.
+        :param polling_initial_delay: Seconds to wait before the first status check of an analysis. Defaults to 0.5.
+        :param polling_max_delay: Maximum number of seconds between status checks, unless the service asks for more
+            through `Retry-After`. Defaults to 10.
+        :param polling_backoff_factor: Factor applied to the delay after each status check. Defaults to 1.5.
+        :param cache: Optional cache of analysis results, keyed by the SHA-256 of the document content and the
+            analysis options. Results are large, so a small `max_entries` and an on-disk directory are recommended.
+            HTTPS URLs other than blobs are keyed by the URL and its ETag or Last-Modified header, and are not
+            cached when the server returns neither.
+        :param resilience: Retry, backoff and circuit breaker policy of the analysis requests. Defaults to the
+            policy shared by the process (`get_default_policy`). Status checks keep the retries of the client.
         """
         self.azure_endpoint = azure_endpoint
         self.azure_key = azure_key
 
         if not self.azure_endpoint or not self.azure_key:
             self.load_environment_variables_from_env_file()
-
-        if not self.azure_endpoint or not self.azure_key:
-            raise ValueError(
-                "Azure endpoint and key must be provided either as parameters or in a .env file."
-            )
+        azure_endpoint, azure_key = self._credentials()
 
         self.blob_manager = AzureBlobDataExtractor(container_name=container_name)
 
+        self.polling_initial_delay = polling_initial_delay
+        self.polling_max_delay = polling_max_delay
+        self.polling_backoff_factor = polling_backoff_factor
+        self.cache = cache
+        self.resilience = resilience or get_default_policy()
+
         self.document_analysis_client = DocumentIntelligenceClient(
-            endpoint=self.azure_endpoint,
-            credential=AzureKeyCredential(self.azure_key),
+            endpoint=azure_endpoint,
+            credential=AzureKeyCredential(azure_key),
             headers={"x-ms-useragent": "langchain-parser/1.0.0"},
-            polling_interval=30,
         )
+        self._async_document_analysis_client: Optional[
+            AsyncDocumentIntelligenceClient
+        ] = None
+
+    def _credentials(self) -> Tuple[str, str]:
+        """
+        Returns the endpoint and key of the service. (Internal method)
+
+        :raises ValueError: If the endpoint or the key is missing.
+        """
+        if not self.azure_endpoint or not self.azure_key:
+            raise ValueError(
+                "Azure endpoint and key must be provided either as parameters or in a .env file."
+            )
+        return self.azure_endpoint, self.azure_key
 
     @lru_cache(maxsize=1)
     def load_environment_variables_from_env_file(self):
@@ -91,9 +199,9 @@ class AzureDocumentIntelligenceManager:
         features: Optional[List[str]] = None,
         query_fields: Optional[List[str]] = None,
         output_format: Optional[Union[str, models.ContentFormat]] = None,
-        content_type: str = "application/json",
+        content_type: Optional[str] = None,
         **kwargs: Any,
-    ) -> LROPoller:
+    ) -> models.AnalyzeResult:
         """
         Analyzes a document using Azure's Document Analysis Client with pre-trained models.
 
@@ -128,67 +236,431 @@ class AzureDocumentIntelligenceManager:
             - "STYLE_FONT": Detects and analyzes font styles in the document.
         :param query_fields: List of additional fields to extract.
         :param output_content_format: Format of the analyze result top-level content.
-        :param content_type: Body Parameter content-type. Content type parameter for JSON body.
-        :param kwargs: Additional keyword arguments to pass to the analysis method.
-        :return: An instance of LROPoller that returns AnalyzeResult.
+        :param content_type: Body Parameter content-type. Defaults to "application/json" for URLs and to
+            "application/octet-stream" for local files and blobs, whose content is streamed as the request body.
+        :param kwargs: Additional keyword arguments to pass to the analysis method. Pass `polling` to replace
+            the adaptive polling method.
+        :return: The AnalyzeResult of the document, served from the result cache if one is configured and the
+            document was analyzed before.
         """
-        # Convert feature strings into DocumentAnalysisFeature objects
-        if features is not None:
-            features = [
-                getattr(models.DocumentAnalysisFeature, feature) for feature in features
-            ]
+        analyze_kwargs = self._analyze_kwargs(
+            model_type,
+            pages=pages,
+            locale=locale,
+            string_index_type=string_index_type,
+            features=features,
+            query_fields=query_fields,
+            output_format=output_format,
+            **kwargs,
+        )
+        analyze_kwargs.setdefault("polling", self._polling_method())
+        # The analysis request is retried by the resilience policy rather than by the client
+        analyze_kwargs.setdefault("retry_total", 0)
+        begin_analyze = self.document_analysis_client.begin_analyze_document
 
-        # Check if the document_input is a URL
-        if document_input.startswith(("http://", "https://")):
-            # If it's an HTTP URL, raise an error
-            if document_input.startswith("http://"):
-                raise ValueError("HTTP URLs are not supported. Please use HTTPS.")
-            # If it's an HTTPS URL but contains "blob.core.windows.net", process it as a blob
-            elif "blob.core.windows.net" in document_input:
-                logger.info("Blob URL detected. Extracting content.")
-                content_bytes = self.blob_manager.extract_content(document_input)
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
-                    analyze_request=AnalyzeDocumentRequest(base64_source=content_bytes),
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
+        # HTTP URLs are not supported
+        if document_input.startswith("http://"):
+            raise ValueError("HTTP URLs are not supported. Please use HTTPS.")
+
+        # HTTPS URLs, other than blobs, are fetched by the service itself
+        if document_input.startswith("https://") and not self._is_blob_url(
+            document_input
+        ):
+            cache_key = self._result_cache_key(document_input, None, analyze_kwargs)
+            cached = self._get_cached_result(cache_key, document_input)
+            if cached is not None:
+                return cached
+            poller = self.resilience.call(
+                self._endpoint_key(model_type),
+                begin_analyze,
+                analyze_request=AnalyzeDocumentRequest(url_source=document_input),
+                content_type=content_type or "application/json",
+                **analyze_kwargs,
+            )
+        else:
+            with self._open_document(document_input) as f:
+                cache_key = self._result_cache_key(document_input, f, analyze_kwargs)
+                cached = self._get_cached_result(cache_key, document_input)
+                if cached is not None:
+                    return cached
+                # The file object is streamed as the request body, without loading or base64-encoding it
+                poller = self.resilience.call(
+                    self._endpoint_key(model_type),
+                    self._rewind_and_call(f, begin_analyze),
+                    analyze_request=f,
+                    content_type=content_type or "application/octet-stream",
+                    **analyze_kwargs,
                 )
-            else:
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
-                    analyze_request=AnalyzeDocumentRequest(url_source=document_input),
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
+
+        result = poller.result()
+        self._set_cached_result(cache_key, result)
+        return result
+
+    def analyze_documents(
+        self,
+        inputs: Iterable[str],
+        model_type: str = "prebuilt-layout",
+        max_in_flight: int = 8,
+        **kwargs: Any,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Analyzes many documents concurrently, yielding each result as soon as its analysis completes.
+
+        At most `max_in_flight` analyses are submitted and polled at once; the next input is only read from
+        `inputs` when a slot frees up, so `inputs` can be a lazy iterable over a large backlog.
+        A failed document does not stop the batch: its error is reported in the yielded dictionary.
+
+        :param inputs: Local file paths, blob URLs or HTTPS URLs of the documents to analyze.
+        :param model_type: Type of pre-trained model to use for analysis. Defaults to 'prebuilt-layout'.
+        :param max_in_flight: Maximum number of analyses in flight at once. Defaults to 8.
+        :param kwargs: Additional keyword arguments passed to `analyze_document` for every document.
+        :return: An iterator of dictionaries, in completion order, with the keys `index` (position in `inputs`),
+            `input`, `result` (the AnalyzeResult or None), `error` (the error message or None) and
+            `elapsed` (seconds from submission to completion).
+        """
+        numbered_inputs = iter(enumerate(inputs))
+        succeeded = failed = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+            in_flight = {}
+
+            def submit_next() -> bool:
+                try:
+                    index, document_input = next(numbered_inputs)
+                except StopIteration:
+                    return False
+                future = executor.submit(
+                    self._analyze_job, document_input, model_type, **kwargs
                 )
+                in_flight[future] = (index, document_input)
+                return True
+
+            while len(in_flight) < max(1, max_in_flight) and submit_next():
+                pass
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, document_input = in_flight.pop(future)
+                    outcome = future.result()
+                    if outcome["error"] is None:
+                        succeeded += 1
+                    else:
+                        failed += 1
+                    submit_next()
+                    yield {"index": index, "input": document_input, **outcome}
+
+        logger.info(
+            f"Analyzed {succeeded + failed} documents in {time.perf_counter() - start:.1f}s: "
+            f"{succeeded} succeeded, {failed} failed."
+        )
+
+    def _analyze_job(
+        self, document_input: str, model_type: str, **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        Analyzes a single document and captures its outcome instead of raising. (Internal method)
+
+        :return: A dictionary with the keys `result`, `error` and `elapsed`.
+        """
+        start = time.perf_counter()
+        try:
+            result = self.analyze_document(document_input, model_type, **kwargs)
+            error = None
+        except Exception as e:
+            logger.error(f"Failed to analyze {document_input}: {e}")
+            result, error = None, str(e)
+        return {
+            "result": result,
+            "error": error,
+            "elapsed": time.perf_counter() - start,
+        }
+
+    async def analyze_document_async(
+        self,
+        document_input: str,
+        model_type: str = "prebuilt-layout",
+        pages: Optional[str] = None,
+        locale: Optional[str] = None,
+        string_index_type: Optional[Union[str, models.StringIndexType]] = None,
+        features: Optional[List[str]] = None,
+        query_fields: Optional[List[str]] = None,
+        output_format: Optional[Union[str, models.ContentFormat]] = None,
+        content_type: Optional[str] = None,
+        **kwargs: Any,
+    ) -> models.AnalyzeResult:
+        """
+        Asynchronous variant of `analyze_document`, built on the `aio` Document Intelligence client.
+
+        Many analyses can be awaited together (e.g. with `asyncio.gather`) without a thread per document.
+        Parameters are the same as for `analyze_document`.
+
+        :return: The AnalyzeResult of the document.
+        """
+        analyze_kwargs = self._analyze_kwargs(
+            model_type,
+            pages=pages,
+            locale=locale,
+            string_index_type=string_index_type,
+            features=features,
+            query_fields=query_fields,
+            output_format=output_format,
+            **kwargs,
+        )
+        analyze_kwargs.setdefault("polling", self._polling_method(use_async=True))
+        analyze_kwargs.setdefault("retry_total", 0)
+        begin_analyze = self._get_async_client().begin_analyze_document
+
+        if document_input.startswith("http://"):
+            raise ValueError("HTTP URLs are not supported. Please use HTTPS.")
+
+        if document_input.startswith("https://") and not self._is_blob_url(
+            document_input
+        ):
+            cache_key = await asyncio.to_thread(
+                self._result_cache_key, document_input, None, analyze_kwargs
+            )
+            cached = await asyncio.to_thread(
+                self._get_cached_result, cache_key, document_input
+            )
+            if cached is not None:
+                return cached
+            poller = await self.resilience.acall(
+                self._endpoint_key(model_type),
+                begin_analyze,
+                analyze_request=AnalyzeDocumentRequest(url_source=document_input),
+                content_type=content_type or "application/json",
+                **analyze_kwargs,
+            )
         else:
-            with open(document_input, "rb") as f:
-                # FIXME: local upload is not working
-                poller = self.document_analysis_client.begin_analyze_document(
-                    model_id=model_type,
+            # Opening a blob downloads it, so the document is opened and closed outside the event loop
+            document = self._open_document(document_input)
+            f = await asyncio.to_thread(document.__enter__)
+            try:
+                cache_key = await asyncio.to_thread(
+                    self._result_cache_key, document_input, f, analyze_kwargs
+                )
+                cached = await asyncio.to_thread(
+                    self._get_cached_result, cache_key, document_input
+                )
+                if cached is not None:
+                    return cached
+                poller = await self.resilience.acall(
+                    self._endpoint_key(model_type),
+                    self._rewind_and_call(f, begin_analyze),
                     analyze_request=f,
-                    pages=pages,
-                    locale=locale,
-                    string_index_type=string_index_type,
-                    features=features,
-                    query_fields=query_fields,
-                    output_content_format=output_format if output_format else "text",
-                    content_type=content_type,
-                    **kwargs,
+                    content_type=content_type or "application/octet-stream",
+                    **analyze_kwargs,
                 )
+            finally:
+                await asyncio.to_thread(document.__exit__, None, None, None)
 
-        return poller.result()
+        result = await poller.result()
+        await asyncio.to_thread(self._set_cached_result, cache_key, result)
+        return result
+
+    @staticmethod
+    def _is_blob_url(document_input: str) -> bool:
+        """
+        Returns whether a document input is an Azure Blob Storage URL.
+        """
+        return (
+            document_input.startswith("https://")
+            and "blob.core.windows.net" in document_input
+        )
+
+    @contextmanager
+    def _open_document(self, document_input: str) -> Iterator[IO[bytes]]:
+        """
+        Opens a local file or a blob as a seekable binary file object. (Internal method)
+
+        Blobs are downloaded chunk by chunk into an anonymous temporary file rather than into memory.
+
+        :param document_input: Blob URL or file path of the document.
+        :return: A context manager yielding the file object, positioned at its start.
+        """
+        if self._is_blob_url(document_input):
+            logger.info("Blob URL detected. Downloading content to a temporary file.")
+            with tempfile.TemporaryFile() as f:
+                self.blob_manager.download_to_stream(document_input, f)
+                f.seek(0)
+                yield f
+        else:
+            with open(document_input, "rb") as f:
+                yield f
+
+    def _result_cache_key(
+        self,
+        document_input: str,
+        document_file: Optional[IO[bytes]],
+        analyze_kwargs: Dict[str, Any],
+    ) -> Optional[str]:
+        """
+        Builds the cache key of an analysis, or returns None if no cache is configured. (Internal method)
+
+        Blobs and local files are keyed by the SHA-256 of their content, so a renamed or re-uploaded document
+        is still a hit and an overwritten one is a miss. Other HTTPS URLs are only fetched by the service, so
+        they are keyed by the URL and the validator (ETag or Last-Modified) returned by a HEAD request; without
+        a validator, a changed document could not be told apart, and the analysis is not cached.
+
+        :param document_input: URL or file path of the document.
+        :param document_file: The opened document for blobs and local files, otherwise None.
+        :param analyze_kwargs: The keyword arguments of the analysis, as built by `_analyze_kwargs`.
+        :return: The cache key or None.
+        """
+        if self.cache is None:
+            return None
+        if document_file is not None:
+            document = _file_sha256(document_file)
+        else:
+            validator = self._url_validator(document_input)
+            if validator is None:
+                logger.info(
+                    f"{document_input} has no ETag or Last-Modified; not caching its analysis."
+                )
+                return None
+            document = f"{document_input}#{validator}"
+        return self.cache.make_key(
+            operation="analyze_document",
+            document=document,
+            **{option: analyze_kwargs.get(option) for option in _RESULT_CACHE_OPTIONS},
+        )
+
+    @staticmethod
+    def _url_validator(url: str) -> Optional[str]:
+        """
+        Returns the ETag, or else the Last-Modified date, of the document behind a URL. (Internal method)
+
+        :param url: The HTTPS URL of the document.
+        :return: The validator, or None if the server returns neither or cannot be reached.
+        """
+        try:
+            response = requests.head(
+                url, allow_redirects=True, timeout=URL_VALIDATOR_TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"Could not check {url} for changes: {e}")
+            return None
+        etag = response.headers.get("ETag")
+        if etag:
+            return f"etag:{etag}"
+        last_modified = response.headers.get("Last-Modified")
+        return f"last-modified:{last_modified}" if last_modified else None
+
+    def _get_cached_result(
+        self, cache_key: Optional[str], document_input: str
+    ) -> Optional[models.AnalyzeResult]:
+        """
+        Returns the cached analysis for `cache_key`, or None on a miss. (Internal method)
+        """
+        if cache_key is None or self.cache is None:
+            return None
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        logger.info(f"Loaded analysis of {document_input} from cache.")
+        return models.AnalyzeResult(cached)
+
+    def _set_cached_result(
+        self, cache_key: Optional[str], result: models.AnalyzeResult
+    ) -> None:
+        """
+        Stores an analysis result in the cache, if one is configured. (Internal method)
+        """
+        if cache_key is not None and self.cache is not None:
+            self.cache.set(cache_key, result.as_dict())
+
+    def _get_async_client(self) -> AsyncDocumentIntelligenceClient:
+        """
+        Returns the async Document Intelligence client, creating it on first use.
+
+        :return: The `aio` DocumentIntelligenceClient.
+        """
+        if self._async_document_analysis_client is None:
+            azure_endpoint, azure_key = self._credentials()
+            self._async_document_analysis_client = AsyncDocumentIntelligenceClient(
+                endpoint=azure_endpoint,
+                credential=AzureKeyCredential(azure_key),
+                headers={"x-ms-useragent": "langchain-parser/1.0.0"},
+            )
+        return self._async_document_analysis_client
+
+    async def aclose(self) -> None:
+        """
+        Closes the async Document Intelligence client and its connections.
+        """
+        if self._async_document_analysis_client is not None:
+            await self._async_document_analysis_client.close()
+            self._async_document_analysis_client = None
+
+    def _polling_method(
+        self, use_async: bool = False
+    ) -> Union[AdaptivePolling, AsyncAdaptivePolling]:
+        """
+        Returns a new adaptive polling method for one long-running analysis.
+
+        :param use_async: Whether the polling method is for the async client.
+        :return: An AdaptivePolling or AsyncAdaptivePolling instance.
+        """
+        polling_class = AsyncAdaptivePolling if use_async else AdaptivePolling
+        return polling_class(
+            self._credentials()[0],
+            initial_delay=self.polling_initial_delay,
+            max_delay=self.polling_max_delay,
+            backoff_factor=self.polling_backoff_factor,
+        )
+
+    def _endpoint_key(self, model_type: str) -> str:
+        """Returns the endpoint identifier of a model for the resilience policy."""
+        return f"{self.azure_endpoint}/{model_type}"
+
+    @staticmethod
+    def _rewind_and_call(
+        f: IO[bytes], function: Callable[..., Any]
+    ) -> Callable[..., Any]:
+        """Wraps a call streaming `f`, so that every attempt sends the document from its start."""
+        position = f.tell()
+
+        def call(*args, **kwargs):
+            f.seek(position)
+            return function(*args, **kwargs)
+
+        return call
+
+    @staticmethod
+    def _analyze_kwargs(
+        model_type: str,
+        pages: Optional[str] = None,
+        locale: Optional[str] = None,
+        string_index_type: Optional[Union[str, models.StringIndexType]] = None,
+        features: Optional[List[str]] = None,
+        query_fields: Optional[List[str]] = None,
+        output_format: Optional[Union[str, models.ContentFormat]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """
+        Builds the keyword arguments shared by every `begin_analyze_document` call.
+
+        :return: A dictionary of keyword arguments, without the analyze request and its content type.
+        """
+        # Convert feature strings into DocumentAnalysisFeature objects
+        if features is not None:
+            features = [
+                getattr(models.DocumentAnalysisFeature, feature) for feature in features
+            ]
+
+        return dict(
+            model_id=model_type,
+            pages=pages,
+            locale=locale,
+            string_index_type=string_index_type,
+            features=features,
+            query_fields=query_fields,
+            output_content_format=output_format if output_format else "text",
+            **kwargs,
+        )
 
     def process_invoice(self, invoice: Document) -> Dict:
         """
@@ -198,34 +670,7 @@ class AzureDocumentIntelligenceManager:
         :return: A dictionary with the processed data.
         """
         invoice_data = {}
-        fields = [
-            "VendorName",
-            "VendorAddress",
-            "VendorAddressRecipient",
-            "CustomerName",
-            "CustomerId",
-            "CustomerAddress",
-            "CustomerAddressRecipient",
-            "InvoiceId",
-            "InvoiceDate",
-            "InvoiceTotal",
-            "DueDate",
-            "PurchaseOrder",
-            "BillingAddress",
-            "BillingAddressRecipient",
-            "ShippingAddress",
-            "ShippingAddressRecipient",
-            "SubTotal",
-            "TotalTax",
-            "PreviousUnpaidBalance",
-            "AmountDue",
-            "ServiceStartDate",
-            "ServiceEndDate",
-            "ServiceAddress",
-            "ServiceAddressRecipient",
-            "RemittanceAddress",
-            "RemittanceAddressRecipient",
-        ]
+        fields = INVOICE_FIELDS
         for field in fields:
             field_data = invoice.fields.get(
                 field, {"content": None, "confidence": None}
@@ -239,16 +684,7 @@ class AzureDocumentIntelligenceManager:
             invoice.fields.get("Items", {"valueArray": []}).get("valueArray")
         ):
             item_data = {}
-            item_fields = [
-                "Description",
-                "Quantity",
-                "Unit",
-                "UnitPrice",
-                "ProductCode",
-                "Date",
-                "Tax",
-                "Amount",
-            ]
+            item_fields = INVOICE_ITEM_FIELDS
             for item_field in item_fields:
                 item_field_data = item.get("valueObject").get(
                     item_field, {"content": None, "confidence": None}
@@ -261,9 +697,51 @@ class AzureDocumentIntelligenceManager:
         invoice_data["Items"] = items
         return invoice_data
 
-    def _generate_docs_single(self, result: Any) -> Iterator[LangchainDocument]:
-        yield LangchainDocument(page_content=result.content, metadata={})
+    def process_invoices(
+        self,
+        invoices: Iterable[Document],
+        invoice_keys: Optional[Iterable[str]] = None,
+        as_pandas: bool = False,
+    ) -> Tuple[Any, Any]:
+        """
+        Processes a batch of invoices into a header table and a line items table.
+
+        Unlike `process_invoice`, no dictionary is built per invoice: values are accumulated in typed columns,
+        each with a confidence column. Use `write_invoices_parquet` from `src.ocr.invoice_table` to write
+        the tables to Parquet.
+
+        :param invoices: The invoices to process.
+        :param invoice_keys: Optional identifiers of the invoices, e.g. their source paths. Defaults to None.
+        :param as_pandas: Whether to return pandas DataFrames instead of Arrow tables. Defaults to False.
+        :return: A tuple (header table, items table), joined on their `invoice_index` column.
+        """
+        if as_pandas:
+            return invoices_to_pandas(invoices, invoice_keys)
+        return invoices_to_arrow(invoices, invoice_keys)
+
+    def lazy_load(
+        self,
+        result: Any,
+        chunk_size: int = 512,
+        source: Optional[str] = None,
+    ) -> Iterator[LangchainDocument]:
+        """
+        Lazily splits an analysis result into page- and section-aware chunks.
+
+        :param result: The AnalyzeResult of a layout (or read) analysis.
+        :param chunk_size: Maximum number of tokens of a chunk. Defaults to 512.
+        :param source: Identifier of the document, e.g. its path or URL, stored in the metadata and part of
+            the chunk IDs. Defaults to None.
+        :return: An iterator of LangchainDocuments whose metadata holds `chunk_id`, `chunk_index`, `source`,
+            `page_numbers`, `bounding_regions`, `sections`, `token_count`, `start` and `end`.
+        """
+        for chunk in chunk_layout(result, chunk_size=chunk_size, source=source):
+            yield LangchainDocument(
+                page_content=chunk["content"], metadata=chunk["metadata"]
+            )
 
-    def load(self, result: Any) -> List[LangchainDocument]:
-        """Load given path as pages."""
-        return list(self._generate_docs_single(result))
+    def load(
+        self, result: Any, chunk_size: int = 512, source: Optional[str] = None
+    ) -> List[LangchainDocument]:
+        """Load given analysis result as a list of chunks. See `lazy_load`."""
+        return list(self.lazy_load(result, chunk_size=chunk_size, source=source))
@@ -0,0 +1,213 @@
+"""
+`image_preprocessor.py` prepares images before they are sent to GPT-4 Vision.
+
+The model never looks at more pixels than its effective resolution: images are scaled to fit
+in a 2048 x 2048 square and then so that their shortest side is at most 768 px. Anything
+above that is uploaded, encoded and billed for nothing. This module detects the real image
+format, downscales to the effective resolution, re-encodes to the smallest suitable format
+and picks the `detail` level.
+"""
+
+import io
+import math
+from typing import Dict, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Magic numbers of the image formats accepted by GPT-4 Vision
+_MAGIC_NUMBERS = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# Token accounting of GPT-4 Vision
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+TILE_SIZE = 512
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+
+
+def detect_mime_type(image_bytes: bytes) -> str:
+    """
+    Detects the MIME type of an image from its leading bytes.
+
+    :param image_bytes: The image content.
+    :return: The MIME type, defaulting to "image/jpeg" when the format is not recognized.
+    """
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if image_bytes.startswith(magic):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def effective_size(
+    width: int,
+    height: int,
+    max_long_side: int = MAX_LONG_SIDE,
+    max_short_side: int = MAX_SHORT_SIDE,
+) -> Tuple[int, int]:
+    """
+    Returns the size at which the model sees an image in high detail mode.
+
+    :param width: Width of the image in pixels.
+    :param height: Height of the image in pixels.
+    :param max_long_side: Side of the square the image is first fitted in. Defaults to 2048.
+    :param max_short_side: Maximum length of the shortest side after fitting. Defaults to 768.
+    :return: The (width, height) the image is scaled down to. Images are never scaled up.
+    """
+    scale = min(1.0, max_long_side / max(width, height))
+    scale = min(scale, max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Estimates the number of prompt tokens GPT-4 Vision charges for an image.
+
+    :param width: Width of the image in pixels.
+    :param height: Height of the image in pixels.
+    :param detail: The detail level, "low" or "high".
+    :return: The estimated number of tokens.
+    """
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    width, height = effective_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return LOW_DETAIL_TOKENS + TILE_TOKENS * tiles
+
+
+class ImagePreprocessor:
+    """
+    Downscales, re-encodes and picks the detail level of images before they are sent to GPT-4 Vision.
+
+    Attributes:
+        max_long_side (int): Images are fitted in a square of this side.
+        max_short_side (int): The shortest side of an image is at most this long.
+        formats (Tuple[str, ...]): Candidate output formats; the smallest encoding is kept.
+        quality (int): Quality of lossy encodings.
+        low_detail_max_side (int): Images whose sides all fit in this length are sent in low detail.
+        detail (str): "auto" to pick the detail level per image, or a fixed "low"/"high".
+    """
+
+    def __init__(
+        self,
+        max_long_side: int = MAX_LONG_SIDE,
+        max_short_side: int = MAX_SHORT_SIDE,
+        formats: Tuple[str, ...] = ("JPEG", "WEBP", "PNG"),
+        quality: int = 85,
+        low_detail_max_side: int = TILE_SIZE,
+        detail: str = "auto",
+    ):
+        """
+        Initialize the preprocessor.
+
+        :param max_long_side: Images are fitted in a square of this side. Defaults to 2048, as the model does.
+        :param max_short_side: The shortest side of an image is at most this long. Defaults to 768, as the model does.
+        :param formats: Candidate output formats; the smallest encoding is kept. JPEG is skipped for images
+            with transparency. Defaults to ("JPEG", "WEBP", "PNG").
+        :param quality: Quality of lossy encodings (JPEG, WEBP). Defaults to 85.
+        :param low_detail_max_side: Images whose sides all fit in this length are sent in low detail. Defaults to 512.
+        :param detail: "auto" to pick the detail level per image, or a fixed "low"/"high". Defaults to "auto".
+        """
+        self.max_long_side = max_long_side
+        self.max_short_side = max_short_side
+        self.formats = formats
+        self.quality = quality
+        self.low_detail_max_side = low_detail_max_side
+        self.detail = detail
+
+    @staticmethod
+    def _has_alpha(image: Image.Image) -> bool:
+        """Whether an image has transparency, which JPEG cannot encode. (Internal method)"""
+        return image.mode in ("RGBA", "LA") or (
+            image.mode == "P" and "transparency" in image.info
+        )
+
+    def _encode(self, image: Image.Image, image_format: str) -> bytes:
+        """
+        Encodes an image in the given format. JPEG is only used for images without transparency. (Internal method)
+        """
+        if image_format == "JPEG":
+            image = image.convert("L" if image.mode in ("L", "1") else "RGB")
+        elif image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if self._has_alpha(image) else "RGB")
+
+        buffer = io.BytesIO()
+        if image_format == "PNG":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=image_format, quality=self.quality)
+        return buffer.getvalue()
+
+    def process(self, image_bytes: bytes) -> Dict:
+        """
+        Preprocesses an image.
+
+        :param image_bytes: The original image content.
+        :return: A dictionary with the keys `data` (the processed bytes), `mime_type`, `detail`, `size`
+            (processed width and height), `original_bytes`, `bytes_saved`, `original_tokens` and `tokens_saved`.
+        """
+        original_mime = detect_mime_type(image_bytes)
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            source.load()
+            image: Image.Image = source
+            # Cameras store the pixels as captured and the rotation in EXIF, which re-encoding drops
+            oriented = image.getexif().get(ExifTags.Base.Orientation, 1) != 1
+            if oriented:
+                image = ImageOps.exif_transpose(image)
+            original_size = image.size
+            target_size = effective_size(
+                *original_size, self.max_long_side, self.max_short_side
+            )
+
+            detail = self.detail
+            if detail == "auto":
+                detail = (
+                    "low" if max(target_size) <= self.low_detail_max_side else "high"
+                )
+
+            resized = target_size != original_size
+            if resized:
+                image = image.resize(target_size, Image.Resampling.LANCZOS)
+
+            # The original bytes can only be kept if the image was neither rotated nor resized
+            best_data: Optional[bytes] = None
+            best_mime = original_mime
+            if not (oriented or resized):
+                best_data = image_bytes
+            for image_format in self.formats:
+                if image_format == "JPEG" and self._has_alpha(image):
+                    continue
+                data = self._encode(image, image_format)
+                if best_data is None or len(data) < len(best_data):
+                    best_data, best_mime = data, f"image/{image_format.lower()}"
+            if best_data is None:
+                best_data, best_mime = self._encode(image, "PNG"), "image/png"
+
+        original_tokens = estimate_image_tokens(*original_size, detail="high")
+        processed_tokens = estimate_image_tokens(*target_size, detail=detail)
+        result = {
+            "data": best_data,
+            "mime_type": best_mime,
+            "detail": detail,
+            "size": target_size,
+            "original_bytes": len(image_bytes),
+            "bytes_saved": len(image_bytes) - len(best_data),
+            "original_tokens": original_tokens,
+            "tokens_saved": original_tokens - processed_tokens,
+        }
+        logger.info(
+            f"Preprocessed image {original_size} {original_mime} -> {target_size} {best_mime} "
+            f"(detail={detail}): saved {result['bytes_saved']} bytes and ~{result['tokens_saved']} tokens."
+        )
+        return result
@@ -0,0 +1,256 @@
+"""
+`invoice_table.py` turns batches of Document Intelligence invoices into columnar tables.
+
+`AzureDocumentIntelligenceManager.process_invoice` returns one nested dictionary per invoice,
+which is convenient for a single document but slow and memory-hungry to analyze at scale.
+This module builds two Arrow tables instead: one row per invoice (header fields) and one row
+per line item. Every field gets a typed value column and a `<field>_confidence` column, and
+the tables can be converted to pandas or written to Parquet directly.
+"""
+
+import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Header fields of the prebuilt invoice model and the Arrow type of their values
+INVOICE_FIELDS: Dict[str, pa.DataType] = {
+    "VendorName": pa.string(),
+    "VendorAddress": pa.string(),
+    "VendorAddressRecipient": pa.string(),
+    "CustomerName": pa.string(),
+    "CustomerId": pa.string(),
+    "CustomerAddress": pa.string(),
+    "CustomerAddressRecipient": pa.string(),
+    "InvoiceId": pa.string(),
+    "InvoiceDate": pa.date32(),
+    "InvoiceTotal": pa.float64(),
+    "DueDate": pa.date32(),
+    "PurchaseOrder": pa.string(),
+    "BillingAddress": pa.string(),
+    "BillingAddressRecipient": pa.string(),
+    "ShippingAddress": pa.string(),
+    "ShippingAddressRecipient": pa.string(),
+    "SubTotal": pa.float64(),
+    "TotalTax": pa.float64(),
+    "PreviousUnpaidBalance": pa.float64(),
+    "AmountDue": pa.float64(),
+    "ServiceStartDate": pa.date32(),
+    "ServiceEndDate": pa.date32(),
+    "ServiceAddress": pa.string(),
+    "ServiceAddressRecipient": pa.string(),
+    "RemittanceAddress": pa.string(),
+    "RemittanceAddressRecipient": pa.string(),
+}
+
+# Line item fields of the prebuilt invoice model and the Arrow type of their values
+INVOICE_ITEM_FIELDS: Dict[str, pa.DataType] = {
+    "Description": pa.string(),
+    "Quantity": pa.float64(),
+    "Unit": pa.string(),
+    "UnitPrice": pa.float64(),
+    "ProductCode": pa.string(),
+    "Date": pa.date32(),
+    "Tax": pa.float64(),
+    "Amount": pa.float64(),
+}
+
+
+def _field_value(field: Optional[Dict[str, Any]], value_type: pa.DataType) -> Any:
+    """
+    Extracts the typed value of a document field, falling back to its content for strings.
+
+    :param field: The document field, or None if the field was not found.
+    :param value_type: The Arrow type of the column.
+    :return: The value as a Python object of the column type, or None.
+    """
+    if field is None:
+        return None
+    if pa.types.is_date(value_type):
+        value = field.get("valueDate")
+        try:
+            return datetime.date.fromisoformat(value) if value else None
+        except ValueError:
+            return None
+    if pa.types.is_floating(value_type):
+        currency = field.get("valueCurrency")
+        if currency is not None:
+            return currency.get("amount")
+        return field.get("valueNumber")
+    return field.get("content")
+
+
+def _currency_code(fields: Dict[str, Any], names: Iterable[str]) -> Optional[str]:
+    """
+    Returns the currency code of the first currency-valued field among `names`.
+    """
+    for name in names:
+        currency = (fields.get(name) or {}).get("valueCurrency")
+        if currency is not None and currency.get("currencyCode"):
+            return currency.get("currencyCode")
+    return None
+
+
+def _empty_columns(field_types: Dict[str, pa.DataType]) -> Dict[str, List]:
+    """
+    Returns empty value and confidence columns for the given fields.
+    """
+    columns: Dict[str, List] = {}
+    for name in field_types:
+        columns[name] = []
+        columns[f"{name}_confidence"] = []
+    return columns
+
+
+def _append_fields(
+    columns: Dict[str, List],
+    fields: Dict[str, Any],
+    field_types: Dict[str, pa.DataType],
+) -> None:
+    """
+    Appends the value and confidence of every field to the column lists.
+    """
+    for name, value_type in field_types.items():
+        field = fields.get(name)
+        columns[name].append(_field_value(field, value_type))
+        columns[f"{name}_confidence"].append(
+            field.get("confidence") if field is not None else None
+        )
+
+
+def _schema(
+    key_fields: List[Tuple[str, pa.DataType]],
+    field_types: Dict[str, pa.DataType],
+) -> pa.Schema:
+    """
+    Builds the schema of a table from its key columns and its field columns.
+    """
+    schema_fields = [pa.field(name, value_type) for name, value_type in key_fields]
+    for name, value_type in field_types.items():
+        schema_fields.append(pa.field(name, value_type))
+        schema_fields.append(pa.field(f"{name}_confidence", pa.float32()))
+    return pa.schema(schema_fields)
+
+
+def invoices_to_arrow(
+    invoices: Iterable[Any], invoice_keys: Optional[Iterable[str]] = None
+) -> Tuple[pa.Table, pa.Table]:
+    """
+    Converts invoice documents into a header table and a line items table.
+
+    Values are accumulated column by column, without building a dictionary per invoice.
+
+    :param invoices: Documents analyzed with the prebuilt invoice model (e.g. `AnalyzeResult.documents`).
+    :param invoice_keys: Optional identifiers of the invoices, e.g. their source paths, stored in an
+        `invoice_key` column of both tables. Defaults to None.
+    :return: A tuple (header table, items table). The header table has one row per invoice and the
+        columns `invoice_index`, `invoice_key`, `CurrencyCode` and the fields of `INVOICE_FIELDS`. The items
+        table has one row per line item and the columns `invoice_index`, `invoice_key`, `item_index` and the
+        fields of `INVOICE_ITEM_FIELDS`. Tables join on `invoice_index`.
+    :raises ValueError: If `invoice_keys` does not have one key per invoice.
+    """
+    invoices = list(invoices)
+    keys = list(invoice_keys) if invoice_keys is not None else None
+    if keys is not None and len(keys) != len(invoices):
+        raise ValueError(
+            f"Got {len(keys)} invoice keys for {len(invoices)} invoices; expected one key per invoice."
+        )
+    header: Dict[str, List] = {
+        "invoice_index": [],
+        "invoice_key": [],
+        "CurrencyCode": [],
+    }
+    header.update(_empty_columns(INVOICE_FIELDS))
+    items: Dict[str, List] = {"invoice_index": [], "invoice_key": [], "item_index": []}
+    items.update(_empty_columns(INVOICE_ITEM_FIELDS))
+
+    currency_fields = [
+        name
+        for name, value_type in INVOICE_FIELDS.items()
+        if value_type == pa.float64()
+    ]
+    for invoice_index, invoice in enumerate(invoices):
+        invoice_key = keys[invoice_index] if keys is not None else None
+        fields = invoice.fields or {}
+        header["invoice_index"].append(invoice_index)
+        header["invoice_key"].append(invoice_key)
+        header["CurrencyCode"].append(_currency_code(fields, currency_fields))
+        _append_fields(header, fields, INVOICE_FIELDS)
+
+        item_array = (fields.get("Items") or {}).get("valueArray") or []
+        for item_index, item in enumerate(item_array):
+            items["invoice_index"].append(invoice_index)
+            items["invoice_key"].append(invoice_key)
+            items["item_index"].append(item_index)
+            _append_fields(items, item.get("valueObject") or {}, INVOICE_ITEM_FIELDS)
+
+    header_table = pa.Table.from_pydict(
+        header,
+        schema=_schema(
+            [
+                ("invoice_index", pa.int32()),
+                ("invoice_key", pa.string()),
+                ("CurrencyCode", pa.dictionary(pa.int16(), pa.string())),
+            ],
+            INVOICE_FIELDS,
+        ),
+    )
+    items_table = pa.Table.from_pydict(
+        items,
+        schema=_schema(
+            [
+                ("invoice_index", pa.int32()),
+                ("invoice_key", pa.string()),
+                ("item_index", pa.int32()),
+            ],
+            INVOICE_ITEM_FIELDS,
+        ),
+    )
+    logger.info(
+        f"Converted {header_table.num_rows} invoices and {items_table.num_rows} line items to Arrow."
+    )
+    return header_table, items_table
+
+
+def invoices_to_pandas(
+    invoices: Iterable[Any], invoice_keys: Optional[Iterable[str]] = None
+) -> Tuple[Any, Any]:
+    """
+    Converts invoice documents into a header DataFrame and a line items DataFrame.
+
+    :param invoices: Documents analyzed with the prebuilt invoice model.
+    :param invoice_keys: Optional identifiers of the invoices. Defaults to None.
+    :return: A tuple (header DataFrame, items DataFrame), as described in `invoices_to_arrow`.
+    """
+    header_table, items_table = invoices_to_arrow(invoices, invoice_keys)
+    return header_table.to_pandas(), items_table.to_pandas()
+
+
+def write_invoices_parquet(
+    invoices: Iterable[Any],
+    header_path: str,
+    items_path: str,
+    invoice_keys: Optional[Iterable[str]] = None,
+    compression: str = "zstd",
+) -> Tuple[int, int]:
+    """
+    Converts invoice documents into columnar tables and writes them to Parquet files.
+
+    :param invoices: Documents analyzed with the prebuilt invoice model.
+    :param header_path: Path of the Parquet file of the header table.
+    :param items_path: Path of the Parquet file of the line items table.
+    :param invoice_keys: Optional identifiers of the invoices. Defaults to None.
+    :param compression: Parquet compression codec. Defaults to "zstd".
+    :return: A tuple (number of invoices, number of line items) written.
+    """
+    header_table, items_table = invoices_to_arrow(invoices, invoice_keys)
+    pq.write_table(header_table, header_path, compression=compression)
+    pq.write_table(items_table, items_path, compression=compression)
+    logger.info(f"Wrote invoices to {header_path} and line items to {items_path}.")
+    return header_table.num_rows, items_table.num_rows
@@ -0,0 +1,262 @@
+"""
+`layout_chunker.py` splits Document Intelligence layout results into retrieval-sized chunks.
+
+Chunks are built from the layout structure rather than from raw text: paragraphs and tables are
+never cut in the middle unless they alone exceed the chunk size, page headers, footers and page
+numbers are dropped, and a new section heading always starts a new chunk. Every chunk carries
+its page numbers, bounding regions, section headings, token count and a stable chunk ID, so the
+same document always yields the same IDs.
+"""
+
+import bisect
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import tiktoken
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Paragraph roles that repeat on every page and carry no content of their own
+SKIPPED_ROLES = ("pageHeader", "pageFooter", "pageNumber")
+
+# Paragraph roles that open a new section
+HEADING_ROLES = ("title", "sectionHeading")
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str) -> Optional[tiktoken.Encoding]:
+    """Returns the (cached) tiktoken encoding used to count tokens, or None if it cannot be loaded."""
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(
+            f"Could not load the {encoding_name} encoding, estimating tokens from characters: {e}"
+        )
+        return None
+
+
+def _count_tokens(encoding: Optional[tiktoken.Encoding], text: str) -> int:
+    """Returns the number of tokens of a text, estimated as one token per four characters without the encoding."""
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def _split_tokens(
+    encoding: Optional[tiktoken.Encoding], text: str, size: int
+) -> List[str]:
+    """Splits a text on token boundaries into pieces of at most `size` tokens (as counted by `_count_tokens`)."""
+    if encoding is None:
+        step = max(1, (size - 1) * 4)
+        return [text[offset : offset + step] for offset in range(0, len(text), step)]
+    encoded = encoding.encode(text)
+    return [
+        encoding.decode(encoded[offset : offset + size])
+        for offset in range(0, len(encoded), size)
+    ]
+
+
+def _span_range(element: Dict[str, Any]) -> Tuple[int, int]:
+    """Returns the (start, end) offsets in the result content covered by an element."""
+    spans = element.get("spans") or []
+    if not spans:
+        return 0, 0
+    start = min(span["offset"] for span in spans)
+    end = max(span["offset"] + span["length"] for span in spans)
+    return start, end
+
+
+def _regions(element: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Returns the bounding regions of an element as plain dictionaries."""
+    return [
+        {"page_number": region["pageNumber"], "polygon": list(region["polygon"])}
+        for region in element.get("boundingRegions") or []
+    ]
+
+
+def _table_to_text(table: Dict[str, Any]) -> str:
+    """Renders a table as Markdown, one row per line."""
+    rows = [[""] * table["columnCount"] for _ in range(table["rowCount"])]
+    for cell in table.get("cells") or []:
+        content = (cell.get("content") or "").replace("\n", " ").replace("|", "\\|")
+        rows[cell["rowIndex"]][cell["columnIndex"]] = content
+    lines = ["| " + " | ".join(row) + " |" for row in rows]
+    if lines:
+        lines.insert(1, "|" + " --- |" * table["columnCount"])
+    return "\n".join(lines)
+
+
+def _section_headings(result: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Maps every paragraph and table reference (e.g. "/paragraphs/3") to the headings of its sections.
+
+    :param result: The analyze result.
+    :return: A dictionary of element references to heading paths, empty if the result has no sections.
+    """
+    sections = result.get("sections") or []
+    paragraphs = result.get("paragraphs") or []
+    headings: Dict[str, List[str]] = {}
+    if not sections:
+        return headings
+
+    stack: List[Tuple[int, List[str]]] = [(0, [])]
+    visited = set()
+    while stack:
+        section_index, path = stack.pop()
+        if section_index in visited or section_index >= len(sections):
+            continue
+        visited.add(section_index)
+        elements = sections[section_index].get("elements") or []
+        section_path = path
+        if elements and elements[0].startswith("/paragraphs/"):
+            first = paragraphs[int(elements[0].rsplit("/", 1)[1])]
+            if first.get("role") in HEADING_ROLES:
+                section_path = path + [first["content"]]
+        for element in elements:
+            if element.startswith("/sections/"):
+                stack.append((int(element.rsplit("/", 1)[1]), section_path))
+            else:
+                headings[element] = section_path
+    return headings
+
+
+def iter_layout_units(result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the paragraphs and tables of a layout result in reading order.
+
+    Paragraphs inside tables are skipped, since the table is yielded as a whole. Results without
+    paragraphs (e.g. from models that do not extract them) are yielded page by page.
+
+    :param result: The analyze result.
+    :return: An iterator of dictionaries with the keys `ref`, `text`, `role`, `start`, `end`,
+        `page_numbers` and `bounding_regions`.
+    """
+    paragraphs = result.get("paragraphs") or []
+    tables = result.get("tables") or []
+    content = result.get("content") or ""
+
+    if not paragraphs and not tables:
+        for page in result.get("pages") or []:
+            start, end = _span_range(page)
+            yield {
+                "ref": f"/pages/{page['pageNumber'] - 1}",
+                "text": content[start:end],
+                "role": None,
+                "start": start,
+                "end": end,
+                "page_numbers": [page["pageNumber"]],
+                "bounding_regions": [],
+            }
+        return
+
+    table_ranges = sorted(
+        (_span_range(table) + (index,) for index, table in enumerate(tables))
+    )
+    table_starts = [start for start, _, _ in table_ranges]
+
+    units = []
+    for index, paragraph in enumerate(paragraphs):
+        start, end = _span_range(paragraph)
+        position = bisect.bisect_right(table_starts, start) - 1
+        if position >= 0 and start < table_ranges[position][1]:
+            continue
+        units.append((start, end, "paragraphs", index))
+    units.extend((start, end, "tables", index) for start, end, index in table_ranges)
+    units.sort()
+
+    for start, end, kind, index in units:
+        element = paragraphs[index] if kind == "paragraphs" else tables[index]
+        regions = _regions(element)
+        yield {
+            "ref": f"/{kind}/{index}",
+            "text": element["content"]
+            if kind == "paragraphs"
+            else _table_to_text(element),
+            "role": element.get("role") if kind == "paragraphs" else "table",
+            "start": start,
+            "end": end,
+            "page_numbers": sorted({region["page_number"] for region in regions}),
+            "bounding_regions": regions,
+        }
+
+
+def chunk_layout(
+    result: Dict[str, Any],
+    chunk_size: int = 512,
+    source: Optional[str] = None,
+    encoding_name: str = "cl100k_base",
+) -> Iterator[Dict[str, Any]]:
+    """
+    Lazily splits a layout result into chunks of at most `chunk_size` tokens.
+
+    :param result: The analyze result (an `AnalyzeResult` or its dictionary form).
+    :param chunk_size: Maximum number of tokens of a chunk. Defaults to 512.
+    :param source: Identifier of the document, stored in the metadata and part of the chunk IDs. Defaults to None.
+    :param encoding_name: The tiktoken encoding used to count tokens. Defaults to "cl100k_base". If it cannot
+        be loaded (e.g. offline), tokens are estimated as one per four characters.
+    :return: An iterator of dictionaries with the keys `content` and `metadata`. The metadata holds `chunk_id`,
+        `chunk_index`, `source`, `page_numbers`, `bounding_regions`, `sections`, `token_count` and the
+        `start`/`end` offsets of the chunk in the result content.
+    """
+    encoding = _get_encoding(encoding_name)
+    headings = _section_headings(result)
+    state = {"chunk_index": 0}
+
+    def make_chunk(units: List[Dict[str, Any]], text: str, part=None):
+        start, end = units[0]["start"], units[-1]["end"]
+        key = f"{source}:{start}:{end}" + (f":{part}" if part is not None else "")
+        chunk = {
+            "content": text,
+            "metadata": {
+                "chunk_id": hashlib.sha256(key.encode("utf-8")).hexdigest()[:32],
+                "chunk_index": state["chunk_index"],
+                "source": source,
+                "page_numbers": sorted(
+                    {page for unit in units for page in unit["page_numbers"]}
+                ),
+                "bounding_regions": [
+                    region for unit in units for region in unit["bounding_regions"]
+                ],
+                "sections": headings.get(units[0]["ref"], []),
+                "token_count": _count_tokens(encoding, text),
+                "start": start,
+                "end": end,
+            },
+        }
+        state["chunk_index"] += 1
+        return chunk
+
+    pending: List[Dict[str, Any]] = []
+    pending_tokens = 0
+    for unit in iter_layout_units(result):
+        if unit["role"] in SKIPPED_ROLES or not unit["text"].strip():
+            continue
+        tokens = _count_tokens(encoding, unit["text"])
+        starts_section = unit["role"] in HEADING_ROLES or (
+            pending and headings.get(unit["ref"]) != headings.get(pending[0]["ref"])
+        )
+        # Units are joined with a blank line, which is counted as one token
+        if pending and (starts_section or pending_tokens + 1 + tokens > chunk_size):
+            yield make_chunk(pending, "\n\n".join(u["text"] for u in pending))
+            pending, pending_tokens = [], 0
+
+        if tokens > chunk_size:
+            # A single paragraph or table larger than a chunk is split on token boundaries
+            for part, piece in enumerate(
+                _split_tokens(encoding, unit["text"], chunk_size)
+            ):
+                yield make_chunk([unit], piece, part)
+            continue
+
+        pending_tokens += tokens + (1 if pending else 0)
+        pending.append(unit)
+
+    if pending:
+        yield make_chunk(pending, "\n\n".join(u["text"] for u in pending))
+    logger.info(
+        f"Split {source or 'document'} into {state['chunk_index']} chunks of at most {chunk_size} tokens."
+    )
@@ -0,0 +1,130 @@
+"""
+`polling.py` provides adaptive polling methods for Document Intelligence long-running operations.
+
+The default `LROBasePolling` waits a fixed interval between status checks. Most analyses finish
+in a few seconds, so a fixed interval long enough for large documents wastes most of it on small
+ones. These polling methods start with a sub-second delay and back off geometrically up to a cap,
+while never polling sooner than the service asks through `Retry-After`.
+"""
+import email.utils
+import time
+from typing import Any, Mapping, Optional
+
+from azure.core.polling.async_base_polling import AsyncLROBasePolling
+from azure.core.polling.base_polling import LROBasePolling
+
+DEFAULT_INITIAL_DELAY = 0.5
+DEFAULT_MAX_DELAY = 10.0
+DEFAULT_BACKOFF_FACTOR = 1.5
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Returns the delay requested by a response through its retry headers.
+
+    Supports `retry-after-ms`, `x-ms-retry-after-ms` and `Retry-After` in seconds or as an HTTP date.
+
+    :param headers: The response headers (looked up case-insensitively).
+    :return: The delay in seconds, or None if the response does not request one.
+    """
+    lowered = {key.lower(): value for key, value in headers.items()}
+    for header in ("retry-after-ms", "x-ms-retry-after-ms"):
+        if header in lowered:
+            try:
+                return max(0.0, float(lowered[header]) / 1000)
+            except ValueError:
+                pass
+    retry_after = lowered.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+class _AdaptiveDelayMixin:
+    """
+    Replaces the fixed polling interval of `LROBasePolling` by a geometric backoff.
+    """
+
+    # Set by the polling method the mixin is combined with
+    _pipeline_response: Any
+
+    def _init_adaptive_delay(
+        self, initial_delay: float, max_delay: float, backoff_factor: float
+    ) -> None:
+        self._next_delay = initial_delay
+        self._max_delay = max_delay
+        self._backoff_factor = backoff_factor
+
+    def _extract_delay(self) -> float:
+        delay = self._next_delay
+        self._next_delay = min(self._next_delay * self._backoff_factor, self._max_delay)
+        retry_after = retry_after_seconds(self._pipeline_response.http_response.headers)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class AdaptivePolling(_AdaptiveDelayMixin, LROBasePolling):
+    """
+    An `LROBasePolling` that backs off from `initial_delay` to `max_delay` and honors `Retry-After`.
+
+    A polling method tracks a single operation, so a new instance is needed for every call.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        initial_delay: float = DEFAULT_INITIAL_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        **kwargs: Any,
+    ):
+        """
+        Initialize the polling method.
+
+        :param endpoint: The Document Intelligence endpoint, used to resolve relative operation URLs.
+        :param initial_delay: Seconds to wait before the first status check. Defaults to 0.5.
+        :param max_delay: Maximum number of seconds between status checks, unless the service asks for more. Defaults to 10.
+        :param backoff_factor: Factor applied to the delay after each status check. Defaults to 1.5.
+        :param kwargs: Additional keyword arguments for `LROBasePolling`.
+        """
+        super().__init__(
+            timeout=initial_delay,
+            path_format_arguments={"endpoint": endpoint},
+            **kwargs,
+        )
+        self._init_adaptive_delay(initial_delay, max_delay, backoff_factor)
+
+
+class AsyncAdaptivePolling(_AdaptiveDelayMixin, AsyncLROBasePolling):
+    """
+    Async variant of `AdaptivePolling`, for the `aio` Document Intelligence client.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        initial_delay: float = DEFAULT_INITIAL_DELAY,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        **kwargs: Any,
+    ):
+        """
+        Initialize the polling method.
+
+        :param endpoint: The Document Intelligence endpoint, used to resolve relative operation URLs.
+        :param initial_delay: Seconds to wait before the first status check. Defaults to 0.5.
+        :param max_delay: Maximum number of seconds between status checks, unless the service asks for more. Defaults to 10.
+        :param backoff_factor: Factor applied to the delay after each status check. Defaults to 1.5.
+        :param kwargs: Additional keyword arguments for `AsyncLROBasePolling`.
+        """
+        super().__init__(
+            timeout=initial_delay,
+            path_format_arguments={"endpoint": endpoint},
+            **kwargs,
+        )
+        self._init_adaptive_delay(initial_delay, max_delay, backoff_factor)
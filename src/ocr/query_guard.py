@@ -0,0 +1,369 @@
+"""
+`query_guard.py` checks and rewrites LLM-generated Cosmos DB SQL before it is executed.
+
+Generated queries are often unbounded (`SELECT * FROM c` with no cap) and read heavy fields
+nobody asked for. The guard compiles a generated query into a safer one:
+
+- `SELECT *` becomes an explicit projection without heavy fields (attachments, long descriptions),
+- a `TOP` cap is injected, or an existing `TOP`/`OFFSET LIMIT` is clamped,
+- literals become query parameters, so the service can reuse query plans,
+- an estimated RU cost is computed, and queries over budget are rejected before reaching Cosmos DB.
+
+The cost model is a heuristic: it only ranks queries (index lookups vs. scans, small vs. heavy
+documents) and should be tuned with the `full_scan_items` and `max_cost` of the container.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Fields of the request documents indexed by the Submit page
+DEFAULT_REQUEST_FIELDS = (
+    "RequestTitle",
+    "Requester",
+    "RequesterEmail",
+    "Partner",
+    "ProjectedWorkHours",
+    "ExpectedStartDate",
+    "MSXID",
+    "TPID",
+    "PrimarySolutionArea",
+    "SecondarySolutionArea",
+    "CustomerName",
+    "OperatingUnit",
+    "ProblemDescription",
+    "ProjectedACR",
+    "NecessarySkills",
+    "AzureAIServices",
+    "EngagementCountry",
+    "EngagementRegion",
+    "MonthlyUsage",
+    "Attachment",
+    "CreatedDate",
+    "RequestId",
+    "Status",
+    "AssignedTo",
+    "AssignedDate",
+    "Approved",
+    "ApprovedDate",
+    "ApprovedBy",
+)
+
+# Fields left out of `SELECT *` unless they are selected explicitly
+DEFAULT_HEAVY_FIELDS = ("Attachment", "ProblemDescription")
+
+# System functions that prevent a filter from being served by the index alone
+_NON_INDEXED_FUNCTIONS = {
+    "CONTAINS",
+    "ENDSWITH",
+    "LOWER",
+    "UPPER",
+    "REGEXMATCH",
+    "SUBSTRING",
+    "INDEX_OF",
+    "TRIM",
+    "LTRIM",
+    "RTRIM",
+    "REPLACE",
+    "LENGTH",
+}
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<param>@\w+)
+    |(?P<word>[A-Za-z_]\w*)
+    |(?P<space>\s+)
+    |(?P<symbol>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_CLAUSE_KEYWORDS = {"WHERE", "ORDER", "GROUP", "OFFSET", "LIMIT", "JOIN"}
+
+
+class QueryRejectedError(ValueError):
+    """Raised when a generated query is invalid or over its cost budget."""
+
+
+def _tokenize(query: str) -> List[List[str]]:
+    """Splits a query into [kind, text] tokens."""
+    return [
+        [match.lastgroup or "", match.group()]
+        for match in _TOKEN_PATTERN.finditer(query)
+    ]
+
+
+def _literal_value(kind: str, text: str) -> Any:
+    """Converts a string or number token into its Python value."""
+    if kind == "number":
+        return float(text) if any(c in text for c in ".eE") else int(text)
+    return re.sub(r"\\(.)", r"\1", text[1:-1])
+
+
+def _strip_wrapping(query: str) -> str:
+    """Removes the Markdown code fences and trailing semicolons LLMs often add around a query."""
+    query = query.strip()
+    fenced = re.match(r"^```(?:\w+)?\s*(.*?)\s*```$", query, re.DOTALL)
+    if fenced:
+        query = fenced.group(1)
+    return query.strip().rstrip(";").strip()
+
+
+class CosmosQueryGuard:
+    """
+    Compiles LLM-generated Cosmos DB SQL into a bounded, parameterized, cost-checked query.
+
+    Attributes:
+        fields (Sequence[str]): Fields of the documents, used to expand `SELECT *`.
+        heavy_fields (Sequence[str]): Fields dropped from `SELECT *` unless selected explicitly.
+        max_items (int): Maximum number of items a query may return.
+        max_cost (float): Estimated RU budget of a query; more expensive queries are rejected.
+        full_scan_items (int): Approximate number of documents read by a query that cannot use the index.
+    """
+
+    BASE_COST = 2.5
+    SCAN_COST_PER_ITEM = 0.05
+    READ_COST_PER_ITEM = 1.0
+    HEAVY_FIELD_FACTOR = 10.0
+    JOIN_FACTOR = 3.0
+
+    def __init__(
+        self,
+        fields: Optional[Sequence[str]] = DEFAULT_REQUEST_FIELDS,
+        heavy_fields: Sequence[str] = DEFAULT_HEAVY_FIELDS,
+        max_items: int = 50,
+        max_cost: float = 1000.0,
+        full_scan_items: int = 10000,
+    ):
+        """
+        Initialize the query guard.
+
+        :param fields: Fields of the documents, used to expand `SELECT *`. If None, `SELECT *` is kept as is.
+            Defaults to the fields of the request documents.
+        :param heavy_fields: Fields dropped from `SELECT *` unless selected explicitly. Defaults to
+            ("Attachment", "ProblemDescription").
+        :param max_items: Maximum number of items a query may return. Defaults to 50.
+        :param max_cost: Estimated RU budget of a query. Defaults to 1000.
+        :param full_scan_items: Approximate number of documents read by a query that cannot use the index.
+            Defaults to 10000.
+        """
+        self.fields = fields
+        self.heavy_fields = heavy_fields
+        self.max_items = max_items
+        self.max_cost = max_cost
+        self.full_scan_items = full_scan_items
+
+    def compile(self, query: str) -> Dict[str, Any]:
+        """
+        Compiles a generated query.
+
+        :param query: The SQL query, possibly wrapped in a Markdown code block.
+        :return: A dictionary with the keys `query` (the rewritten SQL), `parameters` (for `query_items`),
+            `estimated_cost` (RU) and `rewrites` (descriptions of the changes made).
+        :raises QueryRejectedError: If the query is empty, is not a single SELECT statement or is over budget.
+        """
+        if not isinstance(query, str) or not query.strip():
+            raise QueryRejectedError("No query was generated.")
+        tokens = _tokenize(_strip_wrapping(query))
+        clauses = self._top_level_keywords(tokens)
+        if not tokens or tokens[0][1].upper() != "SELECT":
+            raise QueryRejectedError("Only SELECT queries can be executed.")
+        if any(kind == "symbol" and text == ";" for kind, text in tokens):
+            raise QueryRejectedError("Only a single query can be executed.")
+
+        rewrites: List[str] = []
+        heavy_projected = self._rewrite_projection(tokens, clauses, rewrites)
+        returned_items = self._cap_items(tokens, clauses, rewrites)
+        parameters = self._parameterize(
+            tokens, clauses.get("FROM", len(tokens)), rewrites
+        )
+        estimated_cost = self._estimate_cost(
+            tokens, clauses, returned_items, heavy_projected
+        )
+
+        if estimated_cost > self.max_cost:
+            raise QueryRejectedError(
+                f"Estimated query cost of {estimated_cost:.0f} RU is over the budget of {self.max_cost:.0f} RU."
+            )
+        logger.info(
+            f"Compiled query ({'; '.join(rewrites) or 'unchanged'}), estimated cost {estimated_cost:.1f} RU."
+        )
+        return {
+            "query": "".join(text for _, text in tokens),
+            "parameters": parameters,
+            "estimated_cost": estimated_cost,
+            "rewrites": rewrites,
+        }
+
+    @staticmethod
+    def _top_level_keywords(tokens: List[List[str]]) -> Dict[str, int]:
+        """Maps the keywords found outside parentheses to the index of their first token."""
+        keywords: Dict[str, int] = {}
+        depth = 0
+        for index, (kind, text) in enumerate(tokens):
+            if kind == "symbol" and text in "([":
+                depth += 1
+            elif kind == "symbol" and text in ")]":
+                depth -= 1
+            elif kind == "word" and depth == 0:
+                keywords.setdefault(text.upper(), index)
+        return keywords
+
+    @staticmethod
+    def _next_token(tokens: List[List[str]], index: int) -> int:
+        """Returns the index of the next non-space token after `index`, or len(tokens)."""
+        index += 1
+        while index < len(tokens) and tokens[index][0] == "space":
+            index += 1
+        return index
+
+    def _select_body_start(self, tokens: List[List[str]]) -> int:
+        """Returns the index of the first token after SELECT [DISTINCT] [VALUE] [TOP n]."""
+        index = self._next_token(tokens, 0)
+        while index < len(tokens) and tokens[index][1].upper() in (
+            "DISTINCT",
+            "VALUE",
+            "TOP",
+        ):
+            if tokens[index][1].upper() == "TOP":
+                index = self._next_token(tokens, index)
+            index = self._next_token(tokens, index)
+        return index
+
+    def _rewrite_projection(
+        self, tokens: List[List[str]], clauses: Dict[str, int], rewrites: List[str]
+    ) -> bool:
+        """
+        Replaces `SELECT *` with a projection without heavy fields.
+
+        :return: Whether the query still projects heavy fields.
+        """
+        body = self._select_body_start(tokens)
+        from_index = clauses.get("FROM", len(tokens))
+        if body >= len(tokens) or tokens[body][1] != "*":
+            projection = {
+                text for kind, text in tokens[body:from_index] if kind == "word"
+            }
+            return any(field in projection for field in self.heavy_fields)
+        if self.fields is None or "JOIN" in clauses or "FROM" not in clauses:
+            return True
+
+        # The alias is the word after the container name, if any: FROM c, FROM root r, FROM Requests AS r
+        alias_index = self._next_token(tokens, from_index)
+        alias = tokens[alias_index][1]
+        candidate = self._next_token(tokens, alias_index)
+        if candidate < len(tokens) and tokens[candidate][1].upper() == "AS":
+            candidate = self._next_token(tokens, candidate)
+        if (
+            candidate < len(tokens)
+            and tokens[candidate][0] == "word"
+            and tokens[candidate][1].upper() not in _CLAUSE_KEYWORDS
+        ):
+            alias = tokens[candidate][1]
+
+        projected = ["id"] + [f for f in self.fields if f not in self.heavy_fields]
+        tokens[body] = ["projection", ", ".join(f"{alias}.{f}" for f in projected)]
+        rewrites.append(
+            f"replaced SELECT * with a projection without {', '.join(self.heavy_fields)}"
+        )
+        return False
+
+    def _cap_items(
+        self, tokens: List[List[str]], clauses: Dict[str, int], rewrites: List[str]
+    ) -> int:
+        """
+        Clamps `OFFSET LIMIT` or `TOP`, or injects `TOP max_items`.
+
+        :return: The maximum number of items the query can return.
+        """
+        if "LIMIT" in clauses:
+            limit_index = self._next_token(tokens, clauses["LIMIT"])
+            if tokens[limit_index][0] == "number":
+                limit = int(float(tokens[limit_index][1]))
+                if limit > self.max_items:
+                    tokens[limit_index] = ["cap", str(self.max_items)]
+                    rewrites.append(f"clamped LIMIT {limit} to {self.max_items}")
+                return min(limit, self.max_items)
+            return self.max_items
+
+        top_index = clauses.get("TOP")
+        if top_index is not None and top_index < clauses.get("FROM", len(tokens)):
+            count_index = self._next_token(tokens, top_index)
+            if tokens[count_index][0] == "number":
+                top = int(float(tokens[count_index][1]))
+                if top > self.max_items:
+                    tokens[count_index] = ["cap", str(self.max_items)]
+                    rewrites.append(f"clamped TOP {top} to {self.max_items}")
+                return min(top, self.max_items)
+            return self.max_items
+
+        # TOP goes after SELECT [DISTINCT], before VALUE and the projection
+        insert_after = 0
+        next_index = self._next_token(tokens, 0)
+        if next_index < len(tokens) and tokens[next_index][1].upper() == "DISTINCT":
+            insert_after = next_index
+        tokens[insert_after] = [
+            tokens[insert_after][0],
+            f"{tokens[insert_after][1]} TOP {self.max_items}",
+        ]
+        rewrites.append(f"added TOP {self.max_items}")
+        return self.max_items
+
+    @staticmethod
+    def _parameterize(
+        tokens: List[List[str]], start: int, rewrites: List[str]
+    ) -> List[Dict[str, Any]]:
+        """
+        Replaces string and number literals from `start` (the FROM clause) on with parameters.
+
+        Literals of the projection and property names such as c["name"] are kept.
+        """
+        parameters: List[Dict[str, Any]] = []
+        previous_symbol = None
+        for token in tokens[start:]:
+            kind, text = token
+            if kind in ("string", "number") and previous_symbol != "[":
+                name = f"@p{len(parameters)}"
+                parameters.append({"name": name, "value": _literal_value(kind, text)})
+                token[:] = ["param", name]
+            if kind != "space":
+                previous_symbol = text if kind == "symbol" else None
+        if parameters:
+            rewrites.append(f"parameterized {len(parameters)} literals")
+        return parameters
+
+    def _estimate_cost(
+        self,
+        tokens: List[List[str]],
+        clauses: Dict[str, int],
+        returned_items: int,
+        heavy_projected: bool,
+    ) -> float:
+        """
+        Estimates the RU cost of a query: an index lookup or a scan, plus the cost of reading the results.
+        """
+        where_index = clauses.get("WHERE")
+        if where_index is None:
+            scanned_items = self.full_scan_items
+        else:
+            filter_words = {
+                text.upper() for kind, text in tokens[where_index:] if kind == "word"
+            }
+            uses_index = not (filter_words & _NON_INDEXED_FUNCTIONS) and (
+                "LIKE" not in filter_words
+            )
+            scanned_items = returned_items if uses_index else self.full_scan_items
+
+        read_cost = self.READ_COST_PER_ITEM * returned_items
+        if heavy_projected:
+            read_cost *= self.HEAVY_FIELD_FACTOR
+        cost = self.BASE_COST + self.SCAN_COST_PER_ITEM * scanned_items + read_cost
+        if "JOIN" in clauses:
+            cost *= self.JOIN_FACTOR
+        return round(cost, 2)
@@ -1,19 +1,129 @@
+import asyncio
 import base64
+import json
 import os
-from typing import Dict, List, Optional, Union
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
+import httpx
 import openai
 import requests
 from dotenv import load_dotenv
 from IPython.display import Image, display
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
+from src.aoai.deployment_pool import DeploymentPool
+from src.cache.response_cache import ResponseCache
 from src.extractors.blob_data_extractor import AzureBlobDataExtractor
+from src.ocr.image_preprocessor import ImagePreprocessor, detect_mime_type
+from src.resilience import (
+    STREAM_INTERRUPTED_MESSAGE,
+    CircuitOpenError,
+    ResiliencePolicy,
+    get_default_policy,
+)
 from utils.ml_logging import get_logger
 
 # Initialize logging
 logger = get_logger()
 
+# Transport defaults shared by every GPT4VisionManager in the process
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+
+# Marker returned when a server-sent events stream signals its end
+_STREAM_DONE = object()
+
+
+class VisionRequest:
+    """
+    An immutable, request-scoped set of messages for a GPT-4 Vision API call.
+
+    The messages are built and validated once, in time linear in the number of images, and never
+    mutated afterwards. A single instance can therefore be shared between threads and reused to fan
+    out several calls (e.g. with different sampling parameters) without re-encoding the images.
+
+    Attributes:
+        system_text (Optional[str]): The system text message.
+        user_text (Optional[str]): The user text prompt.
+        image_parts (Tuple[Dict, ...]): The image_url content parts attached to the user message.
+    """
+
+    __slots__ = ("system_text", "user_text", "image_parts")
+
+    system_text: Optional[str]
+    user_text: Optional[str]
+    image_parts: Tuple[Dict, ...]
+
+    def __init__(
+        self,
+        system_text: Optional[str] = None,
+        user_text: Optional[str] = None,
+        image_parts: Sequence[Dict] = (),
+    ):
+        """
+        Initialize the request.
+
+        :param system_text: The system text message. If None, no system message is sent.
+        :param user_text: The user text prompt. If None, the user message only carries the images.
+        :param image_parts: The image_url content parts to attach to the user message.
+        :raises ValueError: If an image part is not a valid image_url content part, or the request is empty.
+        """
+        for part in image_parts:
+            if part.get("type") != "image_url" or "url" not in part.get(
+                "image_url", {}
+            ):
+                raise ValueError(f"Invalid image content part: {part!r:.100}")
+        if system_text is None and user_text is None and not image_parts:
+            raise ValueError("A vision request needs instructions or images.")
+
+        object.__setattr__(self, "system_text", system_text)
+        object.__setattr__(self, "user_text", user_text)
+        object.__setattr__(self, "image_parts", tuple(image_parts))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("VisionRequest is immutable.")
+
+    def to_messages(self) -> List[Dict]:
+        """
+        Returns the messages of the request as a fresh list, ready to be used in an API payload.
+
+        :return: A list of dictionaries formatted as messages for the GPT-4 Vision API.
+        """
+        messages = []
+        if self.system_text is not None:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": [{"type": "text", "text": self.system_text}],
+                }
+            )
+        user_content = []
+        if self.user_text is not None:
+            user_content.append({"type": "text", "text": self.user_text})
+        user_content.extend(self.image_parts)
+        messages.append({"role": "user", "content": user_content})
+        return messages
+
 
 class GPT4VisionManager:
     """
@@ -24,8 +134,16 @@ class GPT4VisionManager:
         deployment_name (str): Name of the deployment.
         openai_api_version (str): API version.
         openai_api_key (str): OpenAI API key.
+        timeout (Tuple[float, float]): Connect and read timeouts, in seconds, for each API call.
+
+    HTTP connections are pooled and kept alive at class level, so every instance in the
+    process reuses the same TCP/TLS connections to the AOAI endpoint.
     """
 
+    _session: Optional[requests.Session] = None
+    _async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+    _transport_lock = threading.Lock()
+
     def __init__(
         self,
         openai_api_base: Optional[str] = None,
@@ -33,6 +151,15 @@ class GPT4VisionManager:
         openai_api_version: Optional[str] = None,
         openai_api_key: Optional[str] = None,
         container_name: Optional[str] = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        keep_alive: bool = True,
+        keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+        cache: Optional[ResponseCache] = None,
+        image_preprocessor: Optional[ImagePreprocessor] = None,
+        resilience: Optional[ResiliencePolicy] = None,
+        deployment_pool: Optional[DeploymentPool] = None,
     ):
         """
         Initialize the GPT4Vision class with OpenAI API configurations.
@@ -42,6 +169,20 @@ class GPT4VisionManager:
         :param openai_api_version: API version.
         :param openai_api_key: OpenAI API key.
         :param container_client: Azure Container Client specific to the container.
+        :param pool_maxsize: Maximum number of pooled connections per host. The shared pool is sized by the
+            first instance that creates it; call `reset_transport` to rebuild it with new settings.
+        :param connect_timeout: Seconds to wait for a connection to the endpoint to be established.
+        :param read_timeout: Seconds to wait for the endpoint to send a response.
+        :param keep_alive: Whether to keep connections open between calls. Defaults to True.
+        :param keepalive_expiry: Seconds an idle connection is kept in the async pool before it is closed.
+        :param cache: Optional response cache. Identical requests (same deployment, messages, images and
+            sampling parameters) are then answered from the cache instead of calling the API.
+        :param image_preprocessor: Optional preprocessor that downscales and re-encodes images, and picks their
+            detail level, before they are uploaded. Without it, images are sent as-is.
+        :param resilience: Retry, backoff and circuit breaker policy of the API calls. Defaults to the policy
+            shared by the process (`get_default_policy`).
+        :param deployment_pool: Optional pool of endpoints and deployments. Requests for `deployment_name` are
+            then spread over its members, which fail over to each other.
         """
         self.openai_api_base = openai_api_base
         self.deployment_name = deployment_name
@@ -50,8 +191,95 @@ class GPT4VisionManager:
         if not self.openai_api_base or not self.openai_api_key:
             self.load_environment_variables_from_env_file()
 
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.keepalive_expiry = keepalive_expiry
+        self.messages: Optional[List[Dict]] = None
+        self.last_stream_stats: Optional[Dict] = None
+        self.cache = cache
+        self.image_preprocessor = image_preprocessor
+        self.resilience = resilience or get_default_policy()
+        self.deployment_pool = deployment_pool
+        self.preprocessing_stats = {"images": 0, "bytes_saved": 0, "tokens_saved": 0}
+        self._stats_lock = threading.Lock()
+
         self.blob_manager = AzureBlobDataExtractor(container_name=container_name)
 
+    @classmethod
+    def _get_session(cls, pool_maxsize: int = DEFAULT_POOL_MAXSIZE) -> requests.Session:
+        """
+        Returns the process-wide HTTP session, creating it on first use. (Internal method)
+
+        :param pool_maxsize: Maximum number of pooled connections per host.
+        :return: A `requests.Session` backed by a keep-alive connection pool.
+        """
+        with cls._transport_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=pool_maxsize,
+                    max_retries=0,
+                )
+                session.mount("https://", adapter)
+                cls._session = session
+                logger.info(
+                    f"Created shared HTTP connection pool (pool_maxsize={pool_maxsize})."
+                )
+            return cls._session
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """
+        Returns the shared async HTTP client for the running event loop, creating it on first use. (Internal method)
+
+        An `httpx.AsyncClient` is bound to the event loop it was first used on, so one client is kept
+        per loop and released together with the loop.
+
+        :return: An `httpx.AsyncClient` backed by a keep-alive connection pool.
+        """
+        loop = asyncio.get_running_loop()
+        with self._transport_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_maxsize,
+                        max_keepalive_connections=(
+                            self.pool_maxsize if self.keep_alive else 0
+                        ),
+                        keepalive_expiry=self.keepalive_expiry,
+                    ),
+                    timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                )
+                self._async_clients[loop] = client
+                logger.info(
+                    f"Created shared async HTTP connection pool (pool_maxsize={self.pool_maxsize})."
+                )
+            return client
+
+    @classmethod
+    def reset_transport(cls) -> None:
+        """
+        Closes the shared HTTP session and async clients so the next call builds new connection pools.
+
+        Each async client is closed on its own event loop: right away if that loop is idle, or as soon as it
+        gets control if it is running. Clients of loops already closed can no longer be closed and are dropped.
+        """
+        with cls._transport_lock:
+            if cls._session is not None:
+                cls._session.close()
+                cls._session = None
+            async_clients = list(cls._async_clients.items())
+            cls._async_clients = weakref.WeakKeyDictionary()
+        for loop, client in async_clients:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            else:
+                loop.run_until_complete(client.aclose())
+
     def load_environment_variables_from_env_file(self):
         """
         Loads required environment variables for the application from a .env file.
@@ -157,39 +385,555 @@ class GPT4VisionManager:
         return True
 
     def add_image_url_to_user_message(
-        self, image_url: str, message: Optional[Dict] = None
-    ) -> Dict:
+        self,
+        image_url: str,
+        message: Optional[List[Dict]] = None,
+        detail: Optional[str] = None,
+    ) -> List[Dict]:
         """
         Adds the image URL to the user message.
 
         :param image_url: The URL of the image to be processed.
         :param message: The user message to which the image URL will be added.
+        :param detail: Optional detail level of the image, "low" or "high". Defaults to the service's choice.
         :return: The updated user message with the image URL added.
         """
         try:
-            if message is None and self.messages is None:
+            messages = message if message is not None else self.messages
+            if messages is None:
                 raise ValueError("No message provided to add the image URL to.")
-            else:
-                self.messages = message if message is not None else self.messages
+            self.messages = messages
 
-            if not self._validate_message_structure(self.messages):
+            # Only the message being extended needs checking; re-walking every message per image is quadratic
+            if not self._validate_message_structure(messages[-1:]):
                 raise ValueError("Invalid message structure.")
 
-            self.messages[-1]["content"].append(
-                {"type": "image_url", "image_url": {"url": image_url}}
-            )
+            messages[-1]["content"].append(self._image_content(image_url, detail))
             logger.info("Image URL added to user message successfully.")
 
-            return self.messages
+            return messages
         except Exception as e:
             logger.error(
                 f"An error occurred while adding the image URL to the user message: {e}"
             )
             raise
 
+    @staticmethod
+    def _image_content(image_url: str, detail: Optional[str] = None) -> Dict:
+        """
+        Builds the message content part of an image. (Internal method)
+
+        :param image_url: The URL of the image.
+        :param detail: Optional detail level of the image.
+        :return: A dictionary formatted as an image_url content part.
+        """
+        image = {"url": image_url}
+        if detail is not None:
+            image["detail"] = detail
+        return {"type": "image_url", "image_url": image}
+
+    def _read_image_bytes(self, image_file_path: str) -> bytes:
+        """
+        Reads a local image, or an image stored in Azure Blob Storage. (Internal method)
+
+        :param image_file_path: Local path or HTTPS blob URL of the image.
+        :return: The image content.
+        :raises ValueError: If the path is an HTTP URL or a non-blob HTTPS URL.
+        :raises FileNotFoundError: If the image file is not found.
+        """
+        if image_file_path.startswith(("http://", "https://")):
+            if image_file_path.startswith("http://"):
+                raise ValueError("HTTP URLs are not supported. Please use HTTPS.")
+            # If it's an HTTPS URL but contains "blob.core.windows.net", process it as a blob
+            elif "blob.core.windows.net" in image_file_path:
+                logger.info("Blob URL detected. Extracting content.")
+                return self.blob_manager.extract_content(image_file_path)
+            raise ValueError("Only Azure Blob Storage HTTPS URLs are supported.")
+        try:
+            with open(image_file_path, "rb") as image_file:
+                return image_file.read()
+        except FileNotFoundError as e:
+            logger.error(f"Image file not found: {e}")
+            raise
+
+    def _encode_image_url(self, image_file_path: str) -> Tuple[str, Optional[str]]:
+        """
+        Encodes an image as a base64 data URL, preprocessing it first if a preprocessor is configured. (Internal method)
+
+        :param image_file_path: Local path or HTTPS blob URL of the image.
+        :return: A tuple of (data URL, detail level or None).
+        """
+        image_bytes = self._read_image_bytes(image_file_path)
+        detail = None
+
+        if self.image_preprocessor is not None:
+            processed = self.image_preprocessor.process(image_bytes)
+            image_bytes, mime_type = processed["data"], processed["mime_type"]
+            detail = processed["detail"]
+            with self._stats_lock:
+                self.preprocessing_stats["images"] += 1
+                self.preprocessing_stats["bytes_saved"] += processed["bytes_saved"]
+                self.preprocessing_stats["tokens_saved"] += processed["tokens_saved"]
+        else:
+            mime_type = detect_mime_type(image_bytes)
+
+        return (
+            f"data:{mime_type};base64,{self._encode_bytes_to_base64(image_bytes)}",
+            detail,
+        )
+
+    def build_vision_request(
+        self,
+        image_file_paths: Union[str, List[str], None] = None,
+        system_instruction: Optional[str] = None,
+        user_instruction: Optional[str] = None,
+    ) -> VisionRequest:
+        """
+        Encodes the images once and builds an immutable request that can be passed to any number of calls.
+
+        :param image_file_paths: Local paths or HTTPS blob URLs of the images to attach.
+        :param system_instruction: Optional system instruction text.
+        :param user_instruction: Optional user instruction text.
+        :return: A `VisionRequest` holding the messages of the call.
+        """
+        if image_file_paths is None:
+            image_file_paths = []
+        elif isinstance(image_file_paths, str):
+            image_file_paths = [image_file_paths]
+
+        image_parts = [
+            self._image_content(*self._encode_image_url(image_file_path))
+            for image_file_path in image_file_paths
+        ]
+        return VisionRequest(system_instruction, user_instruction, image_parts)
+
+    def _build_request(
+        self,
+        image_file_paths: Union[str, List[str], None] = None,
+        system_instruction: Optional[str] = None,
+        user_instruction: Optional[str] = None,
+        ocr: bool = False,
+        grounding: bool = False,
+        in_context: Optional[Dict] = None,
+        use_vision_api: bool = False,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        max_tokens: int = 1000,
+        seed: int = 5555,
+        model_version: str = "gpt-4-vision-preview",
+        vision_request: Optional[VisionRequest] = None,
+    ) -> Tuple[str, Dict, Dict]:
+        """
+        Builds the URL, headers and payload for a GPT-4 Vision API call. (Internal method)
+
+        Parameters are the same as for `call_gpt4v_image`. The messages are built for this call only,
+        so the manager can be used from several threads at once.
+
+        :return: A tuple of (api_url, headers, payload).
+        """
+        if vision_request is None:
+            vision_request = self.build_vision_request(
+                image_file_paths, system_instruction, user_instruction
+            )
+        messages = vision_request.to_messages()
+
+        if use_vision_api:
+            azure_endpoint_vision = os.getenv("AZURE_ENDPOINT_VISION")
+            azure_key_vision = os.getenv("AZURE_KEY_VISION")
+
+            if not azure_endpoint_vision or not azure_key_vision:
+                logger.error(
+                    "Missing required Azure Computer Vision environment variables."
+                )
+                raise SystemExit(
+                    "Missing required Azure Computer Vision environment variables."
+                )
+
+            vision_api_config = {
+                "endpoint": azure_endpoint_vision,
+                "key": azure_key_vision,
+            }
+
+        if not all(
+            [
+                self.openai_api_base,
+                self.deployment_name,
+                self.openai_api_version,
+                self.openai_api_key,
+            ]
+        ):
+            raise SystemExit(
+                "Missing required OpenAI environment variables. "
+                "Please call the function load_environment_variables_from_env_file"
+            )
+
+        api_url = (
+            f"{self.openai_api_base}/openai/deployments/{self.deployment_name}/"
+            f"{'extensions/' if ocr or grounding else ''}chat/completions?api-version={self.openai_api_version}"
+        )
+
+        # Log the request
+        logger.info(f"Sending request to {api_url}")
+
+        # Payload setup
+        payload = {
+            "model": model_version,
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens,
+            "seed": seed,
+        }
+
+        # HTTP headers
+        headers = {
+            "Content-Type": "application/json",
+            "api-key": self.openai_api_key,
+        }
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+
+        if ocr or grounding:
+            payload["enhancements"] = {
+                "ocr": {"enabled": ocr},
+                "grounding": {"enabled": grounding},
+            }
+
+        data_sources = []
+
+        if in_context is not None:
+            data_sources.append(
+                {"type": "AzureCognitiveSearch", "parameters": in_context}
+            )
+
+        if use_vision_api:
+            data_sources.append(
+                {"type": "AzureComputerVision", "parameters": vision_api_config}
+            )
+
+        if data_sources:
+            payload["dataSources"] = data_sources
+
+        return api_url, headers, payload
+
+    def _send(self, api_url: str, headers: Dict, payload: Dict) -> str:
+        """
+        Sends a prepared request through the shared connection pool. (Internal method)
+
+        :param api_url: The chat completions URL.
+        :param headers: The HTTP headers.
+        :param payload: The JSON payload.
+        :return: The content of the model's response.
+        :raises RequestException: If the request fails or returns a non-2xx status code.
+        """
+        cache_key = self._cache_key(api_url, payload)
+        if cache_key is not None and self.cache is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                logger.info("Response served from cache.")
+                return content
+
+        logger.info(f"Sending request to {api_url} with payload: {payload}")
+
+        def post(url: str, request_headers: Dict) -> requests.Response:
+            response = self._get_session(self.pool_maxsize).post(
+                url, headers=request_headers, json=payload, timeout=self.timeout
+            )
+            response.raise_for_status()
+            return response
+
+        response = self._dispatch(api_url, headers, post)
+        logger.info("Request successful.")
+        content = response.json()["choices"][0]["message"]["content"]
+
+        if cache_key is not None and self.cache is not None:
+            self.cache.set(cache_key, content)
+        return content
+
+    def _member_request(
+        self, member: Dict, deployment: str, api_url: str, headers: Dict
+    ) -> Tuple[str, Dict]:
+        """
+        Returns the URL and headers of a request sent to a member of the deployment pool. (Internal method)
+
+        :param member: The member of the pool.
+        :param deployment: The name of the deployment on the member.
+        :param api_url: The URL of the request for the configured endpoint.
+        :param headers: The HTTP headers of the request for the configured endpoint.
+        :return: A tuple of (api_url, headers).
+        """
+        prefix = f"{self.openai_api_base}/openai/deployments/{self.deployment_name}/"
+        url = (
+            f"{member['azure_endpoint']}/openai/deployments/{deployment}/"
+            f"{api_url[len(prefix):]}"
+        )
+        if member["api_version"]:
+            url = f"{url.split('?', 1)[0]}?api-version={member['api_version']}"
+        return url, {**headers, "api-key": member["api_key"]}
+
+    def _dispatch(
+        self,
+        api_url: str,
+        headers: Dict,
+        send: Callable[[str, Dict], Any],
+        hedge: bool = True,
+    ) -> Any:
+        """
+        Sends a request through the resilience policy, or through the deployment pool if there is one. (Internal method)
+
+        :param api_url: The chat completions URL.
+        :param headers: The HTTP headers.
+        :param send: Function sending the request, called with a URL and headers.
+        :param hedge: Whether the pool may hedge the request. Defaults to True.
+        :return: The return value of `send`.
+        """
+        if self.deployment_pool is None or self.deployment_name is None:
+            return self.resilience.call(
+                self._endpoint_key(api_url), send, api_url, headers
+            )
+        return self.deployment_pool.call(
+            self.deployment_name,
+            lambda member, deployment: send(
+                *self._member_request(member, deployment, api_url, headers)
+            ),
+            hedge=hedge,
+        )
+
+    async def _adispatch(
+        self,
+        api_url: str,
+        headers: Dict,
+        send: Callable[[str, Dict], Awaitable[Any]],
+        hedge: bool = True,
+    ) -> Any:
+        """
+        Async variant of `_dispatch`, for a coroutine function `send`. (Internal method)
+        """
+        if self.deployment_pool is None or self.deployment_name is None:
+            return await self.resilience.acall(
+                self._endpoint_key(api_url), send, api_url, headers
+            )
+        return await self.deployment_pool.acall(
+            self.deployment_name,
+            lambda member, deployment: send(
+                *self._member_request(member, deployment, api_url, headers)
+            ),
+            hedge=hedge,
+        )
+
+    @staticmethod
+    def _endpoint_key(api_url: str) -> str:
+        """Returns the endpoint identifier of a request URL for the resilience policy. (Internal method)"""
+        return api_url.split("?", 1)[0]
+
+    def _cache_key(self, api_url: str, payload: Dict) -> Optional[str]:
+        """
+        Returns the response cache key of a request, or None if caching is disabled. (Internal method)
+
+        The URL carries the endpoint, deployment, API version and whether enhancements are used; the payload
+        carries the model version, messages (images are keyed by a digest of their content) and sampling
+        parameters. The API key is never part of the key.
+
+        :param api_url: The chat completions URL.
+        :param payload: The JSON payload.
+        :return: The cache key or None.
+        """
+        if self.cache is None:
+            return None
+        payload = {
+            k: v for k, v in payload.items() if k not in ("stream", "stream_options")
+        }
+        return self.cache.make_key(api_url=api_url, payload=payload)
+
+    @staticmethod
+    def _parse_sse_line(line: str, stats: Dict) -> Union[str, object, None]:
+        """
+        Parses one line of a server-sent events stream of chat completion chunks. (Internal method)
+
+        :param line: The line, without its trailing newline.
+        :param stats: The stream statistics; `usage` is recorded when the service sends it.
+        :return: The content delta carried by the line, `_STREAM_DONE` at the end of the stream, or None.
+        """
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:") :].strip()
+        if data == "[DONE]":
+            stats["completed"] = True
+            return _STREAM_DONE
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            stats["usage"] = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            if choice.get("finish_reason"):
+                stats["completed"] = True
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                return delta
+        return None
+
+    def _iter_stream(
+        self, lines: Iterable[str], start: float, stats: Dict
+    ) -> Iterator[str]:
+        """
+        Yields the content deltas of an SSE stream and keeps the stream statistics up to date. (Internal method)
+
+        :param lines: The decoded lines of the response body.
+        :param start: `time.perf_counter()` when the request was sent.
+        :param stats: The stream statistics to update.
+        :return: An iterator over content deltas.
+        """
+        for line in lines:
+            delta = self._parse_sse_line(line, stats)
+            if delta is _STREAM_DONE:
+                break
+            if isinstance(delta, str) and delta:
+                if stats["time_to_first_token"] is None:
+                    stats["time_to_first_token"] = time.perf_counter() - start
+                stats["chunks"] += 1
+                yield delta
+
+    @staticmethod
+    def _new_stream_stats() -> Dict:
+        """Returns empty statistics for a streamed response. (Internal method)"""
+        return {
+            "time_to_first_token": None,
+            "total_time": None,
+            "chunks": 0,
+            "usage": None,
+            # Whether the end of the stream was received, and the error that interrupted it
+            "completed": False,
+            "error": None,
+        }
+
+    def _send_stream(self, api_url: str, headers: Dict, payload: Dict) -> Iterator[str]:
+        """
+        Sends a prepared request with streaming enabled and yields the content deltas as they arrive. (Internal method)
+
+        Once the stream is exhausted, `self.last_stream_stats` holds the time to first token, the total time,
+        the number of chunks and the token usage when the service reports it.
+
+        :param api_url: The chat completions URL.
+        :param headers: The HTTP headers.
+        :param payload: The JSON payload.
+        :return: An iterator over content deltas.
+        :raises RequestException: If the request fails or returns a non-2xx status code.
+        """
+        stats = self._new_stream_stats()
+        self.last_stream_stats = stats
+        start = time.perf_counter()
+
+        cache_key = self._cache_key(api_url, payload)
+        if cache_key is not None and self.cache is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                logger.info("Response served from cache.")
+                stats.update(
+                    time_to_first_token=0.0, total_time=0.0, chunks=1, completed=True
+                )
+                yield content
+                return
+
+        logger.info(f"Sending streaming request to {api_url}")
+
+        def open_stream(url: str, request_headers: Dict) -> requests.Response:
+            response = self._get_session(self.pool_maxsize).post(
+                url,
+                headers=request_headers,
+                json={**payload, "stream": True},
+                timeout=self.timeout,
+                stream=True,
+            )
+            try:
+                response.raise_for_status()
+            except RequestException:
+                response.close()
+                raise
+            return response
+
+        # Only opening the stream is retried; a stream cut midway is not replayed
+        parts: List[str] = []
+        with self._dispatch(api_url, headers, open_stream, hedge=False) as response:
+            for delta in self._iter_stream(
+                response.iter_lines(decode_unicode=True), start, stats
+            ):
+                parts.append(delta)
+                yield delta
+
+        stats["total_time"] = time.perf_counter() - start
+        logger.info(
+            f"Stream finished: first token after {stats['time_to_first_token']}s, "
+            f"{stats['chunks']} chunks in {stats['total_time']:.2f}s."
+        )
+        interrupted = self._finish_stream(cache_key, parts, stats)
+        if interrupted:
+            yield interrupted
+
+    def _finish_stream(
+        self, cache_key: Optional[str], parts: List[str], stats: Dict
+    ) -> Optional[str]:
+        """
+        Caches a streamed response, unless the stream ended before its terminal event. (Internal method)
+
+        :return: The text to yield after the response if the stream was cut off, None otherwise.
+        """
+        if not stats["completed"]:
+            logger.warning("Stream ended before its last event; not caching it.")
+            return self._stream_failed("The stream ended before its last event.")
+        if cache_key is not None and self.cache is not None:
+            self.cache.set(cache_key, "".join(parts))
+        return None
+
+    def _stream_failed(self, error: Union[BaseException, str]) -> str:
+        """
+        Records the error that interrupted a stream in `last_stream_stats`. (Internal method)
+
+        :return: The text yielded in place of the rest of the response.
+        """
+        if self.last_stream_stats is not None:
+            self.last_stream_stats["error"] = str(error)
+        return STREAM_INTERRUPTED_MESSAGE
+
+    def _stream_with_error_handling(self, deltas: Iterator[str]) -> Iterator[str]:
+        """
+        Wraps a stream of deltas with the error handling of `call_gpt4v_image`. (Internal method)
+
+        An error ends the stream with `STREAM_INTERRUPTED_MESSAGE` and is recorded in `last_stream_stats["error"]`,
+        so callers can tell an interrupted response from a complete one.
+        """
+        try:
+            yield from deltas
+        except RequestException as e:
+            logger.error(f"Failed to make the request. Error: {e}")
+            yield self._stream_failed(e)
+        except Exception as e:
+            logger.error(f"Azure OpenAI API error: {e}")
+            yield self._stream_failed(e)
+
+    def _build_and_send_stream(
+        self, image_file_paths: Union[str, List[str], None], request_options: Dict
+    ) -> Iterator[str]:
+        """
+        Builds a streaming request and yields the content deltas of its response. (Internal method)
+
+        The request is only built once the first delta is requested, so an error building it (e.g. an image
+        that cannot be read) ends the stream like any other error.
+        """
+        try:
+            api_url, headers, payload = self._build_request(
+                image_file_paths, **request_options
+            )
+        except (Exception, SystemExit) as e:
+            logger.error(f"Failed to build the request. Error: {e}")
+            self.last_stream_stats = self._new_stream_stats()
+            yield self._stream_failed(e)
+            return
+        yield from self._stream_with_error_handling(
+            self._send_stream(api_url, headers, payload)
+        )
+
     def call_gpt4v_image(
         self,
-        image_file_paths: Union[str, List[str]],
+        image_file_paths: Union[str, List[str], None] = None,
         system_instruction: Optional[str] = None,
         user_instruction: Optional[str] = None,
         ocr: bool = False,
@@ -202,7 +946,9 @@ class GPT4VisionManager:
         seed: int = 5555,
         model_version: str = "gpt-4-vision-preview",
         display_image: bool = False,
-    ) -> Dict:
+        vision_request: Optional[VisionRequest] = None,
+        stream: bool = False,
+    ) -> Union[Optional[str], Iterator[str]]:
         """
         Make an API call to the GPT-4 Vision model with optional OCR, grounding, and Azure Computer Vision API enhancements.
 
@@ -219,120 +965,52 @@ class GPT4VisionManager:
         :param seed: Optional parameter for the GPT-4 model that sets the seed for the random number generator. Using the same seed will ensure that the model produces the same output for the same input.
         :param model_version: Optional string parameter specifying the version of the GPT-4 Vision model to use.
         :param display_image: Optional boolean flag indicating whether to display the image.
+        :param vision_request: Optional prebuilt request from `build_vision_request`. When given, the images and
+            instructions it holds are used instead of `image_file_paths`, `system_instruction` and `user_instruction`.
+            Omitted instructions are simply left out of the messages; nothing is carried over between calls.
+        :param stream: If True, return an iterator over the content deltas as they arrive, instead of waiting for the
+            full response. Statistics of the stream (time to first token, usage) are in `last_stream_stats` once it
+            is consumed. A failed stream, including one whose request could not be built, ends with
+            `STREAM_INTERRUPTED_MESSAGE`, and `last_stream_stats["error"]` is then set.
         :return: A dictionary containing the response from the GPT-4 Vision API call. The dictionary includes the model's output and any other information returned by the API.
         """
-        try:
-            if system_instruction is not None or user_instruction is not None:
-                self.prepare_instruction(system_instruction, user_instruction)
-
-            if isinstance(image_file_paths, str):
-                image_file_paths = [image_file_paths]
-
-            for image_file_path in image_file_paths:
-                if image_file_path.startswith(("http://", "https://")):
-                    if image_file_path.startswith("http://"):
-                        raise ValueError(
-                            "HTTP URLs are not supported. Please use HTTPS."
-                        )
-                    # If it's an HTTPS URL but contains "blob.core.windows.net", process it as a blob
-                    elif "blob.core.windows.net" in image_file_path:
-                        logger.info("Blob URL detected. Extracting content.")
-                        content_bytes = self.blob_manager.extract_content(
-                            image_file_path
-                        )
-                        encoded_image = self._encode_bytes_to_base64(content_bytes)
-                else:
-                    encoded_image = self._encode_image_to_base64(image_file_path)
-
-                image_url = f"data:image/jpeg;base64,{encoded_image}"
-                self.add_image_url_to_user_message(image_url)
-
-            if use_vision_api:
-                azure_endpoint_vision = os.getenv("AZURE_ENDPOINT_VISION")
-                azure_key_vision = os.getenv("AZURE_KEY_VISION")
-
-                if not azure_endpoint_vision or not azure_key_vision:
-                    logger.error(
-                        "Missing required Azure Computer Vision environment variables."
-                    )
-                    raise SystemExit(
-                        "Missing required Azure Computer Vision environment variables."
-                    )
-
-                vision_api_config = {
-                    "endpoint": azure_endpoint_vision,
-                    "key": azure_key_vision,
-                }
-
-            if not all(
-                [
-                    self.openai_api_base,
-                    self.deployment_name,
-                    self.openai_api_version,
-                    self.openai_api_key,
-                ]
-            ):
-                raise SystemExit(
-                    "Missing required OpenAI environment variables. Please call the function load_environment_variables_from_env_file"
-                )
+        request_options: Dict[str, Any] = dict(
+            system_instruction=system_instruction,
+            user_instruction=user_instruction,
+            ocr=ocr,
+            grounding=grounding,
+            in_context=in_context,
+            use_vision_api=use_vision_api,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            seed=seed,
+            model_version=model_version,
+            vision_request=vision_request,
+        )
+        if stream:
+            return self._build_and_send_stream(image_file_paths, request_options)
 
-            api_url = f"{self.openai_api_base}/openai/deployments/{self.deployment_name}/{'extensions/' if ocr or grounding else ''}chat/completions?api-version={self.openai_api_version}"
-
-            # Log the request
-            logger.info(f"Sending request to {api_url}")
-
-            # Payload setup
-            payload = {
-                "model": model_version,
-                "messages": self.messages,
-                "temperature": temperature,
-                "top_p": top_p,
-                "max_tokens": max_tokens,
-                "seed": seed,
-            }
-
-            # HTTP headers
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": self.openai_api_key,
-            }
-
-            if ocr or grounding:
-                payload["enhancements"] = {
-                    "ocr": {"enabled": ocr},
-                    "grounding": {"enabled": grounding},
-                }
-
-            data_sources = []
-
-            if in_context is not None:
-                data_sources.append(
-                    {"type": "AzureCognitiveSearch", "parameters": in_context}
-                )
+        try:
+            api_url, headers, payload = self._build_request(
+                image_file_paths, **request_options
+            )
+            content = self._send(api_url, headers, payload)
 
-            if use_vision_api:
-                data_sources.append(
-                    {"type": "AzureComputerVision", "parameters": vision_api_config}
+            if display_image and image_file_paths:
+                display(
+                    Image(
+                        image_file_paths
+                        if isinstance(image_file_paths, str)
+                        else image_file_paths[-1]
+                    )
                 )
 
-            if data_sources:
-                payload["dataSources"] = data_sources
-
-            # Send the request
-            logger.info(f"Sending request to {api_url} with payload: {payload}")
-            response = requests.post(api_url, headers=headers, json=payload)
-            response.raise_for_status()
-            logger.info("Request successful.")
-            content = response.json()["choices"][0]["message"]["content"]
-
-            if display_image:
-                display(Image(image_file_path))
-
             return content
 
         except RequestException as e:
             logger.error(f"Failed to make the request. Error: {e}")
-            raise SystemExit(f"Failed to make the request. Error: {e}")
+            return None
         except openai.APIConnectionError as e:
             logger.error("The server could not be reached")
             logger.error(e.__cause__)
@@ -348,3 +1026,231 @@ class GPT4VisionManager:
         except Exception as e:
             logger.error(f"Azure OpenAI API error: {e}")
             return None
+
+    async def acall_gpt4v_image(
+        self,
+        image_file_paths: Union[str, List[str], None] = None,
+        system_instruction: Optional[str] = None,
+        user_instruction: Optional[str] = None,
+        ocr: bool = False,
+        grounding: bool = False,
+        in_context: Optional[Dict] = None,
+        use_vision_api: bool = False,
+        temperature: float = 0.7,
+        top_p: float = 0.95,
+        max_tokens: int = 1000,
+        seed: int = 5555,
+        model_version: str = "gpt-4-vision-preview",
+        vision_request: Optional[VisionRequest] = None,
+        stream: bool = False,
+    ) -> Union[Optional[str], AsyncIterator[str]]:
+        """
+        Asynchronous variant of `call_gpt4v_image` using a pooled, keep-alive `httpx.AsyncClient`.
+
+        Parameters are the same as for `call_gpt4v_image`, except `display_image`, which is not supported.
+
+        :return: The content of the model's response, or None if an error occurred. With `stream=True`, an async
+            iterator over the content deltas.
+        """
+        request_options: Dict[str, Any] = dict(
+            system_instruction=system_instruction,
+            user_instruction=user_instruction,
+            ocr=ocr,
+            grounding=grounding,
+            in_context=in_context,
+            use_vision_api=use_vision_api,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            seed=seed,
+            model_version=model_version,
+            vision_request=vision_request,
+        )
+        if stream:
+            return self._abuild_and_send_stream(image_file_paths, request_options)
+
+        try:
+            api_url, headers, payload = self._build_request(
+                image_file_paths, **request_options
+            )
+
+            cache_key = self._cache_key(api_url, payload)
+            if cache_key is not None and self.cache is not None:
+                content = self.cache.get(cache_key)
+                if content is not None:
+                    logger.info("Response served from cache.")
+                    return content
+
+            logger.info(f"Sending async request to {api_url}")
+
+            async def post(url: str, request_headers: Dict) -> httpx.Response:
+                response = await self._get_async_client().post(
+                    url, headers=request_headers, json=payload
+                )
+                response.raise_for_status()
+                return response
+
+            response = await self._adispatch(api_url, headers, post)
+            logger.info("Request successful.")
+            content = response.json()["choices"][0]["message"]["content"]
+
+            if cache_key is not None and self.cache is not None:
+                self.cache.set(cache_key, content)
+            return content
+
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to make the request. Error: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Azure OpenAI API error: {e}")
+            return None
+
+    async def _abuild_and_send_stream(
+        self, image_file_paths: Union[str, List[str], None], request_options: Dict
+    ) -> AsyncIterator[str]:
+        """
+        Async variant of `_build_and_send_stream`. (Internal method)
+        """
+        try:
+            api_url, headers, payload = self._build_request(
+                image_file_paths, **request_options
+            )
+        except (Exception, SystemExit) as e:
+            logger.error(f"Failed to build the request. Error: {e}")
+            self.last_stream_stats = self._new_stream_stats()
+            yield self._stream_failed(e)
+            return
+        async for delta in self._asend_stream(api_url, headers, payload):
+            yield delta
+
+    async def _asend_stream(
+        self, api_url: str, headers: Dict, payload: Dict
+    ) -> AsyncIterator[str]:
+        """
+        Async variant of `_send_stream`. (Internal method)
+        """
+        stats = self._new_stream_stats()
+        self.last_stream_stats = stats
+        start = time.perf_counter()
+
+        cache_key = self._cache_key(api_url, payload)
+        if cache_key is not None and self.cache is not None:
+            content = self.cache.get(cache_key)
+            if content is not None:
+                logger.info("Response served from cache.")
+                stats.update(
+                    time_to_first_token=0.0, total_time=0.0, chunks=1, completed=True
+                )
+                yield content
+                return
+
+        logger.info(f"Sending async streaming request to {api_url}")
+        client = self._get_async_client()
+
+        async def open_stream(url: str, request_headers: Dict) -> httpx.Response:
+            response = await client.send(
+                client.build_request(
+                    "POST",
+                    url,
+                    headers=request_headers,
+                    json={**payload, "stream": True},
+                ),
+                stream=True,
+            )
+            try:
+                response.raise_for_status()
+            except httpx.HTTPError:
+                await response.aclose()
+                raise
+            return response
+
+        parts: List[str] = []
+        try:
+            response = await self._adispatch(api_url, headers, open_stream, hedge=False)
+            try:
+                async for line in response.aiter_lines():
+                    delta = self._parse_sse_line(line, stats)
+                    if delta is _STREAM_DONE:
+                        break
+                    if isinstance(delta, str) and delta:
+                        if stats["time_to_first_token"] is None:
+                            stats["time_to_first_token"] = time.perf_counter() - start
+                        stats["chunks"] += 1
+                        parts.append(delta)
+                        yield delta
+            finally:
+                await response.aclose()
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            logger.error(f"Failed to make the request. Error: {e}")
+            yield self._stream_failed(e)
+            return
+        except Exception as e:
+            logger.error(f"Azure OpenAI API error: {e}")
+            yield self._stream_failed(e)
+            return
+
+        stats["total_time"] = time.perf_counter() - start
+        interrupted = self._finish_stream(cache_key, parts, stats)
+        if interrupted:
+            yield interrupted
+
+    def batch_call(
+        self, jobs: List[Dict], max_concurrency: int = DEFAULT_POOL_MAXSIZE
+    ) -> List[Dict]:
+        """
+        Runs many GPT-4 Vision calls concurrently with bounded parallelism.
+
+        Each job is a dictionary with the keys `image_file_paths`, `system_instruction` and `user_instruction`
+        (or a prebuilt `vision_request`), plus an optional `options` dictionary holding any other
+        `call_gpt4v_image` parameter (e.g. `ocr`, `temperature`, `max_tokens`). Every job builds its own
+        messages, so the manager can be shared by all workers.
+
+        :param jobs: The jobs to run.
+        :param max_concurrency: Maximum number of requests in flight at once. Defaults to the connection pool size.
+        :return: One dictionary per job, in the order of `jobs`, with the keys `content` (the model's response or None),
+            `error` (the error message or None) and `elapsed` (seconds spent on the job).
+        """
+        if max_concurrency > self.pool_maxsize:
+            logger.warning(
+                f"max_concurrency ({max_concurrency}) exceeds pool_maxsize ({self.pool_maxsize}); "
+                "extra connections will not be kept alive."
+            )
+
+        results_by_index: Dict[int, Dict] = {}
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = {
+                executor.submit(self._run_job, job): idx for idx, job in enumerate(jobs)
+            }
+            for future in as_completed(futures):
+                results_by_index[futures[future]] = future.result()
+
+        results = [results_by_index[idx] for idx in range(len(jobs))]
+        failed = sum(1 for result in results if result["error"] is not None)
+        logger.info(f"Batch finished: {len(jobs) - failed} succeeded, {failed} failed.")
+        return results
+
+    def _run_job(self, job: Dict) -> Dict:
+        """
+        Runs a single batch job and captures its outcome instead of raising. (Internal method)
+
+        :param job: The job, as described in `batch_call`.
+        :return: A dictionary with the keys `content`, `error` and `elapsed`.
+        """
+        start = time.perf_counter()
+        try:
+            api_url, headers, payload = self._build_request(
+                job.get("image_file_paths"),
+                system_instruction=job.get("system_instruction"),
+                user_instruction=job.get("user_instruction"),
+                vision_request=job.get("vision_request"),
+                **job.get("options", {}),
+            )
+            content, error = self._send(api_url, headers, payload), None
+        except (Exception, SystemExit) as e:
+            logger.error(f"Batch job failed: {e}")
+            content, error = None, str(e)
+        return {
+            "content": content,
+            "error": error,
+            "elapsed": time.perf_counter() - start,
+        }
@@ -0,0 +1,325 @@
+"""
+`vector_index.py` provides an in-process vector index for semantic search over indexed documents.
+
+Vectors are L2-normalized and kept in one contiguous matrix, so a search is a single matrix-vector
+product followed by a partial sort. For larger collections the index can be partitioned with
+k-means (IVF), so that a search only scores the vectors of the `n_probe` closest partitions, and
+vectors can be stored as int8 with a scale per row to cut memory by four. Documents are added,
+updated and removed incrementally.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Rows scored per matrix product when vectors are stored as int8, bounding the float32 copy
+_SCORE_BLOCK_ROWS = 16384
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Returns the rows of a matrix scaled to unit length (zero rows are left as is)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class LocalVectorIndex:
+    """
+    An in-memory cosine-similarity index with optional IVF partitioning and int8 quantization.
+
+    Attributes:
+        dimensions (Optional[int]): Dimensions of the vectors, or None until the first vector is added.
+        quantize (bool): Whether vectors are stored as int8.
+        n_lists (Optional[int]): Number of IVF partitions, or None for exact (brute-force) search.
+        n_probe (int): Number of partitions scored per search when the index is partitioned.
+    """
+
+    def __init__(
+        self,
+        dimensions: Optional[int] = None,
+        quantize: bool = False,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        initial_capacity: int = 1024,
+    ):
+        """
+        Initialize an empty index.
+
+        :param dimensions: Dimensions of the vectors. Defaults to the dimensions of the first vectors added.
+        :param quantize: Whether to store vectors as int8 with a scale per row. Defaults to False.
+        :param n_lists: Number of IVF partitions. The partitions are trained on the first search once the index
+            holds at least 39 vectors per partition, or explicitly with `train`. Defaults to None (exact search).
+        :param n_probe: Number of partitions scored per search. Defaults to 8.
+        :param initial_capacity: Number of rows allocated up front. The storage doubles when full.
+        """
+        self.dimensions = dimensions
+        self.quantize = quantize
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self._capacity = initial_capacity
+        self._size = 0
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._metadata: List[Optional[Dict[str, Any]]] = []
+        # The storage is allocated on the first add, once the dimensions are known
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._scales = np.ones(0, dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._centroids: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, document_id: str) -> bool:
+        return document_id in self._rows
+
+    @property
+    def is_trained(self) -> bool:
+        """Whether the IVF partitions have been trained."""
+        return self._centroids is not None
+
+    def _allocate(self, rows: int, dimensions: int) -> None:
+        """Makes room for at least `rows` vectors of `dimensions` dimensions, doubling the storage as needed."""
+        if not len(self._vectors):
+            self._capacity = max(self._capacity, rows)
+            dtype = np.int8 if self.quantize else np.float32
+            self._vectors = np.empty((self._capacity, dimensions), dtype=dtype)
+            self._scales = np.ones(self._capacity, dtype=np.float32)
+            self._assignments = np.zeros(self._capacity, dtype=np.int32)
+            return
+        if rows <= self._capacity:
+            return
+        while self._capacity < rows:
+            self._capacity *= 2
+        for name in ("_vectors", "_scales", "_assignments"):
+            array = getattr(self, name)
+            grown = np.empty((self._capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[: self._size] = array[: self._size]
+            setattr(self, name, grown)
+
+    def _encode(self, vectors: np.ndarray):
+        """Returns the stored form of normalized vectors and their scales."""
+        if not self.quantize:
+            return vectors, np.ones(len(vectors), dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Returns the closest partition of each vector."""
+        return np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+
+    def add(
+        self,
+        ids: Sequence[str],
+        vectors: np.ndarray,
+        metadata: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+    ) -> None:
+        """
+        Adds documents to the index, replacing the vectors and metadata of ids that are already indexed.
+
+        :param ids: The document IDs.
+        :param vectors: A matrix with one embedding per document.
+        :param metadata: Optional metadata per document, returned with the search results.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        if not len(ids):
+            return
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Expected vectors of {self.dimensions} dimensions, got {vectors.shape[1]}"
+                )
+            normalized = _normalize(vectors)
+            codes, scales = self._encode(normalized)
+
+            rows = []
+            for document_id in ids:
+                row = self._rows.get(document_id)
+                if row is None:
+                    row = self._size
+                    self._allocate(row + 1, self.dimensions)
+                    self._rows[document_id] = row
+                    self._ids.append(document_id)
+                    self._metadata.append(None)
+                    self._size += 1
+                rows.append(row)
+
+            positions = np.array(rows)
+            self._vectors[positions] = codes
+            self._scales[positions] = scales
+            if self._centroids is not None:
+                self._assignments[positions] = self._assign(normalized, self._centroids)
+            for row, data in zip(rows, metadata or [None] * len(ids)):
+                self._metadata[row] = data
+
+    def remove(self, ids: Sequence[str]) -> int:
+        """
+        Removes documents from the index. Unknown ids are ignored.
+
+        :param ids: The document IDs.
+        :return: The number of documents removed.
+        """
+        removed = 0
+        with self._lock:
+            for document_id in ids:
+                row = self._rows.pop(document_id, None)
+                if row is None:
+                    continue
+                # The last row takes the place of the removed one, keeping the storage contiguous
+                last = self._size - 1
+                if row != last:
+                    moved_id = self._ids[last]
+                    self._ids[row] = moved_id
+                    self._metadata[row] = self._metadata[last]
+                    self._vectors[row] = self._vectors[last]
+                    self._scales[row] = self._scales[last]
+                    self._assignments[row] = self._assignments[last]
+                    self._rows[moved_id] = row
+                self._ids.pop()
+                self._metadata.pop()
+                self._size -= 1
+                removed += 1
+        return removed
+
+    def _dense(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Returns stored vectors as float32."""
+        vectors = self._vectors[: self._size] if rows is None else self._vectors[rows]
+        if not self.quantize:
+            return vectors
+        scales = self._scales[: self._size] if rows is None else self._scales[rows]
+        return vectors.astype(np.float32) * scales[:, None]
+
+    def train(
+        self,
+        n_lists: Optional[int] = None,
+        iterations: int = 10,
+        sample_size: int = 50_000,
+        seed: int = 0,
+    ) -> None:
+        """
+        Partitions the index with spherical k-means.
+
+        :param n_lists: Number of partitions. Defaults to `n_lists` of the index, or the square root of its size.
+        :param iterations: Number of k-means iterations. Defaults to 10.
+        :param sample_size: Maximum number of vectors the centroids are trained on. Defaults to 50000.
+        :param seed: Seed of the sampling and initialization. Defaults to 0.
+        """
+        with self._lock:
+            if self._size == 0:
+                return
+            start = time.perf_counter()
+            n_lists = min(
+                n_lists or self.n_lists or int(np.sqrt(self._size)) or 1, self._size
+            )
+            rng = np.random.default_rng(seed)
+            sample = rng.choice(
+                self._size, size=min(sample_size, self._size), replace=False
+            )
+            vectors = self._dense(np.sort(sample))
+            centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)]
+            for _ in range(iterations):
+                labels = np.argmax(vectors @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, vectors)
+                counts = np.bincount(labels, minlength=n_lists)
+                # Empty partitions keep their previous centroid
+                centroids = np.where(counts[:, None] > 0, _normalize(sums), centroids)
+
+            self.n_lists = n_lists
+            self._centroids = centroids.astype(np.float32)
+            for offset in range(0, self._size, _SCORE_BLOCK_ROWS):
+                rows = np.arange(offset, min(offset + _SCORE_BLOCK_ROWS, self._size))
+                self._assignments[rows] = self._assign(
+                    self._dense(rows), self._centroids
+                )
+        logger.info(
+            f"Trained {n_lists} partitions over {self._size} vectors in {time.perf_counter() - start:.2f}s."
+        )
+
+    def _scores(self, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Returns the cosine similarity of the query with every row (or the given rows)."""
+        if not self.quantize:
+            vectors = (
+                self._vectors[: self._size] if rows is None else self._vectors[rows]
+            )
+            return vectors @ query
+        count = self._size if rows is None else len(rows)
+        scores = np.empty(count, dtype=np.float32)
+        for offset in range(0, count, _SCORE_BLOCK_ROWS):
+            block = (
+                np.arange(offset, min(offset + _SCORE_BLOCK_ROWS, count))
+                if rows is None
+                else rows[offset : offset + _SCORE_BLOCK_ROWS]
+            )
+            scores[offset : offset + len(block)] = (
+                self._vectors[block].astype(np.float32) @ query
+            ) * self._scales[block]
+        return scores
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 10,
+        min_score: Optional[float] = None,
+        n_probe: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the documents most similar to a query vector.
+
+        :param query: The query embedding.
+        :param k: Maximum number of results. Defaults to 10.
+        :param min_score: Minimum cosine similarity of the results. Defaults to None (no minimum).
+        :param n_probe: Number of partitions scored, for a partitioned index. Defaults to `n_probe` of the index.
+        :return: A list of dictionaries with the keys `id`, `score` and `metadata`, best first.
+        """
+        vector = _normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        with self._lock:
+            if self._size == 0:
+                return []
+            if self.n_lists and not self.is_trained and self._size >= 39 * self.n_lists:
+                self.train()
+
+            start = time.perf_counter()
+            rows = None
+            if self._centroids is not None:
+                probes = np.argsort(self._centroids @ vector)[::-1][
+                    : n_probe or self.n_probe
+                ]
+                rows = np.flatnonzero(np.isin(self._assignments[: self._size], probes))
+            scores = self._scores(vector, rows)
+
+            k = min(k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results = []
+            for position in top:
+                score = float(scores[position])
+                if min_score is not None and score < min_score:
+                    break
+                row = int(position if rows is None else rows[position])
+                results.append(
+                    {
+                        "id": self._ids[row],
+                        "score": score,
+                        "metadata": self._metadata[row],
+                    }
+                )
+        logger.debug(
+            f"Scored {len(scores)} of {self._size} vectors in {(time.perf_counter() - start) * 1000:.1f} ms."
+        )
+        return results
@@ -0,0 +1,480 @@
+"""
+`resilience.py` provides the retry, backoff and circuit breaker layer shared by the Azure AI clients.
+
+Transient failures (throttling, timeouts, 5xx responses and connection errors) are retried with
+exponential backoff and full jitter, waiting at least as long as the service asks through
+`Retry-After`, `retry-after-ms` or `x-ratelimit-reset-*`. Each endpoint has a circuit breaker,
+which fails calls fast while the endpoint keeps failing, and a retry budget, which caps retries
+to a fraction of the calls so that an outage does not turn into a retry storm.
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+import httpx
+import openai
+import requests
+from azure.core.exceptions import (
+    HttpResponseError,
+    ServiceRequestError,
+    ServiceResponseError,
+)
+
+from src.ocr.polling import retry_after_seconds
+from utils.ml_logging import get_logger
+
+# Initialize logging
+logger = get_logger()
+
+# Status codes of transient failures worth retrying
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+# Text yielded in place of the rest of a streamed response that failed; `last_stream_stats["error"]` is then set
+STREAM_INTERRUPTED_MESSAGE = (
+    "\n\n*The response could not be completed. Please try again.*"
+)
+
+# Matches durations such as "1s", "6m0s" or "250ms" used by the x-ratelimit-reset-* headers
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is refused because the circuit breaker of its endpoint is open."""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(
+            f"Circuit breaker for {endpoint} is open; retry in {retry_in:.1f}s"
+        )
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parses a duration such as "1s", "6m0s" or "250ms" (or a plain number of seconds)."""
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_delay_from_headers(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Returns the delay requested by a throttled response.
+
+    Supports `retry-after-ms`, `x-ms-retry-after-ms`, `Retry-After` and the `x-ratelimit-reset-requests` /
+    `x-ratelimit-reset-tokens` headers; when several are present, the longest delay wins.
+
+    :param headers: The response headers.
+    :return: The delay in seconds, or None if the response does not request one.
+    """
+    candidates = [retry_after_seconds(headers)]
+    lowered = {key.lower(): value for key, value in headers.items()}
+    for header in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        if header in lowered:
+            candidates.append(_parse_duration(lowered[header]))
+    delays = [delay for delay in candidates if delay is not None]
+    return max(delays) if delays else None
+
+
+def classify_error(
+    error: BaseException,
+) -> Tuple[bool, Optional[int], Mapping[str, str]]:
+    """
+    Classifies an error raised by an OpenAI, requests, httpx or Azure SDK call.
+
+    :param error: The error.
+    :return: Whether the error is transient, its HTTP status code (None for transport errors) and the
+        response headers.
+    """
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True, None, {}
+    if isinstance(error, openai.APIStatusError):
+        return (
+            error.status_code in RETRYABLE_STATUS_CODES,
+            error.status_code,
+            error.response.headers,
+        )
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in RETRYABLE_STATUS_CODES, status, error.response.headers
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True, None, {}
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status in RETRYABLE_STATUS_CODES, status, error.response.headers
+    if isinstance(error, httpx.TransportError):
+        return True, None, {}
+    if isinstance(error, (ServiceRequestError, ServiceResponseError)):
+        return True, None, {}
+    if isinstance(error, HttpResponseError):
+        # The response is typed without its headers, which every transport's response has
+        headers = getattr(error.response, "headers", None) or {}
+        return error.status_code in RETRYABLE_STATUS_CODES, error.status_code, headers
+    return False, None, {}
+
+
+class CircuitBreaker:
+    """
+    A thread-safe circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are refused for
+    `recovery_timeout` seconds. Then one trial call is let through (half-open): its success closes the
+    circuit, its failure opens it again.
+
+    Attributes:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        recovery_timeout (float): Seconds the circuit stays open before a trial call.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """The current state: "closed", "open" or "half_open"."""
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.recovery_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> float:
+        """
+        Checks whether a call may proceed.
+
+        :return: 0 if the call may proceed, otherwise the number of seconds until the next trial call.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return 0.0
+            remaining = self.recovery_timeout - (time.monotonic() - self._opened_at)
+            if self._state == self.OPEN and remaining <= 0:
+                self._state = self.HALF_OPEN
+                return 0.0
+            # Only one trial call at a time while half-open
+            return max(remaining, 0.0) if self._state == self.OPEN else 1.0
+
+    def record_success(self) -> None:
+        """Records a successful call, closing the circuit."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def abort_trial(self) -> None:
+        """
+        Settles a trial call that neither succeeded nor failed in a way that says something about the
+        endpoint (e.g. it was cancelled, or its response could not be parsed), by opening the circuit again.
+        Does nothing unless the circuit is half-open.
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_failure(self) -> None:
+        """Records a failed call, opening the circuit after too many consecutive failures."""
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"Opening circuit breaker after {self._failures} consecutive failures."
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    A token bucket limiting retries to a fraction of the calls.
+
+    Every call adds `ratio` tokens and every retry spends one. `min_per_second` tokens are added over time,
+    so that an endpoint with little traffic can still retry.
+
+    Attributes:
+        ratio (float): Retries allowed per call.
+        min_per_second (float): Retries allowed per second regardless of the traffic.
+        max_tokens (float): Maximum number of tokens saved up.
+    """
+
+    def __init__(
+        self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 20.0
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.max_tokens,
+            self._tokens + amount + (now - self._updated) * self.min_per_second,
+        )
+        self._updated = now
+
+    def record_call(self) -> None:
+        """Records a call, earning `ratio` retries."""
+        with self._lock:
+            self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Spends one retry. Returns False if the budget is exhausted."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class ResiliencePolicy:
+    """
+    Retries transient failures of calls to Azure AI endpoints, with a circuit breaker and a retry budget per
+    endpoint.
+
+    Endpoints are identified by a string chosen by the caller, e.g. "<endpoint URL>/<deployment>". A policy
+    is meant to be shared by every client of the process; `get_default_policy` returns a shared instance.
+
+    Attributes:
+        max_attempts (int): Maximum number of attempts of a call, including the first one.
+        base_delay (float): Backoff delay before the first retry, in seconds.
+        max_delay (float): Maximum backoff delay, in seconds.
+        max_elapsed (float): Retries are not attempted once a call has taken this many seconds.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        max_elapsed: float = 120.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        retry_ratio: float = 0.2,
+        min_retries_per_second: float = 1.0,
+    ):
+        """
+        Initialize the policy.
+
+        :param max_attempts: Maximum number of attempts of a call, including the first one. Defaults to 5.
+        :param base_delay: Backoff delay before the first retry, in seconds. Defaults to 0.5.
+        :param max_delay: Maximum backoff delay, in seconds. Defaults to 20. Delays requested by the service
+            are honored up to `max_elapsed`.
+        :param max_elapsed: Retries are not attempted once a call has taken this many seconds. Defaults to 120.
+        :param failure_threshold: Consecutive failures that open the circuit of an endpoint. Defaults to 5.
+        :param recovery_timeout: Seconds a circuit stays open before a trial call. Defaults to 30.
+        :param retry_ratio: Retries allowed per call by the retry budget of an endpoint. Defaults to 0.2.
+        :param min_retries_per_second: Retries allowed per second by the retry budget regardless of the traffic.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.retry_ratio = retry_ratio
+        self.min_retries_per_second = min_retries_per_second
+        self._endpoints: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _endpoint(self, endpoint: str) -> Dict[str, Any]:
+        """Returns the circuit breaker, retry budget and counters of an endpoint."""
+        with self._lock:
+            state = self._endpoints.get(endpoint)
+            if state is None:
+                state = {
+                    "breaker": CircuitBreaker(
+                        self.failure_threshold, self.recovery_timeout
+                    ),
+                    "budget": RetryBudget(
+                        self.retry_ratio, self.min_retries_per_second
+                    ),
+                    "calls": 0,
+                    "retries": 0,
+                    "failures": 0,
+                    "rejected": 0,
+                }
+                self._endpoints[endpoint] = state
+            return state
+
+    def circuit_breaker(self, endpoint: str) -> CircuitBreaker:
+        """Returns the circuit breaker of an endpoint."""
+        return self._endpoint(endpoint)["breaker"]
+
+    def _before_attempt(self, endpoint: str, state: Dict[str, Any]) -> None:
+        """Refuses the attempt if the circuit of the endpoint is open."""
+        retry_in = state["breaker"].allow()
+        if retry_in > 0:
+            state["rejected"] += 1
+            raise CircuitOpenError(endpoint, retry_in)
+
+    def _after_failure(
+        self,
+        endpoint: str,
+        state: Dict[str, Any],
+        error: BaseException,
+        attempt: int,
+        start: float,
+    ) -> Optional[float]:
+        """
+        Records a failed attempt and decides whether to retry it.
+
+        :return: The delay before the next attempt, or None if the error must be raised.
+        """
+        transient, status, headers = classify_error(error)
+        # Throttling says nothing about the health of the endpoint, so it does not trip the breaker
+        if status != 429 and (transient or (status is not None and status >= 500)):
+            state["breaker"].record_failure()
+        elif status is not None and status < 500:
+            state["breaker"].record_success()
+        else:
+            # A 429, or an error without a status: a trial call must still be settled
+            state["breaker"].abort_trial()
+        if not transient:
+            state["failures"] += 1
+            return None
+
+        requested = retry_delay_from_headers(headers)
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if requested is not None:
+            delay = requested + random.uniform(0, self.base_delay)
+        elapsed = time.monotonic() - start
+        if (
+            attempt + 1 >= self.max_attempts
+            or elapsed + delay > self.max_elapsed
+            or not state["budget"].try_spend()
+        ):
+            state["failures"] += 1
+            logger.error(
+                f"Giving up on {endpoint} after {attempt + 1} attempts ({status or type(error).__name__})."
+            )
+            return None
+
+        state["retries"] += 1
+        logger.warning(
+            f"Transient failure on {endpoint} ({status or type(error).__name__}); "
+            f"retrying in {delay:.2f}s (attempt {attempt + 2} of {self.max_attempts})."
+        )
+        return delay
+
+    def call(self, endpoint: str, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls a function, retrying transient failures.
+
+        :param endpoint: Identifier of the endpoint the function calls.
+        :param function: The function to call.
+        :param args: Positional arguments of the function.
+        :param kwargs: Keyword arguments of the function.
+        :return: The return value of the function.
+        :raises CircuitOpenError: If the circuit of the endpoint is open.
+        :raises Exception: The last error of the function, if it is not transient or cannot be retried.
+        """
+        state = self._endpoint(endpoint)
+        state["calls"] += 1
+        state["budget"].record_call()
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self._before_attempt(endpoint, state)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(endpoint, state, e, attempt, start)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # E.g. a cancelled call: a trial call must not leave the circuit half-open for good
+                state["breaker"].abort_trial()
+                raise
+            state["breaker"].record_success()
+            return result
+
+    async def acall(
+        self, endpoint: str, function: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Asynchronous variant of `call`, for coroutine functions.
+        """
+        state = self._endpoint(endpoint)
+        state["calls"] += 1
+        state["budget"].record_call()
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self._before_attempt(endpoint, state)
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                delay = self._after_failure(endpoint, state, e, attempt, start)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # E.g. a cancelled call: a trial call must not leave the circuit half-open for good
+                state["breaker"].abort_trial()
+                raise
+            state["breaker"].record_success()
+            return result
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the counters and circuit state of every endpoint.
+
+        :return: A dictionary of endpoints to dictionaries with the keys `calls`, `retries`, `failures`,
+            `rejected` and `circuit`.
+        """
+        with self._lock:
+            endpoints = dict(self._endpoints)
+        return {
+            endpoint: {
+                "calls": state["calls"],
+                "retries": state["retries"],
+                "failures": state["failures"],
+                "rejected": state["rejected"],
+                "circuit": state["breaker"].state,
+            }
+            for endpoint, state in endpoints.items()
+        }
+
+
+_default_policy: Optional[ResiliencePolicy] = None
+_default_policy_lock = threading.Lock()
+
+
+def get_default_policy() -> ResiliencePolicy:
+    """Returns the resilience policy shared by the clients of the process, creating it on first use."""
+    global _default_policy
+    with _default_policy_lock:
+        if _default_policy is None:
+            _default_policy = ResiliencePolicy()
+        return _default_policy
@@ -0,0 +1,79 @@
+import asyncio
+
+from src.aoai.conversation_memory import SUMMARY_PREFIX, ConversationMemory
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+
+
+def _history(turns, words=40):
+    history = [dict(SYSTEM)]
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} " + "word " * words})
+        history.append(
+            {"role": "assistant", "content": f"answer {i} " + "word " * words}
+        )
+    return history
+
+
+def test_short_history_is_sent_whole():
+    memory = ConversationMemory(max_tokens=3000)
+    history = _history(2)
+
+    messages = memory.select(history, "next")
+
+    assert messages == history + [{"role": "user", "content": "next"}]
+    assert memory.last_stats["saved_tokens"] == 0
+
+
+def test_long_history_keeps_system_message_and_recent_turns_within_budget():
+    memory = ConversationMemory(max_tokens=400)
+    history = _history(20)
+
+    messages = memory.select(history, "next")
+
+    assert messages[0] == SYSTEM
+    assert messages[1]["role"] == "user"
+    assert messages[-2:] == [history[-1], {"role": "user", "content": "next"}]
+    assert memory.last_stats["sent_tokens"] <= 400
+    assert memory.tokens_saved == memory.last_stats["saved_tokens"] > 0
+
+
+def test_turns_leaving_the_window_are_folded_into_the_summary():
+    calls = []
+
+    def summarize(messages, previous_summary):
+        calls.append((len(messages), previous_summary))
+        return f"summary {len(calls)}"
+
+    memory = ConversationMemory(max_tokens=800, summarize_function=summarize)
+    history = _history(20)
+
+    messages = memory.select(history, "next")
+    assert calls == [(calls[0][0], None)] and calls[0][0] > 0
+    assert messages[1] == {"role": "system", "content": SUMMARY_PREFIX + "summary 1"}
+
+    # The window slid below its budget, so the next turn needs no new summary
+    history += [messages[-1], {"role": "assistant", "content": "ok"}]
+    memory.select(history, "again")
+    assert len(calls) == 1
+
+
+def test_aselect_summarizes_with_the_async_summarizer_or_in_a_thread():
+    def summarize(messages, previous_summary):
+        return "threaded summary"
+
+    async def asummarize(messages, previous_summary):
+        return "async summary"
+
+    async def select(memory):
+        return await memory.aselect(_history(20), "next")
+
+    threaded = ConversationMemory(max_tokens=800, summarize_function=summarize)
+    assert asyncio.run(select(threaded))[1]["content"] == (
+        SUMMARY_PREFIX + "threaded summary"
+    )
+
+    both = ConversationMemory(
+        max_tokens=800, summarize_function=summarize, asummarize_function=asummarize
+    )
+    assert asyncio.run(select(both))[1]["content"] == SUMMARY_PREFIX + "async summary"
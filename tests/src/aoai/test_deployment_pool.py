@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from src.aoai.deployment_pool import DeploymentPool
+from src.resilience import ResiliencePolicy
+
+
+def _pool(*names, resilience=None, **kwargs):
+    members = [
+        {"name": name, "azure_endpoint": f"https://{name}.example", "api_key": "key"}
+        for name in names
+    ]
+    return DeploymentPool(
+        members, resilience=resilience or ResiliencePolicy(base_delay=0.0), **kwargs
+    )
+
+
+def _half_open_breaker(pool, name):
+    """Opens the circuit of a member and waits until it allows a trial call."""
+    member = next(m for m in pool.members if m["name"] == name)
+    breaker = pool.resilience.circuit_breaker(pool._member_key(member, "gpt"))
+    breaker.record_failure()
+    time.sleep(0.06)
+    return breaker
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+class _Response:
+    def __init__(self, name, headers=None):
+        self.name = name
+        self.headers = headers or {}
+
+
+def test_sequential_requests_rotate_over_the_members_by_weight():
+    pool = _pool("a", "b")
+    pool.members[1]["weight"] = 2.0
+
+    names = [pool.call("gpt", lambda m, d: _Response(m["name"])).name for _ in range(6)]
+
+    assert names.count("a") == 2 and names.count("b") == 4
+
+
+def test_throttled_member_fails_over_and_is_skipped_afterwards():
+    pool = _pool("a", "b")
+    sent = []
+
+    def send(member, deployment):
+        sent.append(member["name"])
+        if member["name"] == "a":
+            raise _http_error(429, {"retry-after": "30"})
+        return _Response(member["name"])
+
+    assert pool.call("gpt", send).name == "b"
+    assert pool.call("gpt", send).name == "b"
+    assert sent == ["a", "b", "b"]
+    assert pool.stats()[0]["throttled"] == 1
+
+
+def test_client_errors_do_not_fail_over():
+    pool = _pool("a", "b")
+    sent = []
+
+    def send(member, deployment):
+        sent.append(member["name"])
+        raise _http_error(400)
+
+    with pytest.raises(requests.HTTPError):
+        pool.call("gpt", send)
+    assert len(sent) == 1
+
+
+def test_exhausted_quota_and_deployment_names_are_honored():
+    pool = DeploymentPool(
+        [
+            {"name": "a", "azure_endpoint": "https://a.example", "api_key": "key"},
+            {
+                "name": "b",
+                "azure_endpoint": "https://b.example",
+                "api_key": "key",
+                "deployments": {"gpt": "gpt-b"},
+            },
+        ],
+        resilience=ResiliencePolicy(),
+    )
+    pool.call(
+        "gpt",
+        lambda m, d: _Response(d, {"x-ratelimit-remaining-tokens": "10"}),
+    )
+
+    assert [pool.call("gpt", lambda m, d: _Response(d)).name for _ in range(2)] == [
+        "gpt-b",
+        "gpt-b",
+    ]
+
+
+def test_slow_requests_are_hedged_to_another_member():
+    pool = _pool("slow", "fast", hedge_after=0.05)
+
+    def send(member, deployment):
+        if member["name"] == "slow":
+            time.sleep(0.5)
+        return _Response(member["name"])
+
+    assert pool.call("gpt", send).name == "fast"
+    assert pool.stats()[1]["hedge_wins"] == 1
+    pool.close()
+
+
+def test_cancelled_hedged_trial_call_settles_the_circuit():
+    policy = ResiliencePolicy(
+        base_delay=0.0, failure_threshold=1, recovery_timeout=0.05
+    )
+    pool = _pool("slow", "fast", resilience=policy, hedge_after=0.01)
+    breaker = _half_open_breaker(pool, "slow")
+
+    async def send(member, deployment):
+        if member["name"] == "slow":
+            await asyncio.sleep(0.5)
+        return _Response(member["name"])
+
+    async def call():
+        response = await pool.acall("gpt", send)
+        await asyncio.sleep(0)  # lets the cancelled request finish
+        return response
+
+    assert asyncio.run(call()).name == "fast"
+    assert breaker.state == breaker.OPEN
+    assert pool.stats()[0]["outstanding"] == 0
+
+
+def test_trial_call_failing_without_a_status_settles_the_circuit():
+    policy = ResiliencePolicy(
+        base_delay=0.0, failure_threshold=1, recovery_timeout=0.05
+    )
+    pool = _pool("a", resilience=policy)
+    breaker = _half_open_breaker(pool, "a")
+
+    def send(member, deployment):
+        raise ValueError("bad JSON")
+
+    with pytest.raises(ValueError):
+        pool.call("gpt", send)
+    assert breaker.state == breaker.OPEN
+
+    time.sleep(0.06)
+    assert pool.call("gpt", lambda member, deployment: _Response("a")).name == "a"
+    assert breaker.state == breaker.CLOSED
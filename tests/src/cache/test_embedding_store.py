@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.cache.embedding_store import EmbeddingStore
+
+
+def test_embedding_store_roundtrip_survives_reopen(tmp_path):
+    vectors = np.random.rand(3, 8).astype(np.float32)
+    store = EmbeddingStore(str(tmp_path))
+
+    assert store.put_many(["a", "b", "c"], vectors, model="ada") == 3
+    assert store.put_many(["a", "d"], np.random.rand(2, 8), model="ada") == 1
+
+    reopened = EmbeddingStore(str(tmp_path), read_only=True)
+    assert len(reopened) == 4
+    np.testing.assert_array_equal(reopened.get("b", model="ada"), vectors[1])
+    assert reopened.get("b", model="other") is None
+    with pytest.raises(PermissionError):
+        reopened.put("e", np.ones(8))
+
+
+def test_readers_see_rows_appended_by_the_writer(tmp_path):
+    writer = EmbeddingStore(str(tmp_path), dimensions=4)
+    reader = EmbeddingStore(str(tmp_path), read_only=True)
+
+    writer.put("late", np.ones(4))
+    matrix, found = reader.get_many(["late", "missing"])
+
+    assert found.tolist() == [True, False]
+    np.testing.assert_array_equal(matrix[0], np.ones(4))
+
+
+def test_partial_rows_are_ignored_and_truncated(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put("a", np.ones(4))
+    with open(tmp_path / "vectors.bin", "ab") as f:
+        f.write(b"\x00" * 6)
+
+    reopened = EmbeddingStore(str(tmp_path))
+
+    assert len(reopened) == 1
+    assert os.path.getsize(tmp_path / "vectors.bin") == 16
+
+
+def test_compact_keeps_selected_rows_and_quantizes(tmp_path):
+    vectors = np.random.rand(3, 16).astype(np.float32) - 0.5
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many(["a", "b", "c"], vectors)
+    reader = EmbeddingStore(str(tmp_path), read_only=True)
+
+    assert store.compact(keep=["a", "c"], dtype="int8") == 1
+
+    reader.refresh()
+    assert reader.dtype == "int8" and len(reader) == 2
+    assert reader.get("b") is None
+    np.testing.assert_allclose(reader.get("c"), vectors[2], atol=0.01)
+
+
+def test_compaction_switches_generations_in_one_rename(tmp_path):
+    vectors = np.random.rand(3, 4).astype(np.float32)
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many(["a", "b", "c"], vectors)
+    reader = EmbeddingStore(str(tmp_path), read_only=True)
+    reader.get("a")
+
+    store.compact(keep=["a", "c"])
+    first = (tmp_path / "CURRENT").read_text()
+
+    # Until it refreshes, the reader keeps its view of the previous generation
+    np.testing.assert_array_equal(reader.vectors, vectors)
+    assert reader.get("c") is not None and len(reader) == 3
+    assert reader.get("missing") is None and len(reader) == 2
+
+    store.compact(keep=["c"])
+    second = (tmp_path / "CURRENT").read_text()
+
+    assert second != first and not (tmp_path / "keys.bin").exists()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == sorted(
+        [first, second]
+    )
+    assert len(EmbeddingStore(str(tmp_path), read_only=True)) == 1
+    store.compact()
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_dir()) == sorted(
+        [second, (tmp_path / "CURRENT").read_text()]
+    )
@@ -0,0 +1,80 @@
+import os
+
+from src.cache.response_cache import DiskCache, LRUCache, ResponseCache, make_cache_key
+
+
+def test_make_cache_key_is_stable_and_order_independent():
+    key_a = make_cache_key(deployment="gpt-4v", temperature=0.7, seed=42)
+    key_b = make_cache_key(seed=42, temperature=0.7, deployment="gpt-4v")
+
+    assert key_a == key_b
+    assert key_a != make_cache_key(deployment="gpt-4v", temperature=0.7, seed=5555)
+
+
+def test_make_cache_key_digests_image_data_urls():
+    image = "data:image/png;base64," + "A" * 10_000
+    other_image = "data:image/png;base64," + "B" * 10_000
+
+    key = make_cache_key(messages=[{"content": [{"image_url": {"url": image}}]}])
+
+    assert key == make_cache_key(
+        messages=[{"content": [{"image_url": {"url": image}}]}]
+    )
+    assert key != make_cache_key(
+        messages=[{"content": [{"image_url": {"url": other_image}}]}]
+    )
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_disk_cache_roundtrip_and_ttl(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.set("abcdef", {"content": "hello"})
+
+    assert cache.get("abcdef") == {"content": "hello"}
+
+    path = cache._path("abcdef")
+    os.utime(path, (0, 0))
+    assert cache.get("abcdef") is None
+    assert not os.path.exists(path)
+
+
+def test_disk_cache_evicts_when_over_size(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=2_000)
+    for i in range(50):
+        cache.set(f"{i:04d}key", "x" * 1_000 + str(i))
+
+    assert cache.total_bytes <= 2_000
+    assert cache.get("0049key") is not None
+
+
+def test_response_cache_promotes_disk_hits(tmp_path):
+    ResponseCache(directory=str(tmp_path)).set("k" * 64, "answer")
+    cache = ResponseCache(directory=str(tmp_path))
+
+    assert cache.get("k" * 64) == "answer"
+    assert len(cache.memory) == 1
+    assert cache.get("missing") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_promoted_disk_hits_keep_their_ttl(tmp_path):
+    ResponseCache(directory=str(tmp_path)).set("k" * 64, "answer")
+    cache = ResponseCache(directory=str(tmp_path), ttl=60)
+    path = cache.disk._path("k" * 64)
+    written = os.path.getmtime(path) - 50
+    os.utime(path, (written, written))
+
+    assert cache.get("k" * 64) == "answer"
+    assert cache.memory._entries["k" * 64][0] == written
@@ -0,0 +1,178 @@
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from src.extractors.blob_data_extractor import (
+    SYNC_MANIFEST_NAME,
+    AzureBlobDataExtractor,
+)
+
+CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=https;AccountName=account;AccountKey=a2V5;"
+    "EndpointSuffix=core.windows.net"
+)
+
+
+class _Container:
+    """Stub container client listing the blobs of a dictionary of names to contents and ETags."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+
+    def list_blobs(self, name_starts_with=""):
+        return [
+            SimpleNamespace(name=name, etag=etag, size=len(data), last_modified=None)
+            for name, (data, etag) in sorted(self.blobs.items())
+            if name.startswith(name_starts_with)
+        ]
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setenv("AZURE_STORAGE_CONNECTION_STRING", CONNECTION_STRING)
+    manager = AzureBlobDataExtractor("container")
+    manager.blobs = {}
+    manager.downloads = []
+    manager.failing = set()
+    monkeypatch.setattr(
+        manager.blob_service_client,
+        "get_container_client",
+        lambda name: _Container(manager.blobs),
+    )
+
+    def download_blob_to_file(blob_name, local_path, container_name=None):
+        manager.downloads.append(blob_name)
+        if blob_name in manager.failing:
+            raise IOError(f"cannot download {blob_name}")
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as file:
+            file.write(manager.blobs[blob_name][0])
+        return len(manager.blobs[blob_name][0])
+
+    monkeypatch.setattr(manager, "download_blob_to_file", download_blob_to_file)
+    return manager
+
+
+def _manifest(local_dir):
+    with open(os.path.join(local_dir, SYNC_MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def test_only_new_and_changed_blobs_are_downloaded(manager, tmp_path):
+    manager.blobs.update(
+        {"docs/a.pdf": (b"a", "1"), "docs/sub/b.pdf": (b"bb", "1"), "x.pdf": (b"", "1")}
+    )
+
+    assert manager.sync_folder("docs", str(tmp_path))["downloaded"] == 2
+    assert (tmp_path / "sub" / "b.pdf").read_bytes() == b"bb"
+    assert manager.sync_folder("docs", str(tmp_path))["unchanged"] == 2
+
+    manager.blobs["docs/a.pdf"] = (b"A", "2")
+    (tmp_path / "sub" / "b.pdf").write_bytes(b"truncated")
+    manager.downloads.clear()
+    stats = manager.sync_folder("docs", str(tmp_path))
+
+    assert sorted(manager.downloads) == ["docs/a.pdf", "docs/sub/b.pdf"]
+    assert stats["downloaded"] == 2 and stats["unchanged"] == 0
+
+
+def test_failed_download_keeps_its_previous_manifest_entry(manager, tmp_path):
+    manager.blobs.update({"docs/a.pdf": (b"a", "1"), "docs/b.pdf": (b"b", "1")})
+    manager.sync_folder("docs", str(tmp_path))
+
+    manager.blobs["docs/a.pdf"] = (b"A", "2")
+    manager.blobs["docs/b.pdf"] = (b"B", "2")
+    manager.failing.add("docs/a.pdf")
+    with pytest.raises(IOError):
+        manager.sync_folder("docs", str(tmp_path))
+
+    blobs = _manifest(tmp_path)["blobs"]
+    assert blobs["docs/a.pdf"]["etag"] == "1" and blobs["docs/b.pdf"]["etag"] == "2"
+
+    manager.failing.clear()
+    manager.downloads.clear()
+    manager.sync_folder("docs", str(tmp_path))
+    assert manager.downloads == ["docs/a.pdf"]
+
+
+def test_delete_removes_only_files_recorded_in_the_manifest(manager, tmp_path):
+    manager.blobs.update({"docs/a.pdf": (b"a", "1"), "docs/b.pdf": (b"b", "1")})
+    manager.sync_folder("docs", str(tmp_path))
+    (tmp_path / "notes.txt").write_text("mine")
+
+    del manager.blobs["docs/a.pdf"]
+    stats = manager.sync_folder("docs", str(tmp_path), delete=True)
+
+    assert stats["deleted"] == 1
+    assert sorted(os.listdir(tmp_path)) == [SYNC_MANIFEST_NAME, "b.pdf", "notes.txt"]
+    assert list(_manifest(tmp_path)["blobs"]) == ["docs/b.pdf"]
+
+
+def test_names_outside_the_directory_are_skipped(manager, tmp_path):
+    manager.blobs.update(
+        {
+            "docs/a.pdf": (b"a", "1"),
+            "docs/../evil.pdf": (b"x", "1"),
+            "docs/sub/../../evil.pdf": (b"x", "1"),
+            "docs//etc/evil.pdf": (b"x", "1"),
+        }
+    )
+
+    stats = manager.sync_folder("docs", str(tmp_path / "out"))
+
+    assert manager.downloads == ["docs/a.pdf"]
+    assert stats["listed"] == 1
+    assert sorted(os.listdir(tmp_path)) == ["out"]
+
+
+def test_manifest_of_another_folder_is_ignored(manager, tmp_path):
+    manager.blobs.update({"docs/a.pdf": (b"a", "1"), "other/a.pdf": (b"o", "1")})
+    manager.sync_folder("docs", str(tmp_path))
+
+    stats = manager.sync_folder("other", str(tmp_path))
+
+    assert stats["downloaded"] == 1
+    assert (tmp_path / "a.pdf").read_bytes() == b"o"
+    assert _manifest(tmp_path)["prefix"] == "other/"
+
+
+def test_single_blob_url_syncs_that_blob(manager, tmp_path):
+    manager.blobs.update({"docs/a.pdf": (b"a", "1"), "docs/a.pdf.bak": (b"b", "1")})
+
+    stats = manager.sync_folder(
+        "https://account.blob.core.windows.net/container/docs/a.pdf", str(tmp_path)
+    )
+
+    assert stats["downloaded"] == 1 and manager.downloads == ["docs/a.pdf"]
+    assert (tmp_path / "a.pdf").read_bytes() == b"a"
+
+
+def test_download_errors_are_aggregated_and_stats_recorded(manager, tmp_path):
+    manager.blobs.update({"a.pdf": (b"aaa", "1"), "b.pdf": (b"b", "1")})
+    manager.failing.update({"missing.pdf", "c.pdf"})
+    paths = {
+        name: str(tmp_path / name)
+        for name in ("a.pdf", "missing.pdf", "b.pdf", "c.pdf")
+    }
+
+    errors = manager._download_to_paths(paths)
+
+    assert sorted(errors) == ["c.pdf", "missing.pdf"]
+    assert all(isinstance(error, IOError) for error in errors.values())
+    assert sorted(os.listdir(tmp_path)) == ["a.pdf", "b.pdf"]
+    assert manager.last_download_stats["blobs"] == 2
+    assert manager.last_download_stats["bytes"] == 4
+    assert manager.download_stats["failed"] == 2
+
+
+def test_blobs_sharing_a_base_name_are_rejected(manager, tmp_path):
+    manager.blobs.update({"x/a.pdf": (b"x", "1"), "y/a.pdf": (b"y", "1")})
+
+    with pytest.raises(ValueError):
+        manager.download_blobs_to_folder(["x/a.pdf", "y/a.pdf"], str(tmp_path))
+    assert manager.downloads == []
+
+    paths = manager.download_blobs_to_folder(["x/a.pdf", "x/a.pdf"], str(tmp_path))
+    assert paths == {"x/a.pdf": str(tmp_path / "a.pdf")}
@@ -0,0 +1,55 @@
+import os
+
+import fitz
+import pytest
+
+from src.extractors.ocr_data_extractor import OCRHelper
+
+
+def _write_pdf(path, pages=1):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc = fitz.open()
+    for _ in range(pages):
+        doc.new_page(width=100, height=100)
+    doc.save(path)
+    doc.close()
+
+
+def test_pdf_files_of_subfolders_keep_their_folders(tmp_path):
+    _write_pdf(str(tmp_path / "in" / "a" / "invoice.pdf"))
+    _write_pdf(str(tmp_path / "in" / "b" / "invoice.pdf"), pages=2)
+
+    OCRHelper()._process_pdf_path(
+        str(tmp_path / "in"), str(tmp_path / "out"), recursive=True
+    )
+
+    assert sorted(os.listdir(tmp_path / "out" / "a")) == ["invoice-page-1.png"]
+    assert sorted(os.listdir(tmp_path / "out" / "b")) == [
+        "invoice-page-1.png",
+        "invoice-page-2.png",
+    ]
+
+
+def test_only_pdf_files_changed_since_their_images_are_rendered(tmp_path):
+    _write_pdf(str(tmp_path / "in" / "a.pdf"))
+    _write_pdf(str(tmp_path / "in" / "b.pdf"))
+    helper = OCRHelper()
+    helper._process_pdf_path(str(tmp_path / "in"), str(tmp_path / "out"))
+    images = {name: tmp_path / "out" / f"{name}-page-1.png" for name in "ab"}
+    for image in images.values():
+        os.utime(image, (1, 1))
+    os.utime(tmp_path / "in" / "a.pdf", (0, 0))
+
+    helper._process_pdf_path(
+        str(tmp_path / "in"), str(tmp_path / "out"), skip_unchanged=True
+    )
+
+    assert os.path.getmtime(images["a"]) == 1
+    assert os.path.getmtime(images["b"]) > 1
+
+
+def test_url_without_a_container_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        OCRHelper().extract_images_from_pdf(
+            "https://account.blob.core.windows.net/container/docs", str(tmp_path)
+        )
@@ -0,0 +1,133 @@
+import pytest
+from azure.cosmos import exceptions
+
+import src.ocr.cosmosDB_indexer as cosmosdb_indexer
+from src.ocr.cosmosDB_indexer import CosmosDBIndexer
+
+
+class _Container:
+    """Stub container whose batches fail with the given errors, in order, before succeeding."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.batches = []
+
+    def execute_item_batch(self, operations, partition_key):
+        self.batches.append([item["id"] for _, (item,) in operations])
+        if self.errors:
+            error = self.errors.pop(0)
+            if error is not None:
+                raise error
+        return [{"statusCode": 200, "requestCharge": 1.0} for _ in operations]
+
+
+def _batch_error(error_index, status, size, headers=None):
+    responses = [{"statusCode": 424} for _ in range(size)]
+    responses[error_index] = {"statusCode": status}
+    return exceptions.CosmosBatchOperationError(
+        error_index=error_index,
+        headers=dict(headers or {}, **{"x-ms-request-charge": "0.5"}),
+        status_code=207,
+        message="batch failed",
+        operation_responses=responses,
+    )
+
+
+@pytest.fixture
+def indexer(monkeypatch):
+    monkeypatch.setattr(cosmosdb_indexer, "CosmosClient", lambda *args, **kwargs: None)
+    sleeps = []
+    monkeypatch.setattr(cosmosdb_indexer.time, "sleep", sleeps.append)
+    indexer = CosmosDBIndexer("https://cosmos.example", "key")
+    indexer.sleeps = sleeps
+    return indexer
+
+
+def _items(count, partition="p"):
+    return [{"InvoiceId": str(i), "Customer": partition} for i in range(count)]
+
+
+def test_throttled_batches_wait_for_the_retry_after(indexer):
+    indexer.container = _Container(
+        _batch_error(0, 429, 3, {"x-ms-retry-after-ms": "250"})
+    )
+
+    stats = indexer.bulk_index_data(_items(3), partition_key_path="/Customer")
+
+    assert indexer.sleeps == [0.25]
+    assert len(indexer.container.batches) == 2
+    assert stats["indexed"] == 3 and stats["failed"] == 0
+    assert stats["request_charge"] == 3.5
+
+
+def test_failing_item_is_dropped_and_the_rest_re_queued(indexer):
+    indexer.container = _Container(_batch_error(1, 400, 3))
+
+    stats = indexer.bulk_index_data(_items(3), partition_key_path="/Customer")
+
+    assert indexer.container.batches == [["0", "1", "2"], ["0", "2"]]
+    assert stats["indexed"] == 2
+    assert stats["failed"] == 1 and stats["failed_ids"] == ["1"]
+    assert indexer.sleeps == []
+
+
+def test_failed_ids_and_skipped_items_are_accounted(indexer):
+    error = exceptions.CosmosHttpResponseError(status_code=403, message="forbidden")
+    indexer.container = _Container(None, error)
+    data = [
+        {"InvoiceId": "a1", "Customer": "a"},
+        {"InvoiceId": "a2", "Customer": "a"},
+        {"InvoiceId": "b1", "Customer": "b"},
+        {"InvoiceId": None, "Customer": "a"},
+        {"InvoiceId": "c1"},
+    ]
+
+    stats = indexer.bulk_index_data(
+        data, partition_key_path="/Customer", max_concurrency=1
+    )
+
+    assert stats["indexed"] == 2
+    assert stats["failed_ids"] == ["b1"] and stats["failed"] == 1
+    assert stats["skipped"] == 2
+
+
+def test_batches_are_split_by_size_and_halved_when_too_large(indexer, monkeypatch):
+    monkeypatch.setattr(cosmosdb_indexer, "MAX_BATCH_BYTES", 300)
+    too_large = exceptions.CosmosHttpResponseError(status_code=413, message="large")
+    indexer.container = _Container(too_large)
+    data = [{"InvoiceId": str(i), "Customer": "p", "Text": "x" * 40} for i in range(4)]
+
+    stats = indexer.bulk_index_data(
+        data, partition_key_path="/Customer", max_concurrency=1
+    )
+
+    assert indexer.container.batches == [["0", "1", "2"], ["0"], ["1", "2"], ["3"]]
+    assert stats["indexed"] == 4 and stats["failed"] == 0
+
+
+def test_each_half_of_a_split_batch_gets_its_own_retries(indexer):
+    too_large = exceptions.CosmosHttpResponseError(status_code=413, message="large")
+    throttled = exceptions.CosmosHttpResponseError(status_code=429, message="busy")
+    indexer.container = _Container(too_large, throttled, None, throttled)
+
+    stats = indexer.bulk_index_data(
+        _items(2), partition_key_path="/Customer", max_retries=1
+    )
+
+    assert indexer.container.batches == [["0", "1"], ["0"], ["0"], ["1"], ["1"]]
+    assert stats["indexed"] == 2 and stats["failed"] == 0
+
+
+def test_unexpected_error_fails_only_its_batch(indexer):
+    indexer.container = _Container(None, RuntimeError("connection reset"))
+    indexed = []
+    indexer.update_vector_index = indexed.extend
+    data = _items(2, partition="a") + [{"InvoiceId": "b1", "Customer": "b"}]
+
+    stats = indexer.bulk_index_data(
+        data, partition_key_path="/Customer", max_concurrency=1
+    )
+
+    assert stats["indexed"] == 2
+    assert stats["failed_ids"] == ["b1"] and stats["failed"] == 1
+    assert [item["id"] for item in indexed] == ["0", "1"]
@@ -0,0 +1,66 @@
+import io
+
+from PIL import ExifTags, Image
+
+from src.ocr.image_preprocessor import (
+    ImagePreprocessor,
+    detect_mime_type,
+    effective_size,
+    estimate_image_tokens,
+)
+
+
+def _png_bytes(size, mode="RGB", color=(200, 200, 200)):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_detect_mime_type():
+    assert detect_mime_type(_png_bytes((10, 10))) == "image/png"
+    assert detect_mime_type(b"\xff\xd8\xff\xe0rest") == "image/jpeg"
+    assert detect_mime_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+
+
+def test_effective_size_matches_model_scaling():
+    assert effective_size(4096, 8192) == (768, 1536)
+    assert effective_size(1700, 2200) == (768, 994)
+    assert effective_size(300, 200) == (300, 200)
+
+
+def test_estimate_image_tokens():
+    assert estimate_image_tokens(1024, 1024, detail="low") == 85
+    assert estimate_image_tokens(2048, 4096) == 85 + 170 * 6
+
+
+def test_process_downscales_and_picks_detail():
+    processed = ImagePreprocessor().process(_png_bytes((1700, 2200)))
+
+    assert processed["size"] == (768, 994)
+    assert processed["detail"] == "high"
+    assert processed["mime_type"] in ("image/jpeg", "image/webp", "image/png")
+    assert Image.open(io.BytesIO(processed["data"])).size == (768, 994)
+
+    small = ImagePreprocessor().process(_png_bytes((300, 200)))
+    assert small["detail"] == "low"
+    assert small["tokens_saved"] == 170
+
+
+def test_process_keeps_transparency_out_of_jpeg():
+    processed = ImagePreprocessor(formats=("JPEG", "PNG")).process(
+        _png_bytes((900, 900), mode="RGBA", color=(255, 0, 0, 128))
+    )
+
+    assert processed["mime_type"] == "image/png"
+
+
+def test_process_applies_the_exif_orientation():
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6  # rotated 90 degrees clockwise
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), (200, 200, 200)).save(buffer, format="JPEG", exif=exif)
+
+    processed = ImagePreprocessor().process(buffer.getvalue())
+
+    assert processed["size"] == (200, 300)
+    assert Image.open(io.BytesIO(processed["data"])).size == (200, 300)
@@ -0,0 +1,88 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from azure.ai.documentintelligence.models import Document
+
+from src.ocr.invoice_table import invoices_to_arrow, write_invoices_parquet
+
+
+def _invoice(invoice_id, total, items=()):
+    fields = {
+        "InvoiceId": {"type": "string", "content": invoice_id, "confidence": 0.9},
+        "InvoiceDate": {
+            "type": "date",
+            "content": "11/15/2019",
+            "valueDate": "2019-11-15",
+            "confidence": 0.8,
+        },
+        "InvoiceTotal": {
+            "type": "currency",
+            "content": f"${total}",
+            "valueCurrency": {"amount": total, "currencyCode": "USD"},
+            "confidence": 0.95,
+        },
+        "Items": {
+            "type": "array",
+            "valueArray": [
+                {
+                    "type": "object",
+                    "valueObject": {
+                        "Description": {"content": description, "confidence": 0.7},
+                        "Quantity": {"valueNumber": quantity, "confidence": 0.6},
+                    },
+                }
+                for description, quantity in items
+            ],
+        },
+    }
+    return Document({"docType": "invoice", "fields": fields, "spans": []})
+
+
+def test_invoices_to_arrow_builds_typed_columns():
+    header, items = invoices_to_arrow(
+        [
+            _invoice("A1", 110.0, [("Consulting", 2), ("Support", 1)]),
+            _invoice("B2", 5.5),
+        ],
+        invoice_keys=["a.pdf", "b.pdf"],
+    )
+
+    assert header.num_rows == 2
+    assert header.schema.field("InvoiceTotal").type == pa.float64()
+    assert header.schema.field("InvoiceDate").type == pa.date32()
+    assert header.column("InvoiceId").to_pylist() == ["A1", "B2"]
+    assert header.column("InvoiceTotal").to_pylist() == [110.0, 5.5]
+    assert header.column("InvoiceDate")[0].as_py() == datetime.date(2019, 11, 15)
+    assert header.column("CurrencyCode").to_pylist() == ["USD", "USD"]
+    assert header.column("VendorName").to_pylist() == [None, None]
+
+    assert items.num_rows == 2
+    assert items.column("invoice_key").to_pylist() == ["a.pdf", "a.pdf"]
+    assert items.column("item_index").to_pylist() == [0, 1]
+    assert items.column("Quantity").to_pylist() == [2.0, 1.0]
+    assert items.column("Description_confidence").to_pylist() == pytest.approx(
+        [0.7, 0.7]
+    )
+
+
+def test_write_invoices_parquet_round_trips(tmp_path):
+    header_path = tmp_path / "header.parquet"
+    items_path = tmp_path / "items.parquet"
+
+    counts = write_invoices_parquet(
+        [_invoice("A1", 1.0, [("Item", 3)])], str(header_path), str(items_path)
+    )
+
+    assert counts == (1, 1)
+    assert pq.read_table(header_path).column("InvoiceId").to_pylist() == ["A1"]
+    assert pq.read_table(items_path).column("Quantity").to_pylist() == [3.0]
+
+
+def test_invoice_keys_must_match_the_invoices():
+    invoices = [_invoice("A1", 1.0), _invoice("B2", 2.0)]
+
+    for invoice_keys in (["a.pdf"], ["a.pdf", "b.pdf", "c.pdf"]):
+        with pytest.raises(ValueError):
+            invoices_to_arrow(invoices, invoice_keys=invoice_keys)
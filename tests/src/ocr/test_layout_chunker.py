@@ -0,0 +1,83 @@
+from azure.ai.documentintelligence.models import AnalyzeResult
+
+from src.ocr.layout_chunker import chunk_layout, iter_layout_units
+
+
+def _paragraph(content, offset, page, role=None):
+    paragraph = {
+        "content": content,
+        "spans": [{"offset": offset, "length": len(content)}],
+        "boundingRegions": [{"pageNumber": page, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}],
+    }
+    if role:
+        paragraph["role"] = role
+    return paragraph
+
+
+def _result():
+    paragraphs = [
+        _paragraph("Header", 0, 1, role="pageHeader"),
+        _paragraph("Terms", 10, 1, role="sectionHeading"),
+        _paragraph("The buyer pays within thirty days.", 20, 1),
+        _paragraph("Qty", 60, 1),
+        _paragraph("Price", 70, 1),
+        _paragraph("Delivery", 100, 2, role="sectionHeading"),
+        _paragraph("Goods ship from the main warehouse.", 110, 2),
+    ]
+    table = {
+        "rowCount": 1,
+        "columnCount": 2,
+        "cells": [
+            {"rowIndex": 0, "columnIndex": 0, "content": "Qty"},
+            {"rowIndex": 0, "columnIndex": 1, "content": "Price"},
+        ],
+        "spans": [{"offset": 60, "length": 15}],
+        "boundingRegions": [{"pageNumber": 1, "polygon": [0, 0, 1, 0, 1, 1, 0, 1]}],
+    }
+    sections = [
+        {"elements": ["/paragraphs/0", "/sections/1", "/sections/2"]},
+        {"elements": ["/paragraphs/1", "/paragraphs/2", "/tables/0"]},
+        {"elements": ["/paragraphs/5", "/paragraphs/6"]},
+    ]
+    return AnalyzeResult(
+        {
+            "apiVersion": "2024-02-29-preview",
+            "modelId": "prebuilt-layout",
+            "stringIndexType": "textElements",
+            "content": "x" * 150,
+            "pages": [],
+            "paragraphs": paragraphs,
+            "tables": [table],
+            "sections": sections,
+        }
+    )
+
+
+def test_iter_layout_units_replaces_table_paragraphs_by_the_table():
+    refs = [unit["ref"] for unit in iter_layout_units(_result())]
+
+    assert "/paragraphs/3" not in refs and "/paragraphs/4" not in refs
+    assert refs.index("/tables/0") == refs.index("/paragraphs/2") + 1
+
+
+def test_chunk_layout_splits_on_sections_and_skips_page_furniture():
+    chunks = list(chunk_layout(_result(), chunk_size=100, source="doc.pdf"))
+
+    assert len(chunks) == 2
+    assert chunks[0]["content"].startswith("Terms\n\nThe buyer pays")
+    assert "| Qty | Price |" in chunks[0]["content"]
+    assert "Header" not in chunks[0]["content"]
+    assert chunks[0]["metadata"]["sections"] == ["Terms"]
+    assert chunks[1]["metadata"]["sections"] == ["Delivery"]
+    assert chunks[1]["metadata"]["page_numbers"] == [2]
+    assert chunks[0]["metadata"]["token_count"] > 0
+
+
+def test_chunk_layout_ids_are_stable_and_large_units_are_split():
+    first = [c["metadata"]["chunk_id"] for c in chunk_layout(_result(), source="a")]
+    second = [c["metadata"]["chunk_id"] for c in chunk_layout(_result(), source="a")]
+    assert first == second and len(set(first)) == len(first)
+
+    small = list(chunk_layout(_result(), chunk_size=3, source="a"))
+    assert all(chunk["metadata"]["token_count"] <= 4 for chunk in small)
+    assert len({c["metadata"]["chunk_id"] for c in small}) == len(small)
@@ -0,0 +1,52 @@
+import pytest
+
+from src.ocr.query_guard import CosmosQueryGuard, QueryRejectedError
+
+
+def test_select_star_is_projected_capped_and_parameterized():
+    guard = CosmosQueryGuard(fields=("Status", "Attachment", "CustomerName"))
+
+    compiled = guard.compile("```sql\nSELECT * FROM c WHERE c.Status = 'Open';\n```")
+
+    assert compiled["query"] == (
+        "SELECT TOP 50 c.id, c.Status, c.CustomerName FROM c WHERE c.Status = @p0"
+    )
+    assert compiled["parameters"] == [{"name": "@p0", "value": "Open"}]
+
+
+def test_existing_caps_are_clamped_and_property_names_kept():
+    guard = CosmosQueryGuard(max_items=10)
+
+    top = guard.compile('SELECT TOP 500 c.RequestId FROM c WHERE c["Status"] = "Done"')
+    limit = guard.compile(
+        "SELECT c.RequestId FROM c WHERE c.ProjectedWorkHours > 40 "
+        "ORDER BY c.CreatedDate OFFSET 0 LIMIT 1000"
+    )
+
+    assert top["query"] == 'SELECT TOP 10 c.RequestId FROM c WHERE c["Status"] = @p0'
+    assert limit["query"].endswith("OFFSET @p1 LIMIT 10")
+    assert [p["value"] for p in limit["parameters"]] == [40, 0]
+
+
+def test_explicit_heavy_fields_are_kept_and_cost_more():
+    guard = CosmosQueryGuard()
+
+    light = guard.compile("SELECT c.RequestId FROM c WHERE c.Status = 'Open'")
+    heavy = guard.compile("SELECT c.Attachment FROM c WHERE c.Status = 'Open'")
+
+    assert "c.Attachment" in heavy["query"]
+    assert heavy["estimated_cost"] > light["estimated_cost"]
+
+
+def test_invalid_or_expensive_queries_are_rejected():
+    guard = CosmosQueryGuard(max_cost=100)
+
+    with pytest.raises(QueryRejectedError):
+        guard.compile("DELETE FROM c")
+    with pytest.raises(QueryRejectedError):
+        guard.compile("SELECT * FROM c; SELECT * FROM c")
+    with pytest.raises(QueryRejectedError):
+        guard.compile("SELECT c.RequestId FROM c WHERE CONTAINS(c.RequestTitle, 'ai')")
+    for query in (None, "", "   "):
+        with pytest.raises(QueryRejectedError):
+            guard.compile(query)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from src.ocr.vector_index import LocalVectorIndex
+
+
+def _vectors(count=500, dimensions=32, seed=0):
+    return (
+        np.random.default_rng(seed)
+        .standard_normal((count, dimensions))
+        .astype(np.float32)
+    )
+
+
+def _exact_top_k(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k].tolist()
+
+
+def test_search_returns_exact_top_k_with_metadata():
+    vectors = _vectors()
+    index = LocalVectorIndex()
+    index.add(
+        [str(i) for i in range(len(vectors))],
+        vectors,
+        [{"n": i} for i in range(len(vectors))],
+    )
+
+    results = index.search(vectors[7], k=5)
+
+    assert [int(r["id"]) for r in results] == _exact_top_k(vectors, vectors[7], 5)
+    assert results[0]["metadata"] == {"n": 7}
+    assert results[0]["score"] >= results[-1]["score"]
+
+
+def test_add_replaces_existing_ids_and_remove_keeps_storage_contiguous():
+    index = LocalVectorIndex(initial_capacity=1)
+    index.add(["a", "b", "c"], np.eye(3))
+    index.add(["a"], [[0, 0, 1]], [{"updated": True}])
+
+    assert len(index) == 3
+    assert index.remove(["c", "unknown"]) == 1
+    assert [r["id"] for r in index.search([0, 0, 1], k=1)] == ["a"]
+    assert index.search([0, 1, 0], k=3, min_score=0.5) == [
+        {"id": "b", "score": 1.0, "metadata": None}
+    ]
+
+
+def test_quantized_index_ranks_like_the_exact_one():
+    vectors = _vectors()
+    index = LocalVectorIndex(quantize=True)
+    index.add([str(i) for i in range(len(vectors))], vectors)
+
+    results = index.search(vectors[3], k=3)
+
+    assert int(results[0]["id"]) == 3
+    assert abs(results[0]["score"] - 1.0) < 0.01
+
+
+def test_partitioned_index_trains_and_finds_neighbours():
+    vectors = _vectors(count=800)
+    index = LocalVectorIndex(n_lists=4, n_probe=4)
+    index.add([str(i) for i in range(len(vectors))], vectors)
+
+    results = index.search(vectors[11], k=5)
+
+    assert index.is_trained
+    assert [int(r["id"]) for r in results] == _exact_top_k(vectors, vectors[11], 5)
+    index.add(["new"], vectors[11:12] * 2)
+    assert "new" in {r["id"] for r in index.search(vectors[11], k=2, n_probe=1)}
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from src.resilience import (
+    CircuitOpenError,
+    ResiliencePolicy,
+    classify_error,
+    retry_delay_from_headers,
+)
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+def _failing(*errors, result="ok"):
+    calls = []
+
+    def function():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return function, calls
+
+
+def test_retry_delay_from_headers_takes_the_longest_delay():
+    assert retry_delay_from_headers({"retry-after-ms": "250"}) == 0.25
+    assert (
+        retry_delay_from_headers(
+            {"Retry-After": "1", "x-ratelimit-reset-tokens": "1m30s"}
+        )
+        == 90.0
+    )
+    assert retry_delay_from_headers({"content-type": "application/json"}) is None
+
+
+def test_classify_error():
+    assert classify_error(_http_error(429))[:2] == (True, 429)
+    assert classify_error(_http_error(400))[:2] == (False, 400)
+    assert classify_error(requests.ConnectionError())[:2] == (True, None)
+    assert classify_error(ValueError())[:2] == (False, None)
+
+
+def test_throttled_calls_are_retried_after_the_requested_delay():
+    policy = ResiliencePolicy(base_delay=0.0)
+    function, calls = _failing(
+        _http_error(429, {"retry-after-ms": "1"}), requests.Timeout()
+    )
+
+    assert policy.call("endpoint", function) == "ok"
+    assert len(calls) == 3
+    assert policy.stats()["endpoint"]["retries"] == 2
+
+
+def test_client_errors_are_not_retried():
+    policy = ResiliencePolicy(base_delay=0.0)
+    function, calls = _failing(_http_error(400))
+
+    with pytest.raises(requests.HTTPError):
+        policy.call("endpoint", function)
+    assert len(calls) == 1
+
+
+def test_circuit_opens_after_consecutive_failures():
+    policy = ResiliencePolicy(max_attempts=1, failure_threshold=2, recovery_timeout=60)
+    function, calls = _failing(*[_http_error(503)] * 3)
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            policy.call("endpoint", function)
+    with pytest.raises(CircuitOpenError):
+        policy.call("endpoint", function)
+
+    assert len(calls) == 2
+    assert policy.stats()["endpoint"]["circuit"] == "open"
+
+
+def test_trial_call_failing_without_a_status_reopens_the_circuit():
+    policy = ResiliencePolicy(
+        max_attempts=1, failure_threshold=1, recovery_timeout=0.05
+    )
+    with pytest.raises(requests.ConnectionError):
+        policy.call("endpoint", _failing(requests.ConnectionError())[0])
+
+    for error in (ValueError("bad JSON"), asyncio.CancelledError()):
+        time.sleep(0.06)
+        with pytest.raises(type(error)):
+            policy.call("endpoint", _failing(error)[0])
+        assert policy.stats()["endpoint"]["circuit"] == "open"
+
+    time.sleep(0.06)
+    assert policy.call("endpoint", lambda: "ok") == "ok"
+    assert policy.stats()["endpoint"]["circuit"] == "closed"